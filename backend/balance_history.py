@@ -0,0 +1,332 @@
+"""
+История оценок колеса баланса
+
+Раньше каждая оценка была отдельным документом balance_assessments с полными словарями
+scores и answers, а ростер куратора считал "начальной" предпоследнюю строку - после третьей
+оценки это уже не начальная. Теперь у пользователя один документ в balance_history:
+
+    {"user_id", "count",
+     "initial": <первая оценка>, "latest": <последняя>,   - для сравнения одним чтением
+     "entries": [<оценка>, ...]}                            - последние BALANCE_HISTORY_MAX
+
+Оценка: {"id", "type", "timestamp", "scores": <bytes>, "overall_score"} и, только если
+непустые, "answers" и "extra". scores упакованы по байту на категорию в порядке CATEGORIES:
+балл * 10 (0-100, одна цифра после запятой), 0xFF - категории нет в оценке. Новые
+категории добавляются только в конец CATEGORIES; неизвестные клиентские ключи и баллы,
+которые байтом не записать без потерь (7.25), хранятся как есть в "extra".
+
+Запись - один update_one с upsert ($push со $slice, $setOnInsert для initial).
+Старые документы balance_assessments переносятся командой:
+
+    python balance_history.py migrate
+
+Оценки с баллами вне 0-10 не переносятся: команда выводит их id, balance_assessments
+не меняется.
+
+Настройки через окружение:
+    BALANCE_HISTORY_MAX  - сколько оценок хранить в entries (по умолчанию 100)
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import typer
+from pymongo import ReplaceOne
+
+# Порядок категорий - формат хранения: только добавлять в конец
+CATEGORIES = (
+    "personal_boundaries", "relationship_parents", "relationship_friends", "self_confidence",
+    "emotions", "school_study", "hobbies", "health"
+)
+CATEGORY_INDEX = {name: index for index, name in enumerate(CATEGORIES)}
+MISSING = 0xFF
+SCALE = 10
+
+# Поля сводки initial / latest (без answers) - достаточно для сравнения
+SUMMARY_FIELDS = ("id", "type", "timestamp", "scores", "extra", "overall_score")
+
+
+# ========== Упаковка баллов ==========
+
+def validate_scores(scores: Dict[str, Any]):
+    """ValueError с категорией, если балл не число 0-10"""
+    for name, value in scores.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 10:
+            raise ValueError(f"Неверная оценка для {name}")
+
+
+def score_byte(value: Any) -> Optional[int]:
+    """Балл -> байт; None, если байтом его не записать без потерь"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    byte = round(value * SCALE)
+    if not 0 <= byte < MISSING or abs(byte - value * SCALE) > 1e-9:
+        return None
+    return byte
+
+
+def pack_scores(scores: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+    """{"category": балл} -> (байты в порядке CATEGORIES, неизвестные категории и баллы не по формату)"""
+    packed = bytearray([MISSING]) * len(CATEGORIES)
+    extra = {}
+    for name, value in scores.items():
+        index = CATEGORY_INDEX.get(name)
+        byte = score_byte(value) if index is not None else None
+        if byte is None:
+            extra[name] = value
+        else:
+            packed[index] = byte
+    return bytes(packed), extra
+
+
+def unpack_scores(packed: bytes, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    scores: Dict[str, Any] = {}
+    for index, byte in enumerate(packed):
+        if byte != MISSING:
+            # Целые баллы остаются целыми
+            scores[CATEGORIES[index]] = byte // SCALE if byte % SCALE == 0 else byte / SCALE
+    if extra:
+        scores.update(extra)
+    return scores
+
+
+def overall_score(scores: Dict[str, Any]) -> float:
+    return round(sum(scores.values()) / len(scores), 2) if scores else 0
+
+
+def make_entry(
+    type: str,
+    scores: Dict[str, Any],
+    answers: Optional[Dict[str, Any]] = None,
+    timestamp: Optional[datetime] = None,
+    assessment_id: Optional[str] = None,
+    overall: Optional[float] = None
+) -> dict:
+    packed, extra = pack_scores(scores)
+    entry = {
+        "id": assessment_id or str(uuid.uuid4()),
+        "type": type,
+        "timestamp": timestamp or datetime.utcnow(),
+        "scores": packed,
+        "overall_score": overall if overall is not None else overall_score(scores)
+    }
+    if extra:
+        entry["extra"] = extra
+    if answers:
+        entry["answers"] = answers
+    return entry
+
+
+def summary(entry: dict) -> dict:
+    return {field: entry[field] for field in SUMMARY_FIELDS if field in entry}
+
+
+def decode_entry(entry: dict, user_id: str) -> dict:
+    """Оценка в прежней форме документа balance_assessments (BalanceAssessment)"""
+    return {
+        "id": entry["id"],
+        "user_id": user_id,
+        "type": entry["type"],
+        "scores": unpack_scores(entry["scores"], entry.get("extra")),
+        "answers": entry.get("answers", {}),
+        "overall_score": entry.get("overall_score"),
+        "timestamp": entry["timestamp"]
+    }
+
+
+def snapshot(entry: dict) -> dict:
+    return {
+        "id": entry["id"],
+        "type": entry["type"],
+        "timestamp": entry["timestamp"],
+        "scores": unpack_scores(entry["scores"], entry.get("extra")),
+        "overall_score": entry.get("overall_score")
+    }
+
+
+def compare_document(document: dict) -> dict:
+    """Документ истории (хотя бы initial, latest, count) -> начальная, последняя и разница"""
+    initial = snapshot(document["initial"])
+    if document.get("count", 1) < 2:
+        # Сравнивать пока не с чем
+        return {
+            "user_id": document["user_id"], "assessments": document.get("count", 1),
+            "initial": initial, "latest": None, "deltas": None, "overall_delta": None
+        }
+    latest = snapshot(document["latest"])
+    deltas = {
+        name: round(latest["scores"][name] - value, 2)
+        for name, value in initial["scores"].items() if name in latest["scores"]
+    }
+    overall_delta = None
+    if initial["overall_score"] is not None and latest["overall_score"] is not None:
+        overall_delta = round(latest["overall_score"] - initial["overall_score"], 2)
+    return {
+        "user_id": document["user_id"], "assessments": document["count"],
+        "initial": initial, "latest": latest, "deltas": deltas, "overall_delta": overall_delta
+    }
+
+
+def history_document(user_id: str, entries: List[dict], max_entries: int) -> dict:
+    """Документ истории из оценок по возрастанию времени (перенос и тестовые данные)"""
+    return {
+        "user_id": user_id,
+        "count": len(entries),
+        "initial": summary(entries[0]),
+        "latest": summary(entries[-1]),
+        "entries": entries[-max_entries:],
+        "updated_at": datetime.utcnow()
+    }
+
+
+# ========== Хранилище ==========
+
+COMPARE_PROJECTION = {"_id": 0, "user_id": 1, "count": 1, "initial": 1, "latest": 1}
+
+
+class BalanceHistory:
+    def __init__(self, get_collection: Callable, max_entries: Optional[int] = None):
+        self._get_collection = get_collection
+        self.max_entries = max_entries or int(os.environ.get("BALANCE_HISTORY_MAX", "100"))
+
+    @property
+    def collection(self):
+        return self._get_collection()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("user_id", unique=True)
+
+    async def record(self, user_id: str, entry: dict) -> dict:
+        """Добавить оценку (make_entry) одним update_one"""
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {
+                "$push": {"entries": {"$each": [entry], "$slice": -self.max_entries}},
+                "$set": {"latest": summary(entry), "updated_at": datetime.utcnow()},
+                "$setOnInsert": {"initial": summary(entry)},
+                "$inc": {"count": 1}
+            },
+            upsert=True
+        )
+        return entry
+
+    async def exists(self, user_id: str) -> bool:
+        return await self.collection.find_one({"user_id": user_id}, {"_id": 1}) is not None
+
+    async def entries(self, user_id: str) -> List[dict]:
+        """Оценки пользователя, новые первыми"""
+        document = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "entries": 1})
+        if not document:
+            return []
+        return [decode_entry(entry, user_id) for entry in reversed(document["entries"])]
+
+    async def latest(self, user_id: str, type: Optional[str] = None) -> Optional[dict]:
+        if type is None:
+            # Последний элемент entries, а не сводка latest: в сводке нет answers
+            document = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "entries": {"$slice": -1}})
+            return decode_entry(document["entries"][-1], user_id) if document and document.get("entries") else None
+        for entry in await self.entries(user_id):
+            if entry["type"] == type:
+                return entry
+        return None
+
+    async def initial_scores(self, user_id: str) -> Dict[str, Any]:
+        document = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "initial": 1})
+        if not document:
+            return {}
+        return unpack_scores(document["initial"]["scores"], document["initial"].get("extra"))
+
+    async def compare(self, user_id: str) -> Optional[dict]:
+        document = await self.collection.find_one({"user_id": user_id}, COMPARE_PROJECTION)
+        return compare_document(document) if document else None
+
+    async def compare_many(self, user_ids: Iterable[str], collection=None) -> Dict[str, dict]:
+        """Сравнения для группы пользователей одним запросом ($in); collection - для чтения с secondary"""
+        collection = collection if collection is not None else self.collection
+        cursor = collection.find({"user_id": {"$in": list(user_ids)}}, COMPARE_PROJECTION)
+        return {document["user_id"]: compare_document(document) async for document in cursor}
+
+    async def latest_overall_many(self, user_ids: Iterable[str], collection=None) -> Dict[str, Optional[float]]:
+        """Общий балл последней оценки для группы пользователей одним запросом"""
+        collection = collection if collection is not None else self.collection
+        cursor = collection.find(
+            {"user_id": {"$in": list(user_ids)}}, {"_id": 0, "user_id": 1, "latest.overall_score": 1}
+        )
+        return {document["user_id"]: document["latest"].get("overall_score") async for document in cursor}
+
+
+async def migrate(db, max_entries: Optional[int] = None, batch_size: int = 1000) -> dict:
+    """
+    Перенести balance_assessments в balance_history (повторный запуск перезаписывает историю)
+
+    Оценка с баллом не числом 0-10 пропускается и попадает в skipped.
+
+    Returns:
+        {"users", "assessments", "skipped": [{"id", "user_id", "reason"}]}
+    """
+    history = BalanceHistory(lambda: db.balance_history, max_entries)
+    await history.ensure_indexes()
+    migrated = 0
+    assessments = 0
+    skipped: List[dict] = []
+    operations: List[ReplaceOne] = []
+    current_user, entries = None, []
+
+    def flush_user():
+        nonlocal migrated
+        if entries:
+            operations.append(ReplaceOne(
+                {"user_id": current_user}, history_document(current_user, entries, history.max_entries), upsert=True
+            ))
+            migrated += 1
+
+    cursor = db.balance_assessments.find({}, {"_id": 0}).sort([("user_id", 1), ("timestamp", 1)])
+    async for document in cursor:
+        if document["user_id"] != current_user:
+            flush_user()
+            current_user, entries = document["user_id"], []
+            if len(operations) >= batch_size:
+                await db.balance_history.bulk_write(operations, ordered=False)
+                operations = []
+        scores = document.get("scores") or {}
+        try:
+            validate_scores(scores)
+        except ValueError as e:
+            skipped.append({"id": document.get("id"), "user_id": current_user, "reason": str(e)})
+            continue
+        entries.append(make_entry(
+            document.get("type", "initial"), scores, document.get("answers"),
+            document.get("timestamp"), document.get("id"), document.get("overall_score")
+        ))
+        assessments += 1
+    flush_user()
+    if operations:
+        await db.balance_history.bulk_write(operations, ordered=False)
+    return {"users": migrated, "assessments": assessments, "skipped": skipped}
+
+
+# ========== CLI ==========
+
+cli = typer.Typer(help="История оценок колеса баланса")
+
+
+@cli.command("migrate")
+def migrate_command(
+    mongo_url: str = typer.Option("mongodb://localhost:27017", envvar="MONGO_URL"),
+    db_name: str = typer.Option("myteens_space", envvar="DB_NAME")
+):
+    """Перенести balance_assessments в balance_history"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    report = asyncio.run(migrate(AsyncIOMotorClient(mongo_url)[db_name]))
+    typer.echo(
+        f"Перенесена история оценок: {report['users']} пользователей, {report['assessments']} оценок, "
+        f"пропущено {len(report['skipped'])}"
+    )
+    for record in report["skipped"]:
+        typer.echo(f"  пропущена оценка {record['id']} пользователя {record['user_id']}: {record['reason']}")
+
+
+if __name__ == "__main__":
+    cli()
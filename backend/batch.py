@@ -0,0 +1,164 @@
+"""
+Пакетные запросы (POST /api/batch)
+
+При открытии мини-приложение по очереди запрашивает пользователя, прогресс, уведомления,
+последнюю оценку и чек-ины - пять round trip по мобильной сети. Batch принимает список
+под-запросов, выполняет их внутри приложения (тот же ASGI-стек: валидация, лимиты, ETag)
+и отдает все ответы одним JSON.
+
+Соседние GET выполняются параллельно через asyncio.gather; пишущие под-запросы идут
+строго по порядку и разделяют группы чтений. Под-запросы одного batch делят кэш
+(RequestCache): документ пользователя читается из MongoDB один раз; после каждой
+записи кэш сбрасывается.
+"""
+import asyncio
+import contextvars
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from starlette.types import ASGIApp, Message
+
+from responses import dumps
+
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", "20"))
+READ_METHODS = {"GET"}
+# Заголовки внешнего запроса, которые наследуют под-запросы
+INHERITED_HEADERS = {b"authorization", b"x-forwarded-for", b"x-real-ip", b"user-agent"}
+
+_current_cache: contextvars.ContextVar[Optional[Dict[Any, asyncio.Future]]] = contextvars.ContextVar(
+    "batch_request_cache", default=None
+)
+
+
+class RequestCache:
+    """
+    Кэш чтений на время одного batch
+
+    Вне batch просто выполняет загрузку. Внутри - запоминает future по ключу, и
+    параллельные под-запросы ждут одну и ту же загрузку вместо повторного похода в БД.
+    """
+
+    @staticmethod
+    def active() -> bool:
+        return _current_cache.get() is not None
+
+    @staticmethod
+    async def get_or_load(key: Any, load: Callable[[], Awaitable[Any]], aliases: Callable[[Any], List[Any]] = None):
+        cache = _current_cache.get()
+        if cache is None:
+            return await load()
+        future = cache.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            cache[key] = future
+            try:
+                value = await load()
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # ошибку получит тот, кто ждет; без ожидающих - не логировать
+                del cache[key]
+                raise
+            future.set_result(value)
+            # Тот же документ под другими ключами (пользователь по id и по telegram_id)
+            if value is not None and aliases:
+                for alias in aliases(value):
+                    if alias not in cache:
+                        cache[alias] = future
+            return value
+        return await future
+
+
+def _groups(requests: List[dict]) -> List[List[Tuple[int, dict]]]:
+    """Разбить под-запросы на шаги: группа соседних чтений или одна запись"""
+    steps: List[List[Tuple[int, dict]]] = []
+    for index, sub in enumerate(requests):
+        if sub["method"] in READ_METHODS and steps and steps[-1][0][1]["method"] in READ_METHODS:
+            steps[-1].append((index, sub))
+        else:
+            steps.append([(index, sub)])
+    return steps
+
+
+class BatchExecutor:
+    """Выполняет под-запросы через ASGI-приложение без сети"""
+
+    def __init__(self, app: ASGIApp, path: str):
+        self.app = app
+        self.path = path
+
+    async def run(self, scope: dict, requests: List[dict]) -> bytes:
+        """Выполнить под-запросы и собрать тело ответа {"responses": [...]}"""
+        results: List[Optional[bytes]] = [None] * len(requests)
+        cache: Dict[Any, asyncio.Future] = {}
+        token = _current_cache.set(cache)
+        try:
+            for step in _groups(requests):
+                rendered = await asyncio.gather(*(self._execute(scope, sub) for _, sub in step))
+                for (index, _), item in zip(step, rendered):
+                    results[index] = item
+                if step[0][1]["method"] not in READ_METHODS:
+                    # Чтения после записи должны видеть ее результат
+                    cache.clear()
+        finally:
+            _current_cache.reset(token)
+        return b'{"responses":[' + b",".join(results) + b"]}"
+
+    async def _execute(self, parent: dict, sub: dict) -> bytes:
+        url = urlsplit(sub["path"])
+        if url.path.rstrip("/") == self.path:
+            return self._render(sub, 400, {}, dumps({"detail": "Вложенный batch не поддерживается"}))
+
+        body = dumps(sub["body"]) if sub.get("body") is not None else b""
+        headers = [(name, value) for name, value in parent["headers"] if name in INHERITED_HEADERS]
+        headers += [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in (sub.get("headers") or {}).items()]
+        if body:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+
+        scope = {
+            **parent,
+            "method": sub["method"],
+            "path": url.path,
+            "raw_path": url.path.encode(),
+            "query_string": url.query.encode(),
+            "headers": headers
+        }
+        response = {"status": 500, "headers": {}, "chunks": []}
+        sent = False
+
+        async def receive() -> Message:
+            nonlocal sent
+            if sent:
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message: Message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {
+                    name.decode("latin-1"): value.decode("latin-1") for name, value in message.get("headers", [])
+                }
+            elif message["type"] == "http.response.body":
+                response["chunks"].append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # ServerErrorMiddleware уже отправил 500 (если успел) - остальные под-запросы не роняем
+            response["chunks"] = response["chunks"] or [dumps({"detail": "Internal Server Error"})]
+        return self._render(sub, response["status"], response["headers"], b"".join(response["chunks"]))
+
+    @staticmethod
+    def _render(sub: dict, status: int, headers: Dict[str, str], body: bytes) -> bytes:
+        """Ответ под-запроса; JSON-тело вставляется как есть, без повторного разбора"""
+        content_type = headers.get("content-type", "application/json")
+        if not body:
+            body = b"null"
+        elif not content_type.startswith("application/json"):
+            body = dumps(body.decode("utf-8", errors="replace"))
+        kept = {name: headers[name] for name in ("etag", "retry-after", "idempotency-replayed") if name in headers}
+        return (
+            b'{"id":' + dumps(sub.get("id")) + b',"status":' + str(status).encode()
+            + b',"headers":' + dumps(kept) + b',"body":' + body + b"}"
+        )
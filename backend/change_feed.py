@@ -0,0 +1,284 @@
+"""
+Лента изменений MongoDB для кэшей и проекций в памяти
+
+Кэши воркера (ревизии для ETag, telegram_id -> id) и рейтинги обновляются обработчиками
+API. Записи в обход API - скрипты вроде create_test_data.py, пересборка проекций
+(projections.py), другой сервис - их не видят: кэш остается устаревшим до TTL, рейтинг -
+до перезапуска. ChangeFeed читает change stream по users, lesson_progress и
+balance_history и раздает изменения подписанным потребителям.
+
+Позиция в потоке (resume token) сохраняется в коллекции change_feed_state раз в
+CHANGE_FEED_CHECKPOINT_INTERVAL секунд: после переподключения или перезапуска чтение
+продолжается с нее. Если история уже вытеснена из oplog, потребители получают Change с
+operation="reset" и сбрасывают состояние целиком.
+
+На standalone-сервере change streams нет - тогда лента опрашивает коллекции раз в
+CHANGE_FEED_POLL_INTERVAL секунд, читая только изменившееся:
+    - users - по индексу updated_at (каждая запись пользователя ставит его через
+      $currentDate вместе с $inc revision) и новые документы по _id
+    - lesson_progress и balance_history - новые документы по _id
+Удаления и изменения на месте без updated_at (в том числе новые оценки в существующей
+истории) опрос не видит; записи API меняют и users.updated_at.
+
+Настройки через окружение:
+    CHANGE_FEED_MODE                 - auto (по умолчанию), stream, poll или off
+    CHANGE_FEED_POLL_INTERVAL        - период опроса без change streams, сек (по умолчанию 5)
+    CHANGE_FEED_CHECKPOINT_INTERVAL  - период сохранения позиции, сек (по умолчанию 5)
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ("users", "lesson_progress", "balance_history")
+STATE_COLLECTION = "change_feed_state"
+MODES = ("auto", "stream", "poll", "off")
+
+# Коды ошибок MongoDB
+CHANGE_STREAMS_UNSUPPORTED = 40573  # standalone без oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+RESUME_TOKEN_NOT_FOUND = 280
+
+POLL_BATCH = 1000
+# Опрос users перечитывает последнюю секунду: запись с меньшим updated_at может стать
+# видна позже более новой
+POLL_LOOKBACK = timedelta(seconds=1)
+EPOCH = datetime(1970, 1, 1)
+
+
+class ChangeStreamsUnsupported(Exception):
+    pass
+
+
+@dataclass(slots=True)
+class Change:
+    collection: str
+    operation: str  # insert | update | replace | delete | reset
+    user_id: Optional[str] = None
+    # Верхнеуровневые измененные поля; None - неизвестно (новый или замененный документ)
+    updated_fields: Optional[FrozenSet[str]] = None
+    document: Optional[dict] = None
+
+    def touches(self, *fields: str) -> bool:
+        return self.updated_fields is None or any(name in self.updated_fields for name in fields)
+
+
+def change_from_stream(raw: dict) -> Change:
+    """Событие change stream -> Change"""
+    collection = raw["ns"]["coll"]
+    document = raw.get("fullDocument")
+    user_id = None
+    if document is not None:
+        user_id = document.get("id") if collection == "users" else document.get("user_id")
+    updated = None
+    description = raw.get("updateDescription")
+    if raw["operationType"] == "update" and description:
+        names = list(description.get("updatedFields", {})) + list(description.get("removedFields", []))
+        updated = frozenset(name.split(".", 1)[0] for name in names)
+    return Change(collection, raw["operationType"], user_id, updated, document)
+
+
+class ChangeFeed:
+    """Change stream (или опрос) по коллекциям с раздачей изменений подписчикам"""
+
+    def __init__(
+        self,
+        get_db: Callable,
+        name: str = "server",
+        collections: Tuple[str, ...] = WATCHED_COLLECTIONS,
+        mode: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+        checkpoint_interval: Optional[float] = None
+    ):
+        self._get_db = get_db
+        self.name = name
+        self.collections = collections
+        self.mode = mode or os.environ.get("CHANGE_FEED_MODE", "auto")
+        if self.mode not in MODES:
+            raise ValueError(f"CHANGE_FEED_MODE: одно из {', '.join(MODES)}")
+        self.poll_interval = poll_interval or float(os.environ.get("CHANGE_FEED_POLL_INTERVAL", "5"))
+        self.checkpoint_interval = checkpoint_interval or float(os.environ.get("CHANGE_FEED_CHECKPOINT_INTERVAL", "5"))
+        self._subscribers: List[Tuple[Callable[[Change], Any], Optional[Tuple[str, ...]]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._token: Optional[dict] = None
+        self._saved_at = 0.0
+        self.source: Optional[str] = None  # "change_stream" | "polling"
+        self.stats = {"changes": 0, "errors": 0, "resets": 0}
+
+    def subscribe(self, handler: Callable[[Change], Any], collections: Optional[Tuple[str, ...]] = None):
+        """handler(change) - обычная или async-функция; collections=None - все коллекции"""
+        self._subscribers.append((handler, collections))
+
+    async def start(self):
+        if self.mode != "off":
+            self._task = asyncio.create_task(self._run())
+
+    async def ensure_indexes(self):
+        if "users" in self.collections:
+            # Опрос без change streams (_poll_user_updates)
+            await self._get_db().users.create_index("updated_at")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._token is not None:
+            await self._save_token(force=True)
+
+    async def _dispatch(self, change: Change):
+        self.stats["changes"] += 1
+        for handler, collections in self._subscribers:
+            if change.operation != "reset" and collections is not None and change.collection not in collections:
+                continue
+            try:
+                result = handler(change)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Обработчик изменений {change.collection}/{change.operation} упал: {e}")
+
+    async def _run(self):
+        if self.mode in ("auto", "stream"):
+            try:
+                await self._watch()
+                return
+            except ChangeStreamsUnsupported:
+                if self.mode == "stream":
+                    logger.error("CHANGE_FEED_MODE=stream, но сервер MongoDB не поддерживает change streams")
+                    return
+                logger.info("Change streams недоступны (standalone) - лента изменений опросом")
+        await self._poll()
+
+    # ========== Change stream ==========
+
+    async def _watch(self):
+        db = self._get_db()
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(self.collections)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}]
+        self._token = await self._load_token()
+        opened = False
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup", resume_after=self._token) as stream:
+                    opened = True
+                    self.source = "change_stream"
+                    async for raw in stream:
+                        await self._dispatch(change_from_stream(raw))
+                        self._token = stream.resume_token
+                        await self._save_token()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    raise ChangeStreamsUnsupported() from e
+                if e.code in (CHANGE_STREAM_HISTORY_LOST, RESUME_TOKEN_NOT_FOUND) and self._token is not None:
+                    # Пропущенные изменения не восстановить - потребители сбрасывают все
+                    logger.warning(f"Позиция ленты изменений потеряна ({e.code}) - сброс кэшей")
+                    self._token = None
+                    self.stats["resets"] += 1
+                    await self._dispatch(Change("*", "reset"))
+                    continue
+                self.stats["errors"] += 1
+                logger.warning(f"Change stream прерван: {e}; переподключение через {self.poll_interval} с")
+            except (NotImplementedError, TypeError) as e:
+                # Драйвер без watch() (mongomock) - как standalone
+                if not opened:
+                    raise ChangeStreamsUnsupported() from e
+                raise
+            except PyMongoError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Change stream прерван: {e}; переподключение через {self.poll_interval} с")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _load_token(self) -> Optional[dict]:
+        try:
+            state = await self._get_db()[STATE_COLLECTION].find_one({"_id": self.name})
+        except PyMongoError as e:
+            logger.warning(f"Позиция ленты изменений не прочитана: {e}")
+            return None
+        return state.get("token") if state else None
+
+    async def _save_token(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._saved_at < self.checkpoint_interval:
+            return
+        self._saved_at = now
+        try:
+            await self._get_db()[STATE_COLLECTION].update_one(
+                {"_id": self.name},
+                {"$set": {"token": self._token, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning(f"Позиция ленты изменений не сохранена: {e}")
+
+    # ========== Опрос (standalone) ==========
+
+    async def _poll(self):
+        self.source = "polling"
+        watermarks: Dict[str, Any] = {}
+        updated: Optional[datetime] = None
+        seen: Dict[str, Tuple[Any, datetime]] = {}
+        while True:
+            try:
+                for collection in self.collections:
+                    watermarks[collection] = await self._poll_inserts(collection, watermarks.get(collection))
+                if "users" in self.collections:
+                    updated = await self._poll_user_updates(updated, seen)
+            except PyMongoError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Опрос изменений не удался: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll_user_updates(self, watermark: Optional[datetime], seen: Dict[str, Tuple[Any, datetime]]) -> datetime:
+        """
+        Пользователи с updated_at после watermark (с окном POLL_LOOKBACK назад)
+
+        seen - уже разосланные id -> (revision, updated_at) в окне: повторно они не
+        раздаются. Первый опрос только запоминает последнее updated_at.
+        """
+        users = self._get_db().users
+        if watermark is None:
+            last = await users.find_one({}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)])
+            return (last or {}).get("updated_at") or EPOCH
+
+        query = {"updated_at": {"$gte": watermark - POLL_LOOKBACK}}
+        async for document in users.find(query, {"_id": 0}).sort("updated_at", 1):
+            updated_at = document["updated_at"]
+            watermark = max(watermark, updated_at)
+            revision = document.get("revision")
+            if document["id"] in seen and seen[document["id"]][0] == revision:
+                continue
+            seen[document["id"]] = (revision, updated_at)
+            await self._dispatch(Change("users", "update", document["id"], None, document))
+
+        horizon = watermark - POLL_LOOKBACK
+        for user_id in [user_id for user_id, (_, updated_at) in seen.items() if updated_at < horizon]:
+            del seen[user_id]
+        return watermark
+
+    async def _poll_inserts(self, collection: str, watermark):
+        """Новые документы по возрастанию _id; первый опрос запоминает последний _id"""
+        documents = self._get_db()[collection]
+        if watermark is None:
+            last = await documents.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            return last["_id"] if last else 0
+        query = {"_id": {"$gt": watermark}} if watermark != 0 else {}
+        async for document in documents.find(query).sort("_id", 1).limit(POLL_BATCH):
+            watermark = document.pop("_id")
+            user_id = document.get("id") if collection == "users" else document.get("user_id")
+            await self._dispatch(Change(collection, "insert", user_id, None, document))
+        return watermark
+
+    def describe(self) -> dict:
+        return {"mode": self.mode, "source": self.source, "running": self._task is not None, **self.stats}
@@ -0,0 +1,164 @@
+"""
+Сжатие ответов (Brotli / GZip)
+
+Мини-приложение открывают в Telegram на мобильном интернете, а прогресс и ростер
+куратора - это десятки и сотни килобайт JSON с повторяющимися ключами. Middleware
+сжимает ответы, которые больше порога, кодировкой из Accept-Encoding клиента:
+br, если установлен пакет brotli, иначе gzip.
+
+Настройки через окружение:
+    COMPRESSION_MINIMUM_SIZE   - порог в байтах (по умолчанию 500)
+    COMPRESSION_GZIP_LEVEL     - уровень gzip 1-9 (по умолчанию 6)
+    COMPRESSION_BROTLI_QUALITY - качество brotli 0-11 (по умолчанию 4: динамические ответы)
+"""
+import gzip
+import io
+import os
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+# Уже сжатые или бинарные форматы повторно не жмем
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def parse_accept_encoding(value: str) -> Dict[str, float]:
+    """"gzip;q=0.8, br" -> {"gzip": 0.8, "br": 1.0}"""
+    result = {}
+    for item in value.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        result[name.strip().lower()] = quality
+    return result
+
+
+class _Encoder:
+    """Потоковый компрессор с единым интерфейсом для gzip и brotli"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._buffer = io.BytesIO()
+            self._gzip = gzip.GzipFile(mode="wb", fileobj=self._buffer, compresslevel=gzip_level, mtime=0)
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        if self.encoding == "br":
+            chunk = self._brotli.process(data) if data else b""
+            return chunk + self._brotli.finish() if final else chunk
+        if data:
+            self._gzip.write(data)
+        if final:
+            self._gzip.close()
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+
+class CompressionMiddleware:
+    """ASGI middleware: сжатие ответов больше minimum_size"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: Optional[int] = None,
+        gzip_level: Optional[int] = None,
+        brotli_quality: Optional[int] = None
+    ):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else int(os.environ.get("COMPRESSION_MINIMUM_SIZE", "500"))
+        self.gzip_level = gzip_level if gzip_level is not None else int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+        self.brotli_quality = (
+            brotli_quality if brotli_quality is not None else int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+        )
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        accepted = parse_accept_encoding(accept_encoding)
+        if brotli is not None and accepted.get("br", 0) > 0:
+            return "br"
+        if accepted.get("gzip", 0) > 0:
+            return "gzip"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        # None - решение еще не принято, False - ответ идет без сжатия
+        encoder = None
+
+        async def compressing_send(message: Message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                # Ждем первый кусок тела: по нему решаем, сжимать ли ответ
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if encoder is None:
+                headers = MutableHeaders(raw=list(start.get("headers", [])))
+                if not self._should_compress(start["status"], headers, body, more_body):
+                    await send(start)
+                    await send(message)
+                    encoder = False
+                    return
+                encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+                compressed = encoder.compress(body, final=not more_body)
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["content-length"]
+                else:
+                    headers["content-length"] = str(len(compressed))
+                start["headers"] = headers.raw
+                await send(start)
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+                return
+
+            if encoder is False:
+                await send(message)
+                return
+            await send({
+                "type": "http.response.body",
+                "body": encoder.compress(body, final=not more_body),
+                "more_body": more_body
+            })
+
+        await self.app(scope, receive, compressing_send)
+
+    def _should_compress(self, status: int, headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        if status < 200 or status in (204, 304) or "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        # Потоковые ответы без длины сжимаем всегда, остальные - от порога
+        length = headers.get("content-length")
+        size = int(length) if length is not None else (len(body) if not more_body else None)
+        return size is None or size >= self.minimum_size
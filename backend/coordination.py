@@ -0,0 +1,261 @@
+"""
+Координация состояния между воркерами
+
+При запуске нескольких воркеров (gunicorn / uvicorn --workers) все, что хранится в памяти
+процесса - кэши, счетчики, лимиты - у каждого воркера свое. Координатор дает общий слой:
+атомарные счетчики, ключи с TTL и рассылку событий инвалидации кэша всем воркерам.
+
+Бэкенд выбирается через COORDINATION_URL:
+    memory://             - в памяти процесса (тесты, один воркер)
+    redis://host:6379/0   - Redis-совместимый сервер (Redis, Valkey, KeyDB)
+"""
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "myteens:invalidate"
+
+# Token bucket одним атомарным скриптом: пополнить, списать, вернуть Retry-After
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(retry_after)
+"""
+
+
+class Coordinator:
+    """Общий интерфейс координатора"""
+
+    backend = "base"
+
+    def __init__(self):
+        self._handlers: List[Callable[[str], Any]] = []
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Атомарно увеличить счетчик; ttl (сек) задается при создании ключа"""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def take_token(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        """Token bucket: списать cost токенов, вернуть 0 или сколько секунд ждать"""
+        raise NotImplementedError
+
+    def subscribe(self, handler: Callable[[str], Any]):
+        """Подписаться на инвалидацию: handler(key) вызывается в каждом воркере"""
+        self._handlers.append(handler)
+
+    async def invalidate(self, key: str):
+        """Разослать событие инвалидации всем воркерам (включая текущий)"""
+        raise NotImplementedError
+
+    async def _dispatch(self, key: str):
+        for handler in self._handlers:
+            try:
+                result = handler(key)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"Ошибка обработчика инвалидации {key}: {e}")
+
+
+class InProcessCoordinator(Coordinator):
+    """Координатор в памяти процесса - для тестов и запуска в один воркер"""
+
+    backend = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def _alive(self, key: str):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return item
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        item = self._alive(key)
+        if item is None:
+            expires_at = time.monotonic() + ttl if ttl else None
+            value = amount
+        else:
+            value, expires_at = int(item[0]) + amount, item[1]
+        self._values[key] = (value, expires_at)
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._alive(key)
+        return None if item is None else str(item[0])
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def invalidate(self, key: str):
+        await self._dispatch(key)
+
+
+class RedisCoordinator(Coordinator):
+    """Координатор поверх Redis-совместимого сервера (нужен пакет redis)"""
+
+    backend = "redis"
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("Для COORDINATION_URL=redis://... установите пакет redis")
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._listener: Optional[asyncio.Task] = None
+        self._token_bucket = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @property
+    def redis(self):
+        """Клиент для модулей со своими структурами на том же сервере (рейтинги)"""
+        return self._redis
+
+    async def start(self):
+        await self._redis.ping()
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    await self._dispatch(message["data"])
+        finally:
+            await pubsub.close()
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await self._redis.close()
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        value = await self._redis.incrby(key, amount)
+        if ttl and value == amount:
+            await self._redis.pexpire(key, int(ttl * 1000))
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._redis.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def take_token(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        return float(await self._token_bucket(keys=[key], args=[rate, burst, cost]))
+
+    async def invalidate(self, key: str):
+        await self._redis.publish(INVALIDATION_CHANNEL, key)
+
+
+def create_coordinator(url: Optional[str] = None) -> Coordinator:
+    """Создать координатор по COORDINATION_URL"""
+    if not url or url.startswith("memory://"):
+        return InProcessCoordinator()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCoordinator(url)
+    raise ValueError(f"Неподдерживаемый COORDINATION_URL: {url}")
+
+
+class LocalCache:
+    """
+    LRU-кэш в памяти воркера, согласованный через координатор
+
+    Запись хранится локально; invalidate(key) рассылает событие, и каждый воркер
+    удаляет у себя namespace:key.
+    """
+
+    def __init__(self, coordinator: Coordinator, namespace: str, maxsize: int = 10000, ttl: Optional[float] = None):
+        self.coordinator = coordinator
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._prefix = f"{namespace}:"
+        coordinator.subscribe(self._on_invalidate)
+
+    def get(self, key: str, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._items[key]
+            return default
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._items[key] = (value, time.monotonic() + self.ttl if self.ttl else None)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def discard(self, key: str):
+        """Удалить запись только в текущем воркере"""
+        self._items.pop(key, None)
+
+    def clear(self):
+        """Очистить кэш только в текущем воркере"""
+        self._items.clear()
+
+    async def invalidate(self, key: str):
+        """Удалить запись во всех воркерах"""
+        self.discard(key)
+        await self.coordinator.invalidate(self._prefix + key)
+
+    def _on_invalidate(self, key: str):
+        if key.startswith(self._prefix):
+            self.discard(key[len(self._prefix):])
+
+    def __len__(self):
+        return len(self._items)
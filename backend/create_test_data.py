@@ -8,12 +8,22 @@ import uuid
 from datetime import datetime, timedelta
 import random
 import string
+import time
 
-# MongoDB подключение
-client = AsyncIOMotorClient('mongodb://localhost:27017')
-db = client['myteens_space']
+import typer
 
-async def create_curator():
+from balance_history import CATEGORIES as BALANCE_CATEGORIES, history_document, make_entry
+from lesson_catalog import load_catalog_file
+
+CATALOG = load_catalog_file()
+MODULE_LESSONS = dict(CATALOG.totals)
+
+def lesson_ids(module):
+    """ID уроков модуля из каталога: boundaries-w1-1, boundaries-w1-2, ..."""
+    return [lesson.id for lesson in CATALOG.modules[module].lessons]
+
+
+async def create_curator(db):
     """Создать куратора"""
     curator_id = str(uuid.uuid4())
     curator = {
@@ -33,7 +43,7 @@ async def create_curator():
     print(f"✅ Куратор создан: ID = {curator_id}")
     return curator_id
 
-async def generate_code(curator_id):
+async def generate_code(db, curator_id):
     """Сгенерировать код доступа"""
     # Генерируем уникальный 6-значный код
     code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
@@ -53,7 +63,7 @@ async def generate_code(curator_id):
     print(f"✅ Код для ученика создан: {code}")
     return code
 
-async def generate_curator_code(curator_id):
+async def generate_curator_code(db, curator_id):
     """Сгенерировать код для входа куратора"""
     code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
     
@@ -72,15 +82,221 @@ async def generate_curator_code(curator_id):
     print(f"✅ Код для куратора создан: {code}")
     return code
 
-async def main():
+class BatchWriter:
+    """
+    Пакетная запись документов через insert_many несколькими параллельными писателями
+
+    Документы копятся в буферах по коллекциям; полные пачки уходят в ограниченную
+    очередь, которую разбирают writers корутин - генерация не ждет каждой вставки.
+    """
+
+    def __init__(self, db, batch_size=2000, writers=8):
+        self.db = db
+        self.batch_size = batch_size
+        self.writers = writers
+        self.counts = {}
+        self._buffers = {}
+        self._queue = asyncio.Queue(maxsize=writers * 2)
+        self._tasks = []
+        self._error = None
+
+    async def __aenter__(self):
+        self._tasks = [asyncio.create_task(self._writer()) for _ in range(self.writers)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for collection, docs in self._buffers.items():
+            if docs:
+                await self._queue.put((collection, docs))
+        self._buffers = {}
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks)
+        if self._error and not exc_type:
+            raise self._error
+
+    async def add(self, collection, doc):
+        buffer = self._buffers.setdefault(collection, [])
+        buffer.append(doc)
+        if len(buffer) >= self.batch_size:
+            self._buffers[collection] = []
+            await self._queue.put((collection, buffer))
+
+    async def _writer(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self._error:
+                continue  # после ошибки только разбираем очередь, чтобы генератор не завис
+            collection, docs = item
+            try:
+                await self.db[collection].insert_many(docs, ordered=False)
+                self.counts[collection] = self.counts.get(collection, 0) + len(docs)
+            except Exception as e:
+                self._error = e
+
+
+# Распределения доли пройденных уроков (параметры beta-распределения)
+PROGRESS_DISTRIBUTIONS = {
+    "uniform": (1.0, 1.0),
+    "beginners": (1.2, 4.0),  # большинство в начале пути
+    "engaged": (4.0, 2.0)  # большинство прошло больше половины
+}
+
+MOODS = ["Усталость", "Грусть", "Норм", "Хорошо", "Супер"]
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+async def seed_cohorts(
+    db,
+    curators=1,
+    students_per_curator=10,
+    seed=None,
+    distribution="uniform",
+    months=0,
+    checkin_rate=0.5,
+    batch_size=2000,
+    writers=8
+):
+    """
+    Создать синтетические когорты для нагрузочного тестирования
+
+    Каждый ученик получает telegram_id, пройденные уроки (доля по distribution),
+    начальную оценку баланса (и финальную, если прошел больше 75%) и чек-ины
+    примерно в checkin_rate дней за последние months месяцев.
+
+    Returns:
+        {"curators": [curator_id, ...], "students": [{"id", "telegram_id", "curator_id"}, ...],
+         "counts": {collection: inserted}}
+    """
+    rng = random.Random(seed)
+    alpha, beta = PROGRESS_DISTRIBUTIONS[distribution]
+    now = datetime.utcnow()
+    history_days = max(months * 30, 1)
+    curator_ids, students = [], []
+
+    async with BatchWriter(db, batch_size, writers) as writer:
+        for c in range(curators):
+            curator_id = _uuid(rng)
+            curator_ids.append(curator_id)
+            await writer.add("users", {
+                "id": curator_id,
+                "name": f"Куратор {c + 1}",
+                "age": 30,
+                "role": "curator",
+                "created_at": now - timedelta(days=history_days),
+                "xp": 0,
+                "level": 1,
+                "streak": 0,
+                "achievements": [],
+                "notifications_enabled": True
+            })
+
+            for s in range(students_per_curator):
+                student_id = _uuid(rng)
+                telegram_id = str(100000000 + c * students_per_curator + s)
+                created_at = now - timedelta(days=history_days)
+                completion = rng.betavariate(alpha, beta)
+                xp = 0
+                completed_total = 0
+
+                for module, total in MODULE_LESSONS.items():
+                    completed = min(total, max(0, round(completion * total + rng.uniform(-1.5, 1.5))))
+                    completed_total += completed
+                    for position, lesson_id in enumerate(lesson_ids(module)[:completed + 1]):
+                        started_at = created_at + timedelta(
+                            days=rng.randint(0, history_days - 1), seconds=rng.randint(0, 86399)
+                        )
+                        if position == completed:
+                            await writer.add("lesson_progress", {
+                                "id": _uuid(rng),
+                                "user_id": student_id,
+                                "lesson_id": lesson_id,
+                                "module": module,
+                                "status": "in_progress",
+                                "started_at": started_at,
+                                "attempts": 1,
+                                "time_spent": 0,
+                                "answers": {}
+                            })
+                            continue
+                        score = rng.randint(50, 100)
+                        xp += score
+                        await writer.add("lesson_progress", {
+                            "id": _uuid(rng),
+                            "user_id": student_id,
+                            "lesson_id": lesson_id,
+                            "module": module,
+                            "status": "completed",
+                            "started_at": started_at,
+                            "completed_at": started_at + timedelta(minutes=rng.randint(2, 15)),
+                            "score": score,
+                            "xp_earned": score,
+                            "time_spent": rng.randint(120, 900),
+                            "answers": {},
+                            "attempts": rng.choice((1, 1, 1, 2))
+                        })
+
+                scores = {category: rng.randint(1, 10) for category in BALANCE_CATEGORIES}
+                assessments = [make_entry("initial", scores, timestamp=created_at, assessment_id=_uuid(rng))]
+                if completion > 0.75:
+                    final_scores = {k: min(10, v + rng.randint(0, 3)) for k, v in scores.items()}
+                    final_id = _uuid(rng)
+                    assessments.append(make_entry(
+                        "final", final_scores, timestamp=now - timedelta(days=rng.randint(0, 7)), assessment_id=final_id
+                    ))
+                await writer.add("balance_history", history_document(student_id, assessments, len(assessments)))
+
+                for day in range(months * 30):
+                    if rng.random() >= checkin_rate:
+                        continue
+                    await writer.add("checkins", {
+                        "id": _uuid(rng),
+                        "user_id": student_id,
+                        "mood": rng.choice(MOODS),
+                        "anxiety_level": rng.randint(1, 10),
+                        "sleep_hours": round(rng.uniform(5, 10), 1),
+                        "notes": "",
+                        "timestamp": created_at + timedelta(days=day, hours=rng.randint(7, 22))
+                    })
+
+                await writer.add("users", {
+                    "id": student_id,
+                    "telegram_id": telegram_id,
+                    "name": f"Ученик {c + 1}-{s + 1}",
+                    "age": rng.randint(12, 17),
+                    "role": "student",
+                    "curator_id": curator_id,
+                    "created_at": created_at,
+                    "xp": xp,
+                    "level": xp // 500 + 1,
+                    "streak": rng.randint(0, 14) if completed_total else 0,
+                    "achievements": [],
+                    "notifications_enabled": True,
+                    "last_activity": now - timedelta(days=rng.randint(0, 3))
+                })
+                students.append({"id": student_id, "telegram_id": telegram_id, "curator_id": curator_id})
+
+    return {"curators": curator_ids, "students": students, "counts": writer.counts}
+
+
+async def create_demo(mongo_url, db_name):
     print("\n🎯 Создание тестовых данных для MyTeens.Space\n")
     
+    # MongoDB подключение
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    
     # Создаем куратора
-    curator_id = await create_curator()
+    curator_id = await create_curator(db)
     
     # Генерируем коды
-    student_code = await generate_code(curator_id)
-    curator_code = await generate_curator_code(curator_id)
+    student_code = await generate_code(db, curator_id)
+    curator_code = await generate_curator_code(db, curator_id)
     
     print("\n" + "="*50)
     print("📋 ТЕСТОВЫЕ КОДЫ ДОСТУПА:")
@@ -90,5 +306,74 @@ async def main():
     print("\n💡 Введите любой из кодов на странице http://localhost:3001")
     print("="*50 + "\n")
 
+
+async def create_cohorts(mongo_url, db_name, drop, **options):
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    if drop:
+        for collection in ("users", "lesson_progress", "balance_history", "checkins"):
+            await db[collection].drop()
+
+    started = time.perf_counter()
+    result = await seed_cohorts(db, **options)
+    elapsed = time.perf_counter() - started
+    client.close()
+
+    total = sum(result["counts"].values())
+    print(f"\n✅ Создано {total} документов за {elapsed:.1f} с ({total / elapsed:.0f} док/с)")
+    for collection, count in sorted(result["counts"].items()):
+        print(f"   {collection}: {count}")
+
+
+cli = typer.Typer(help="Тестовые данные для MyTeens.Space")
+
+
+@cli.callback(invoke_without_command=True)
+def demo(
+    ctx: typer.Context,
+    mongo_url: str = typer.Option("mongodb://localhost:27017", envvar="MONGO_URL"),
+    db_name: str = typer.Option("myteens_space", envvar="DB_NAME")
+):
+    """Один куратор и коды доступа для ручной проверки (по умолчанию)"""
+    if ctx.invoked_subcommand is None:
+        asyncio.run(create_demo(mongo_url, db_name))
+
+
+@cli.command()
+def cohorts(
+    curators: int = typer.Option(10, help="Количество кураторов"),
+    students: int = typer.Option(30, help="Учеников на куратора"),
+    distribution: str = typer.Option("uniform", help="Доля пройденных уроков: " + ", ".join(PROGRESS_DISTRIBUTIONS)),
+    months: int = typer.Option(3, help="Месяцев истории чек-инов"),
+    checkin_rate: float = typer.Option(0.5, help="Вероятность чек-ина в день"),
+    seed: int = typer.Option(42, help="Seed для воспроизводимости"),
+    batch_size: int = typer.Option(2000, help="Документов в одном insert_many"),
+    writers: int = typer.Option(8, help="Параллельных писателей"),
+    drop: bool = typer.Option(False, help="Очистить коллекции перед генерацией"),
+    mongo_url: str = typer.Option("mongodb://localhost:27017", envvar="MONGO_URL"),
+    db_name: str = typer.Option("myteens_space", envvar="DB_NAME")
+):
+    """
+    Синтетические когорты для профилирования и планирования мощности
+
+    Например, ~1 млн документов: --curators 100 --students 100 --months 6
+    """
+    if distribution not in PROGRESS_DISTRIBUTIONS:
+        raise typer.BadParameter(f"Неизвестное распределение: {distribution}")
+    asyncio.run(create_cohorts(
+        mongo_url,
+        db_name,
+        drop,
+        curators=curators,
+        students_per_curator=students,
+        seed=seed,
+        distribution=distribution,
+        months=months,
+        checkin_rate=checkin_rate,
+        batch_size=batch_size,
+        writers=writers
+    ))
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    cli()
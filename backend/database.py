@@ -0,0 +1,139 @@
+"""
+Настройка подключения к MongoDB
+
+Параметры пула, таймауты и сжатие задаются через переменные окружения:
+    MONGO_MAX_POOL_SIZE                 - максимум соединений на сервер (100)
+    MONGO_MIN_POOL_SIZE                 - сколько держать открытыми заранее (0)
+    MONGO_MAX_IDLE_TIME_MS              - закрывать простаивающие соединения
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         - ожидание свободного соединения
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS
+    MONGO_COMPRESSORS                   - например "zstd,snappy,zlib"
+    MONGO_ANALYTICS_READ_PREFERENCE     - куда читать аналитику (secondaryPreferred)
+    MONGO_ANALYTICS_MAX_STALENESS_S     - допустимое отставание secondary, сек
+
+Клиент подписан на события пула (PoolStats); дополнительные слушатели (статистика
+запросов, см. query_stats.py) передаются в mongo_client_options.
+
+Записи и чтение собственных данных пользователя идут в primary, аналитические
+чтения (список учеников куратора, статистика) - через analytics_database().
+"""
+import os
+from collections import defaultdict
+from typing import Dict, Optional
+
+from pymongo import monitoring
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+INT_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Счетчики пула соединений по серверам (события PyMongo CMAP)"""
+
+    def __init__(self):
+        self.servers = defaultdict(lambda: {
+            "open": 0,
+            "checked_out": 0,
+            "created": 0,
+            "checkout_failures": 0,
+            "cleared": 0
+        })
+
+    def _server(self, event):
+        return self.servers["%s:%s" % event.address]
+
+    def pool_created(self, event):
+        self._server(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._server(event)["cleared"] += 1
+
+    def pool_closed(self, event):
+        self.servers.pop("%s:%s" % event.address, None)
+
+    def connection_created(self, event):
+        stats = self._server(event)
+        stats["open"] += 1
+        stats["created"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._server(event)["open"] -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._server(event)["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        self._server(event)["checked_out"] += 1
+
+    def connection_checked_in(self, event):
+        self._server(event)["checked_out"] -= 1
+
+    def snapshot(self) -> Dict:
+        return {address: dict(stats) for address, stats in self.servers.items()}
+
+
+pool_stats = PoolStats()
+
+
+def mongo_client_options(env=os.environ, listeners=()) -> Dict:
+    """Опции AsyncIOMotorClient из переменных окружения"""
+    options = {"event_listeners": [pool_stats, *listeners]}
+    for option, name in INT_OPTIONS.items():
+        if env.get(name):
+            options[option] = int(env[name])
+    if env.get("MONGO_COMPRESSORS"):
+        options["compressors"] = env["MONGO_COMPRESSORS"]
+    if env.get("MONGO_ZLIB_LEVEL"):
+        options["zlibCompressionLevel"] = int(env["MONGO_ZLIB_LEVEL"])
+    return options
+
+
+def analytics_read_preference(env=os.environ):
+    """Read preference для аналитических чтений (по умолчанию secondaryPreferred)"""
+    mode = read_pref_mode_from_name(env.get("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred"))
+    max_staleness = int(env.get("MONGO_ANALYTICS_MAX_STALENESS_S", "-1"))
+    return make_read_preference(mode, None, max_staleness=max_staleness)
+
+
+def analytics_database(db, env=os.environ):
+    """Тот же пул соединений, но чтение с учетом analytics read preference"""
+    return db.client.get_database(db.name, read_preference=analytics_read_preference(env))
+
+
+def describe_client(client, analytics_db=None) -> Dict:
+    """Настройки и состояние пула для /api/metrics"""
+    options = client.options
+    pool = options.pool_options
+    info = {
+        "pool": {
+            "max_size": pool.max_pool_size,
+            "min_size": pool.min_pool_size,
+            "max_idle_time_s": pool.max_idle_time_seconds,
+            "wait_queue_timeout_s": pool.wait_queue_timeout,
+            "connect_timeout_s": pool.connect_timeout,
+            "socket_timeout_s": pool.socket_timeout,
+        },
+        "server_selection_timeout_s": options.server_selection_timeout,
+        "compressors": list(options._options.get("compressors", [])),
+        "servers": pool_stats.snapshot()
+    }
+    if analytics_db is not None:
+        info["analytics_read_preference"] = analytics_db.read_preference.document
+    return info
@@ -0,0 +1,265 @@
+"""
+Монеты, самоцветы, инвентарь и энергия - атомарные изменения на сервере
+
+POST /sync/progress перезаписывал coins, gems, energy и весь inventory значениями из
+localStorage: большая запись на каждую синхронизацию и "последний пишущий выигрывает"
+между устройствами - покупка на одном устройстве пропадала после синхронизации другого.
+Теперь экономикой владеет сервер: каждая операция - один условный update_one с $inc
+по балансу и по предмету, а условие в фильтре не дает уйти в минус:
+
+    покупка:  {"id": u, "coins": {"$gte": 300}} -> $inc coins: -300, inventory.streak_shield: 1
+    предмет:  {"id": u, "inventory.hint_pack": {"$gte": 1}} -> $inc inventory.hint_pack: -1
+
+Цены и действие предметов - в ITEMS (те же, что в Shop.tsx), цена клиента не учитывается.
+
+Энергия не пересчитывается по таймеру и не перезаписывается синхронизацией: в документе
+лежит запас energy на момент energy_updated_at, текущее значение считается при чтении -
++1 за каждые ENERGY_REGEN_SECONDS, не больше ENERGY_MAX (как в EnergySystem.tsx).
+Списание и пополнение записывают новый запас и момент, с которого идет восстановление,
+с условием, что документ не изменился с чтения (иначе - повтор по свежему документу).
+Нет energy_updated_at - энергия еще из снимков клиента: она считается текущей, а первая
+серверная операция закрепляет ее ($min по energy_updated_at).
+
+Настройки через окружение:
+    ENERGY_MAX             - максимум энергии (по умолчанию 100)
+    ENERGY_REGEN_SECONDS   - секунд на единицу энергии (по умолчанию 60)
+    ECONOMY_MAX_REWARD     - сколько монет и самоцветов можно начислить за один запрос (по умолчанию 500)
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+ENERGY_MAX = int(os.environ.get("ENERGY_MAX", "100"))
+ENERGY_REGEN_SECONDS = float(os.environ.get("ENERGY_REGEN_SECONDS", "60"))
+CURRENCIES = ("coins", "gems")
+# Попыток условной записи энергии при параллельных изменениях
+ENERGY_ATTEMPTS = 3
+
+WALLET_PROJECTION = {
+    "_id": 0, "id": 1, "coins": 1, "gems": 1, "energy": 1, "energy_updated_at": 1, "inventory": 1, "revision": 1
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Item:
+    price: int
+    currency: str
+    energy: int = 0  # сколько энергии дает использование
+    streak_protection: bool = False
+
+
+# Каталог магазина (Shop.tsx); xp_booster и hint_pack действуют на клиенте и только расходуются
+ITEMS: Dict[str, Item] = {
+    "energy_boost": Item(price=100, currency="coins", energy=50),
+    "xp_booster": Item(price=200, currency="coins"),
+    "streak_shield": Item(price=300, currency="coins", streak_protection=True),
+    "hint_pack": Item(price=150, currency="coins"),
+    "mega_energy": Item(price=5, currency="gems", energy=100),
+}
+
+
+class EconomyError(Exception):
+    """Операцию нельзя выполнить; status - HTTP-код для ответа"""
+
+    def __init__(self, message: str, status: int = 409):
+        super().__init__(message)
+        self.status = status
+
+
+class UserNotFound(EconomyError):
+    def __init__(self):
+        super().__init__("Пользователь не найден", 404)
+
+
+# ========== Энергия ==========
+
+def current_energy(user: dict, now: datetime) -> Tuple[int, datetime]:
+    """(энергия сейчас, момент, от которого идет восстановление)"""
+    stored = user.get("energy", ENERGY_MAX)
+    updated_at = user.get("energy_updated_at")
+    if updated_at is None or stored >= ENERGY_MAX:
+        return stored, now
+    ticks = int((now - updated_at).total_seconds() // ENERGY_REGEN_SECONDS)
+    if stored + ticks >= ENERGY_MAX:
+        return ENERGY_MAX, now
+    # Неполный интервал не теряется: отсчет продолжается с начала текущего тика
+    return stored + ticks, updated_at + timedelta(seconds=ticks * ENERGY_REGEN_SECONDS)
+
+
+def energy_fields(value: int, since: datetime) -> Dict[str, Any]:
+    return {"energy": value, "energy_updated_at": since}
+
+
+def energy_guard(user: dict) -> Dict[str, Any]:
+    """Условие "энергия не менялась с чтения" для фильтра update_one"""
+    return {
+        field: user[field] if field in user else {"$exists": False}
+        for field in ("energy", "energy_updated_at")
+    }
+
+
+def wallet(user: dict, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Кошелек для ответа: энергия - текущая, с временем до полного восстановления"""
+    now = now or datetime.utcnow()
+    energy, since = current_energy(user, now)
+    full_in = 0.0
+    if energy < ENERGY_MAX:
+        full_in = (ENERGY_MAX - energy) * ENERGY_REGEN_SECONDS - (now - since).total_seconds()
+    return {
+        "user_id": user.get("id"),
+        "coins": user.get("coins", 0),
+        "gems": user.get("gems", 0),
+        "energy": energy,
+        "energy_max": ENERGY_MAX,
+        "energy_full_in_seconds": max(0, round(full_in)),
+        "inventory": user.get("inventory") or {}
+    }
+
+
+def catalog() -> Dict[str, Dict[str, Any]]:
+    return {
+        item_id: {"price": item.price, "currency": item.currency, "energy": item.energy,
+                  "streak_protection": item.streak_protection}
+        for item_id, item in ITEMS.items()
+    }
+
+
+def get_item(item_id: str) -> Item:
+    item = ITEMS.get(item_id)
+    if item is None:
+        raise EconomyError(f"Неизвестный предмет: {item_id}", 404)
+    return item
+
+
+def import_fields(user: dict, snapshot: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """
+    Кошелек из снимка localStorage (POST /sync/progress) - только пока сервер им не владеет
+
+    Возвращает поля для $set: пусто, если у пользователя уже есть energy_updated_at.
+    """
+    if "energy_updated_at" in user:
+        return {}
+    fields = {name: snapshot[name] for name in ("coins", "gems", "inventory") if snapshot.get(name) is not None}
+    energy = snapshot.get("energy")
+    fields.update(energy_fields(min(energy, ENERGY_MAX) if energy is not None else user.get("energy", ENERGY_MAX), now))
+    return fields
+
+
+# ========== Операции ==========
+
+class Economy:
+    """Условные обновления users: $inc с проверкой баланса в фильтре"""
+
+    def __init__(self, get_users: Callable, max_reward: Optional[int] = None):
+        self._get_users = get_users
+        self.max_reward = max_reward or int(os.environ.get("ECONOMY_MAX_REWARD", "500"))
+
+    @property
+    def users(self):
+        return self._get_users()
+
+    async def get(self, user_id: str) -> dict:
+        user = await self.users.find_one({"id": user_id}, WALLET_PROJECTION)
+        if user is None:
+            raise UserNotFound()
+        return user
+
+    async def _find_and_update(self, query: dict, update: dict) -> Optional[dict]:
+        """Документ после условного обновления или None, если условие не совпало"""
+        # _id в проекции: документ после $inc ищется по _id, а не по условию, которому он
+        # уже может не соответствовать (mongomock без _id перечитывает по исходному фильтру)
+        user = await self.users.find_one_and_update(
+            query, update, projection={**WALLET_PROJECTION, "_id": 1}, return_document=ReturnDocument.AFTER
+        )
+        if user is not None:
+            user.pop("_id", None)
+        return user
+
+    async def _update(self, query: dict, update: dict, failure: str) -> dict:
+        """Условный $inc; не совпало условие - UserNotFound или EconomyError(failure)"""
+        update.setdefault("$inc", {})["revision"] = 1
+        update["$currentDate"] = {"updated_at": True}
+        user = await self._find_and_update(query, update)
+        if user is None:
+            if await self.users.find_one({"id": query["id"]}, {"_id": 1}) is None:
+                raise UserNotFound()
+            raise EconomyError(failure)
+        return user
+
+    async def purchase(self, user_id: str, item_id: str, quantity: int = 1) -> dict:
+        item = get_item(item_id)
+        cost = item.price * quantity
+        return await self._update(
+            {"id": user_id, item.currency: {"$gte": cost}},
+            {
+                "$inc": {item.currency: -cost, f"inventory.{item_id}": quantity},
+                "$min": {"energy_updated_at": datetime.utcnow()}
+            },
+            f"Недостаточно {item.currency}: нужно {cost}"
+        )
+
+    async def earn(self, user_id: str, coins: int = 0, gems: int = 0) -> dict:
+        """Награда клиента (мини-игры, квесты): только положительный $inc, не больше max_reward"""
+        if not (0 <= coins <= self.max_reward and 0 <= gems <= self.max_reward) or not coins + gems:
+            raise EconomyError(f"Награда от 1 до {self.max_reward} монет или самоцветов", 400)
+        return await self._update(
+            {"id": user_id},
+            {"$inc": {"coins": coins, "gems": gems}, "$min": {"energy_updated_at": datetime.utcnow()}},
+            "Пользователь не найден"
+        )
+
+    async def use_item(self, user_id: str, item_id: str) -> dict:
+        item = get_item(item_id)
+        missing = f"Нет предмета {item_id}"
+        if not item.energy:
+            update: Dict[str, Any] = {
+                "$inc": {f"inventory.{item_id}": -1}, "$min": {"energy_updated_at": datetime.utcnow()}
+            }
+            if item.streak_protection:
+                update["$set"] = {"streakProtection": True}
+            return await self._update({"id": user_id, f"inventory.{item_id}": {"$gte": 1}}, update, missing)
+
+        # Энергия зависит от текущего значения - условие и на предмет, и на неизменность энергии
+        for _ in range(ENERGY_ATTEMPTS):
+            user = await self.get(user_id)
+            if (user.get("inventory") or {}).get(item_id, 0) < 1:
+                raise EconomyError(missing)
+            now = datetime.utcnow()
+            energy, since = current_energy(user, now)
+            energy = min(ENERGY_MAX, energy + item.energy)
+            updated = await self._find_and_update(
+                {"id": user_id, f"inventory.{item_id}": {"$gte": 1}, **energy_guard(user)},
+                {
+                    "$inc": {f"inventory.{item_id}": -1, "revision": 1},
+                    "$currentDate": {"updated_at": True},
+                    "$set": energy_fields(energy, now if energy >= ENERGY_MAX else since)
+                }
+            )
+            if updated is not None:
+                return updated
+        raise EconomyError("Энергия менялась параллельно, повторите запрос")
+
+    async def spend_energy(self, user_id: str, amount: int) -> dict:
+        if amount < 1:
+            raise EconomyError("amount должен быть больше 0", 400)
+        for _ in range(ENERGY_ATTEMPTS):
+            user = await self.get(user_id)
+            now = datetime.utcnow()
+            energy, since = current_energy(user, now)
+            if energy < amount:
+                raise EconomyError(f"Недостаточно энергии: есть {energy}, нужно {amount}")
+            # С полной энергии восстановление начинается с момента списания
+            updated = await self._find_and_update(
+                {"id": user_id, **energy_guard(user)},
+                {
+                    "$set": energy_fields(energy - amount, since),
+                    "$inc": {"revision": 1},
+                    "$currentDate": {"updated_at": True}
+                }
+            )
+            if updated is not None:
+                return updated
+        raise EconomyError("Энергия менялась параллельно, повторите запрос")
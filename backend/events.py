@@ -0,0 +1,113 @@
+"""
+Журнал событий прогресса
+
+lesson_progress, users.xp и balance_history меняются на месте, истории нет - ошибку
+в формуле XP или уровня нельзя пересчитать задним числом. Обработчики дополнительно
+пишут неизменяемые события в коллекцию events; проекции (projections.py) заново
+собирают из них XP, уровень и статистику пользователя.
+
+Запись групповая: события от параллельных запросов копятся EVENTS_LINGER_MS миллисекунд
+(или до EVENTS_BATCH_SIZE штук) и уходят одним insert_many. append() не ждет записи -
+обработчик не платит за журнал задержкой; потерять события можно только при падении
+процесса в это окно, close() при остановке дописывает остаток. Ошибка записи не роняет
+запросы (состояние в users / lesson_progress уже изменено) - она логируется и
+учитывается в stats["failed"].
+
+Настройки через окружение:
+    EVENTS_BATCH_SIZE  - событий в одном insert_many (по умолчанию 500)
+    EVENTS_LINGER_MS   - сколько ждать соседние события перед записью (по умолчанию 2)
+"""
+import asyncio
+import contextvars
+import logging
+import os
+from datetime import datetime
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Типы событий
+LESSON_STARTED = "lesson_started"
+LESSON_COMPLETED = "lesson_completed"
+CHECKIN = "checkin"
+ASSESSMENT = "assessment"
+# Абсолютные значения: синхронизация из localStorage и импорт состояния до журнала
+PROGRESS_SYNCED = "progress_synced"
+STATE_IMPORTED = "state_imported"
+
+EVENT_TYPES = {LESSON_STARTED, LESSON_COMPLETED, CHECKIN, ASSESSMENT, PROGRESS_SYNCED, STATE_IMPORTED}
+
+
+def make_event(kind: str, user_id: str, /, **data) -> dict:
+    """Документ события; поля data - произвольные (в том числе "type" оценки)"""
+    if kind not in EVENT_TYPES:
+        raise ValueError(f"Неизвестный тип события: {kind}")
+    return {"type": kind, "user_id": user_id, "at": datetime.utcnow(), "data": data}
+
+
+class EventLog:
+    """Журнал событий с групповой записью"""
+
+    def __init__(self, get_collection: Callable, batch_size: Optional[int] = None, linger: Optional[float] = None):
+        self._get_collection = get_collection
+        self.batch_size = batch_size or int(os.environ.get("EVENTS_BATCH_SIZE", "500"))
+        self.linger = linger if linger is not None else float(os.environ.get("EVENTS_LINGER_MS", "2")) / 1000
+        self._pending: List[dict] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: set = set()
+        self.stats = {"appended": 0, "batches": 0, "failed": 0}
+
+    @property
+    def collection(self):
+        return self._get_collection()
+
+    async def ensure_indexes(self):
+        # Проекции читают события пользователя по времени at; _id - только при равном at:
+        # ObjectId разных воркеров внутри секунды упорядочены случайной частью, а не временем
+        await self.collection.create_index([("user_id", 1), ("at", 1), ("_id", 1)])
+
+    def append(self, kind: str, user_id: str, /, **data):
+        self.append_many([make_event(kind, user_id, **data)])
+
+    def append_many(self, events: List[dict]):
+        """Добавить события в ближайшую пачку (запись - в фоне)"""
+        if not events:
+            return
+        self._pending.extend(events)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            # Пустой контекст: запись пачки не относится ни к одному из запросов
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self._flush, context=contextvars.Context())
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # create_task(context=...) - только с Python 3.11
+            task = contextvars.Context().run(asyncio.create_task, self._write(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _write(self, documents: List[dict]):
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+            self.stats["appended"] += len(documents)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["failed"] += len(documents)
+            logger.error(f"Журнал событий: не записано {len(documents)} событий: {e}")
+
+    async def flush(self):
+        """Записать накопленное и дождаться всех записей"""
+        self._flush()
+        while self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+
+    def describe(self) -> dict:
+        return {"pending": len(self._pending), "writing": len(self._writes), **self.stats}
@@ -0,0 +1,86 @@
+"""
+Параллельные независимые чтения внутри одного запроса
+
+Обработчики ждали независимые запросы к MongoDB по очереди: статистика - пользователя,
+потом прогресс; родительский кабинет - последний урок каждого ребенка в цикле. Время
+ответа - сумма round trip. Fanout запускает чтения сразу задачами asyncio, а обработчик
+забирает результат там, где он нужен - время ответа становится максимумом, а не суммой:
+
+    async with Fanout() as reads:
+        reads.start("user", db.users.find_one, {"id": user_id})
+        reads.start("progress", load_progress, user_id)
+        user = await reads.get("user")
+        if not user:
+            raise HTTPException(404)       # незабранные чтения отменяются на выходе
+        progress = await reads.get("progress")
+
+Повторный start с тем же ключом не запускает второе чтение - результат общий для всех,
+кто его ждет. Одновременно выполняется не больше FANOUT_LIMIT чтений запроса, чтобы
+родитель с большим числом детей не занял весь пул соединений.
+
+Настройки через окружение:
+    FANOUT_MODE   - concurrent (по умолчанию) или sequential: каждое чтение - обычный await
+                    в момент get(), как до Fanout (для сравнения в tests/benchmarks/fanout.py)
+    FANOUT_LIMIT  - сколько чтений одного запроса выполняются одновременно (по умолчанию 8)
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+CONCURRENT = "concurrent"
+SEQUENTIAL = "sequential"
+
+
+class Fanout:
+    """Чтения одного запроса: запуск сразу, результат по ключу"""
+
+    def __init__(self, mode: Optional[str] = None, limit: Optional[int] = None):
+        self.mode = mode or os.environ.get("FANOUT_MODE", CONCURRENT)
+        if self.mode not in (CONCURRENT, SEQUENTIAL):
+            raise ValueError(f"FANOUT_MODE: {CONCURRENT} или {SEQUENTIAL}, а не {self.mode}")
+        self._semaphore = asyncio.Semaphore(limit or int(os.environ.get("FANOUT_LIMIT", "8")))
+        self._pending: Dict[Hashable, Callable[[], Awaitable]] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._results: Dict[Hashable, Any] = {}
+
+    async def __aenter__(self) -> "Fanout":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def start(self, key: Hashable, load: Callable[..., Awaitable], *args, **kwargs) -> Hashable:
+        """Запустить чтение load(*args, **kwargs); уже запущенный ключ не перезапускается"""
+        if key in self._tasks or key in self._pending or key in self._results:
+            return key
+        call = lambda: load(*args, **kwargs)  # noqa: E731
+        if self.mode == CONCURRENT:
+            self._tasks[key] = asyncio.ensure_future(self._run(call))
+        else:
+            self._pending[key] = call
+        return key
+
+    async def _run(self, call: Callable[[], Awaitable]) -> Any:
+        async with self._semaphore:
+            return await call()
+
+    async def get(self, key: Hashable) -> Any:
+        """Результат чтения (ошибка чтения пробрасывается здесь)"""
+        task = self._tasks.get(key)
+        if task is not None:
+            return await task
+        if key in self._results:
+            return self._results[key]
+        # sequential: обычный await в обработчике, без задачи
+        value = self._results[key] = await self._pending.pop(key)()
+        return value
+
+    async def close(self):
+        """Отменить незабранные чтения (ответ уже решен - например, 404)"""
+        self._pending.clear()
+        self._results.clear()
+        for task in self._tasks.values():
+            task.cancel()
+        # Дождаться отмены и забрать ошибки, чтобы asyncio не логировал "never retrieved"
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
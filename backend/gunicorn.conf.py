@@ -0,0 +1,33 @@
+"""
+Конфигурация gunicorn для продакшена: несколько uvicorn-воркеров
+
+    gunicorn server:app -c gunicorn.conf.py
+
+Для общего состояния между воркерами задайте COORDINATION_URL=redis://...
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Воркеры стартуют после fork - у каждого свой Motor-клиент и event loop
+preload_app = False
+
+timeout = int(os.environ.get("WORKER_TIMEOUT", "30"))
+graceful_timeout = 30
+keepalive = 5
+
+# Перезапуск воркеров для защиты от утечек памяти
+max_requests = int(os.environ.get("MAX_REQUESTS", "10000"))
+max_requests_jitter = 1000
+
+accesslog = "-" if os.environ.get("ACCESS_LOG") else None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    # Воркеры читают WEB_CONCURRENCY, чтобы предупредить о memory:// координации
+    os.environ["WEB_CONCURRENCY"] = str(workers)
@@ -0,0 +1,131 @@
+"""
+Готовность воркера и прогрев подключения к MongoDB
+
+    /healthz - liveness: процесс жив и цикл событий отвечает; 200, пока воркер не завис
+    /readyz  - readiness: воркер прогрет и принимает трафик; 503 до конца прогрева, пока
+               MongoDB недоступна и во время остановки
+
+При выкатке балансировщик направляет запросы только на воркеры, ответившие /readyz 200,
+поэтому первые запросы не платят за выбор сервера, открытие соединений, индексы и
+загрузку каталога.
+
+Прогрев - шаги Readiness.step() в lifespan (server.py). Если обязательный шаг не удался
+(MongoDB недоступна), воркер остается неготовым, а прогрев повторяется в фоне раз в
+READY_RETRY_INTERVAL секунд; ошибки остальных шагов только логируются.
+
+Настройки через окружение:
+    MONGO_WARMUP_CONNECTIONS  - сколько соединений открыть при старте
+                                (по умолчанию minPoolSize, не меньше 4 и не больше maxPoolSize)
+    READY_RETRY_INTERVAL      - период повторной проверки, пока воркер не готов, сек (по умолчанию 5)
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+UNAVAILABLE = "unavailable"
+DRAINING = "draining"
+
+DEFAULT_WARMUP_CONNECTIONS = 4
+
+
+def warmup_connections(client, env=os.environ) -> int:
+    pool = client.options.pool_options
+    if env.get("MONGO_WARMUP_CONNECTIONS"):
+        connections = int(env["MONGO_WARMUP_CONNECTIONS"])
+    else:
+        connections = max(pool.min_pool_size, DEFAULT_WARMUP_CONNECTIONS)
+    return min(connections, pool.max_pool_size) if pool.max_pool_size else connections
+
+
+async def warm_pool(db, connections: int) -> int:
+    """Первый ping выбирает сервер, параллельные ping занимают разные соединения пула"""
+    await db.command("ping")
+    if connections > 1:
+        await asyncio.gather(*(db.command("ping") for _ in range(connections - 1)))
+    return connections
+
+
+class Readiness:
+    """Состояние воркера для /readyz: шаги прогрева, их время и ошибки"""
+
+    def __init__(self, retry_interval: Optional[float] = None):
+        self.retry_interval = retry_interval or float(os.environ.get("READY_RETRY_INTERVAL", "5"))
+        self.state = STARTING
+        self.started_at = time.monotonic()
+        self.ready_at: Optional[datetime] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._retry: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    async def step(self, name: str, action: Callable, required: bool = False) -> bool:
+        """Выполнить шаг прогрева (обычная или async-функция); ошибка не пробрасывается"""
+        started = time.perf_counter()
+        try:
+            result = action()
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            self.steps[name] = {"ok": False, "required": required, "ms": self._ms(started), "error": str(e)}
+            log = logger.error if required else logger.warning
+            log(f"Прогрев: шаг {name} не удался: {e}")
+            return False
+        self.steps[name] = {"ok": True, "required": required, "ms": self._ms(started)}
+        if result is not None:
+            self.steps[name]["result"] = result
+        return True
+
+    def finish(self, retry: Optional[Callable[[], Awaitable[bool]]] = None):
+        """
+        Завершить прогрев: готов, если все обязательные шаги прошли
+
+        retry - повтор неудавшегося прогрева в фоне (True - удалось), пока воркер не готов.
+        """
+        if all(step["ok"] for step in self.steps.values() if step["required"]):
+            self._mark_ready()
+            return
+        self.state = UNAVAILABLE
+        if retry is not None:
+            self._retry = asyncio.create_task(self._retry_until_ready(retry))
+
+    def _mark_ready(self):
+        self.state = READY
+        self.ready_at = datetime.utcnow()
+        logger.info(f"Воркер готов за {time.monotonic() - self.started_at:.2f} с")
+
+    async def _retry_until_ready(self, retry: Callable[[], Awaitable[bool]]):
+        await asyncio.sleep(self.retry_interval)
+        while not await retry():
+            await asyncio.sleep(self.retry_interval)
+        if self.state == UNAVAILABLE:
+            self._mark_ready()
+
+    async def drain(self):
+        """Остановка: /readyz сразу отвечает 503, новые запросы уходят на другие воркеры"""
+        self.state = DRAINING
+        if self._retry:
+            self._retry.cancel()
+            await asyncio.gather(self._retry, return_exceptions=True)
+            self._retry = None
+
+    @staticmethod
+    def _ms(started: float) -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    def describe(self) -> dict:
+        return {
+            "status": self.state,
+            "uptime_s": round(time.monotonic() - self.started_at, 1),
+            "ready_at": self.ready_at,
+            "steps": self.steps
+        }
@@ -0,0 +1,175 @@
+"""
+Идемпотентность пишущих запросов по заголовку Idempotency-Key
+
+Telegram WebApp на мобильной сети повторяет запросы, и без защиты повтор
+complete-lesson снова начисляет XP. Если клиент прислал Idempotency-Key,
+первый запрос выполняется и его ответ сохраняется; повторы с тем же ключом
+получают сохраненный ответ (заголовок Idempotency-Replayed: true) без записи в БД.
+
+Ответы хранятся в коллекции idempotency_keys с TTL-индексом по created_at
+и во фронтальном LRU-кэше воркера.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from pymongo.errors import DuplicateKeyError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+# Через сколько секунд незавершенный запрос считается упавшим и ключ можно перехватить
+PENDING_TIMEOUT = 60
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Ответы, которые клиент должен иметь возможность повторить с тем же ключом
+RETRYABLE_STATUSES = {408, 409, 425, 429}
+HEADER = b"idempotency-key"
+
+
+class IdempotencyStore:
+    """Хранилище ответов: коллекция с TTL + локальный кэш завершенных запросов"""
+
+    def __init__(self, get_collection: Callable, cache):
+        self._get_collection = get_collection
+        self.cache = cache
+
+    @property
+    def collection(self):
+        return self._get_collection()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL)
+
+    async def get(self, key: str) -> Optional[dict]:
+        record = self.cache.get(key)
+        if record is not None:
+            return record
+        record = await self.collection.find_one({"_id": key})
+        if record and record["status"] == "completed":
+            self.cache.set(key, record)
+        return record
+
+    async def acquire(self, key: str, fingerprint: str) -> bool:
+        """Занять ключ под выполнение; False - ключ уже занят или выполнен"""
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "status": "pending",
+                "fingerprint": fingerprint,
+                "created_at": now
+            })
+            return True
+        except DuplicateKeyError:
+            # Перехватываем ключ, если предыдущий запрос завис (упал воркер)
+            stale = await self.collection.find_one_and_update(
+                {"_id": key, "status": "pending", "created_at": {"$lt": now - timedelta(seconds=PENDING_TIMEOUT)}},
+                {"$set": {"fingerprint": fingerprint, "created_at": now}}
+            )
+            return stale is not None
+
+    async def complete(self, key: str, fingerprint: str, status_code: int, content_type: Optional[str], body: bytes):
+        record = {
+            "_id": key,
+            "status": "completed",
+            "fingerprint": fingerprint,
+            "status_code": status_code,
+            "content_type": content_type,
+            "body": body
+        }
+        await self.collection.update_one({"_id": key}, {"$set": record})
+        self.cache.set(key, record)
+
+    async def release(self, key: str):
+        await self.collection.delete_one({"_id": key, "status": "pending"})
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware: перехватывает POST/PUT/PATCH/DELETE с Idempotency-Key"""
+
+    def __init__(self, app: ASGIApp, store: IdempotencyStore):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+        client_key = dict(scope["headers"]).get(HEADER)
+        if not client_key:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        key = f"{scope['method']}:{scope['path']}:{client_key.decode('latin-1')}"
+        fingerprint = hashlib.sha256(scope.get("query_string", b"") + b"\n" + body).hexdigest()
+
+        record = await self.store.get(key)
+        if record is None and await self.store.acquire(key, fingerprint):
+            await self._execute(scope, body, send, key, fingerprint)
+            return
+        if record is None:
+            record = await self.store.get(key)
+
+        if record and record.get("fingerprint", fingerprint) != fingerprint:
+            await _send_json(send, 422, "Idempotency-Key уже использован с другим запросом")
+            return
+        if not record or record["status"] != "completed":
+            await _send_json(send, 409, "Запрос с этим Idempotency-Key еще выполняется")
+            return
+
+        headers = [(b"content-length", str(len(record["body"])).encode()), (b"idempotency-replayed", b"true")]
+        if record.get("content_type"):
+            headers.append((b"content-type", record["content_type"].encode()))
+        await send({"type": "http.response.start", "status": record["status_code"], "headers": headers})
+        await send({"type": "http.response.body", "body": bytes(record["body"])})
+
+    async def _execute(self, scope: Scope, body: bytes, send: Send, key: str, fingerprint: str):
+        response = {"status": 500, "content_type": None, "chunks": []}
+        replayed = False
+
+        async def receive() -> Message:
+            nonlocal replayed
+            if replayed:
+                return {"type": "http.disconnect"}
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture(message: Message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["content_type"] = dict(message.get("headers", [])).get(b"content-type", b"").decode() or None
+            elif message["type"] == "http.response.body":
+                response["chunks"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            # 5xx, 429 и оборванные запросы не запоминаем - клиент сможет повторить
+            if response["status"] < 500 and response["status"] not in RETRYABLE_STATUSES:
+                await self.store.complete(
+                    key, fingerprint, response["status"], response["content_type"], b"".join(response["chunks"])
+                )
+            else:
+                await self.store.release(key)
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send: Send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
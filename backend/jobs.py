@@ -0,0 +1,192 @@
+"""
+Фоновые задачи с outbox в MongoDB
+
+Побочные эффекты, без которых ответ клиенту не нужен (достижения, уведомления, оповещения
+родителей), не выполняются в обработчике. Обработчик только записывает задачу в коллекцию
+jobs (outbox) - одна вставка - и кладет ее в ограниченную очередь воркера. Задачи выполняют
+несколько asyncio-воркеров; ошибка - повтор с экспоненциальной задержкой, после
+JOBS_MAX_ATTEMPTS попыток задача остается в outbox со статусом failed.
+
+Переживает падение процесса: незавершенные задачи лежат в outbox, и поллер (этого или
+любого другого процесса) подбирает их по run_at / истекшему locked_until. Поэтому
+обработчики задач должны быть идемпотентными - задача может выполниться повторно.
+
+Настройки через окружение:
+    JOBS_WORKERS        - воркеров в процессе (по умолчанию 4)
+    JOBS_QUEUE_SIZE     - емкость очереди в памяти (по умолчанию 1000)
+    JOBS_MAX_ATTEMPTS   - попыток до failed (по умолчанию 5)
+    JOBS_POLL_INTERVAL  - период опроса outbox, сек (по умолчанию 5)
+"""
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Задача считается брошенной, если воркер не отчитался за это время
+LOCK_TIMEOUT = 60
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 300.0
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка с джиттером: 1, 2, 4, ... сек, не больше RETRY_MAX_DELAY"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobQueue:
+    """Ограниченная очередь задач с воркерами, повторами и outbox в MongoDB"""
+
+    def __init__(
+        self,
+        get_collection: Callable,
+        workers: Optional[int] = None,
+        maxsize: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self._get_collection = get_collection
+        self.workers = workers or int(os.environ.get("JOBS_WORKERS", "4"))
+        self.max_attempts = max_attempts or int(os.environ.get("JOBS_MAX_ATTEMPTS", "5"))
+        self.poll_interval = poll_interval or float(os.environ.get("JOBS_POLL_INTERVAL", "5"))
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize or int(os.environ.get("JOBS_QUEUE_SIZE", "1000")))
+        self._handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"enqueued": 0, "completed": 0, "retried": 0, "failed": 0}
+
+    @property
+    def collection(self):
+        return self._get_collection()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def handler(self, name: str):
+        """Регистрация обработчика: @jobs.handler("grant_achievements")"""
+        def decorator(func):
+            self._handlers[name] = func
+            return func
+        return decorator
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("run_at", 1)])
+
+    async def enqueue(self, name: str, **payload) -> str:
+        """Записать задачу в outbox и отдать воркерам; возвращает id задачи"""
+        if name not in self._handlers:
+            raise ValueError(f"Неизвестная задача: {name}")
+        now = datetime.utcnow()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "name": name,
+            "payload": payload,
+            "attempts": 0,
+            "created_at": now,
+            "run_at": now
+        }
+        # Есть место в очереди - задача сразу закреплена за этим процессом, иначе ее заберет поллер
+        local = self.running and not self._queue.full()
+        job.update(
+            {"status": "running", "locked_until": now + timedelta(seconds=LOCK_TIMEOUT)} if local
+            else {"status": "pending"}
+        )
+        await self.collection.insert_one(job)
+        if local:
+            self._queue.put_nowait(job)
+        self.stats["enqueued"] += 1
+        return job["_id"]
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def close(self):
+        """Остановить воркеров; незавершенные задачи останутся в outbox до следующего запуска"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _claim(self, limit: int) -> List[dict]:
+        """Забрать из outbox готовые задачи и брошенные другими процессами"""
+        claimed = []
+        now = datetime.utcnow()
+        while len(claimed) < limit:
+            job = await self.collection.find_one_and_update(
+                {"$or": [
+                    {"status": "pending", "run_at": {"$lte": now}},
+                    {"status": "running", "locked_until": {"$lt": now}}
+                ]},
+                {"$set": {"status": "running", "locked_until": now + timedelta(seconds=LOCK_TIMEOUT)}},
+                sort=[("run_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                break
+            claimed.append(job)
+        return claimed
+
+    async def _poll(self):
+        while True:
+            try:
+                free = self._queue.maxsize - self._queue.qsize()
+                for job in await self._claim(free) if free > 0 else []:
+                    await self._queue.put(job)
+            except Exception as e:
+                logger.warning(f"Опрос outbox не удался: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict):
+        try:
+            await self._handlers[job["name"]](**job["payload"])
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            if attempts >= self.max_attempts:
+                self.stats["failed"] += 1
+                logger.error(f"Задача {job['name']} {job['_id']} провалена после {attempts} попыток: {e}")
+                update = {"status": "failed", "attempts": attempts, "last_error": str(e)}
+            else:
+                self.stats["retried"] += 1
+                delay = retry_delay(attempts)
+                logger.warning(f"Задача {job['name']} {job['_id']}: {e}; повтор через {delay:.1f} с")
+                update = {
+                    "status": "pending",
+                    "attempts": attempts,
+                    "last_error": str(e),
+                    "run_at": datetime.utcnow() + timedelta(seconds=delay)
+                }
+            try:
+                await self.collection.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+            except Exception as store_error:
+                # Не записали - задачу подберет поллер по истекшему locked_until
+                logger.warning(f"Не удалось обновить задачу {job['_id']}: {store_error}")
+            return
+
+        self.stats["completed"] += 1
+        try:
+            await self.collection.delete_one({"_id": job["_id"]})
+        except Exception as e:
+            logger.warning(f"Не удалось удалить выполненную задачу {job['_id']}: {e}")
+
+    async def drain(self):
+        """Дождаться выполнения задач из очереди в памяти (тесты, бенчмарки, остановка)"""
+        await self._queue.join()
+
+    def describe(self) -> dict:
+        return {"running": self.running, "queued": self._queue.qsize(), "workers": self.workers, **self.stats}
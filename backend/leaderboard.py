@@ -0,0 +1,348 @@
+"""
+Рейтинги (лидерборды) по XP
+
+Сортировать users при каждом запросе рейтинга - полный проход по коллекции. Вместо этого
+рейтинги хранятся в упорядоченных множествах, которые обновляются при каждом изменении XP:
+top-N и "мое место" - O(log n).
+
+Множества - через абстракцию SortedSets с двумя бэкендами:
+    InProcessSortedSets - skip list в памяти процесса (memory://, один воркер)
+    RedisSortedSets     - ZADD / ZREVRANK / ZREVRANGE на Redis-совместимом сервере (redis://)
+Бэкенд выбирается по координатору. Порядок одинаковый: по убыванию очков, при равенстве -
+по убыванию id (как ZREVRANGE).
+
+Рейтинги: общий ("global") и когорта куратора ("curator:<id>"). При старте рейтинги
+строятся одним проходом по users, дальше обновляются инкрементально: обработчиками API
+и лентой изменений (on_change) - для записей XP в обход API.
+"""
+import logging
+import random
+from typing import Dict, List, Optional, Tuple
+
+from change_feed import Change
+from coordination import Coordinator
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "leaderboard:xp:"
+BUILT_MARKER = "leaderboard:xp:built"
+
+
+# ========== Skip list ==========
+
+class _Node:
+    __slots__ = ("member", "score", "forward", "span")
+
+    def __init__(self, member, score, level: int):
+        self.member = member
+        self.score = score
+        self.forward: List[Optional["_Node"]] = [None] * level
+        self.span: List[int] = [0] * level
+
+
+class SkipList:
+    """
+    Skip list с ширинами ссылок (как zset в Redis): вставка, удаление, ранг и
+    выборка по рангу за O(log n)
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        self._rng = rng or random.Random()
+        self._head = _Node(None, None, self.MAX_LEVEL)
+        self._level = 1
+        self.scores: Dict[str, float] = {}
+
+    def __len__(self):
+        return len(self.scores)
+
+    @staticmethod
+    def _precedes(node: _Node, score: float, member: str) -> bool:
+        """node стоит раньше (score, member) в порядке убывания"""
+        return node.score > score or (node.score == score and node.member > member)
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and self._rng.random() < self.P:
+            level += 1
+        return level
+
+    def add(self, member: str, score: float):
+        current = self.scores.get(member)
+        if current == score:
+            return
+        if current is not None:
+            self.remove(member)
+
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            rank[i] = 0 if i == self._level - 1 else rank[i + 1]
+            while node.forward[i] is not None and self._precedes(node.forward[i], score, member):
+                rank[i] += node.span[i]
+                node = node.forward[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.span[i] = len(self.scores)
+            self._level = level
+
+        new = _Node(member, score, level)
+        for i in range(level):
+            new.forward[i] = update[i].forward[i]
+            update[i].forward[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self.scores[member] = score
+
+    def remove(self, member: str) -> bool:
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.forward[i] is not None and self._precedes(node.forward[i], score, member):
+                node = node.forward[i]
+            update[i] = node
+        target = node.forward[0]
+        for i in range(self._level):
+            if update[i].forward[i] is target:
+                update[i].span[i] += target.span[i] - 1
+                update[i].forward[i] = target.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.forward[self._level - 1] is None:
+            self._level -= 1
+        return True
+
+    def rank(self, member: str) -> Optional[int]:
+        """Место с нуля (0 - первое) или None"""
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        traversed = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.forward[i] is not None and (
+                self._precedes(node.forward[i], score, member) or node.forward[i].member == member
+            ):
+                traversed += node.span[i]
+                node = node.forward[i]
+            if node.member == member:
+                return traversed - 1
+        return None
+
+    def range(self, start: int, count: int) -> List[Tuple[str, float]]:
+        """count элементов начиная с места start (с нуля)"""
+        if start < 0 or start >= len(self.scores) or count <= 0:
+            return []
+        target = start + 1
+        traversed = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.forward[i] is not None and traversed + node.span[i] <= target:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if traversed == target:
+                break
+        result = []
+        while node is not None and len(result) < count:
+            result.append((node.member, node.score))
+            node = node.forward[0]
+        return result
+
+
+# ========== Sorted sets ==========
+
+class SortedSets:
+    """Общий интерфейс упорядоченных множеств (семантика ZSET с обратным порядком)"""
+
+    backend = "base"
+
+    async def add(self, key: str, member: str, score: float):
+        raise NotImplementedError
+
+    async def add_many(self, key: str, items: Dict[str, float]):
+        for member, score in items.items():
+            await self.add(key, member, score)
+
+    async def remove(self, key: str, member: str):
+        raise NotImplementedError
+
+    async def rank(self, key: str, member: str) -> Optional[int]:
+        raise NotImplementedError
+
+    async def score(self, key: str, member: str) -> Optional[float]:
+        raise NotImplementedError
+
+    async def range(self, key: str, start: int, count: int) -> List[Tuple[str, float]]:
+        raise NotImplementedError
+
+    async def size(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class InProcessSortedSets(SortedSets):
+    backend = "memory"
+
+    def __init__(self):
+        self._sets: Dict[str, SkipList] = {}
+
+    def _get(self, key: str) -> SkipList:
+        skip_list = self._sets.get(key)
+        if skip_list is None:
+            skip_list = self._sets[key] = SkipList()
+        return skip_list
+
+    async def add(self, key: str, member: str, score: float):
+        self._get(key).add(member, score)
+
+    async def remove(self, key: str, member: str):
+        skip_list = self._sets.get(key)
+        if skip_list is not None:
+            skip_list.remove(member)
+
+    async def rank(self, key: str, member: str) -> Optional[int]:
+        skip_list = self._sets.get(key)
+        return skip_list.rank(member) if skip_list is not None else None
+
+    async def score(self, key: str, member: str) -> Optional[float]:
+        skip_list = self._sets.get(key)
+        return skip_list.scores.get(member) if skip_list is not None else None
+
+    async def range(self, key: str, start: int, count: int) -> List[Tuple[str, float]]:
+        skip_list = self._sets.get(key)
+        return skip_list.range(start, count) if skip_list is not None else []
+
+    async def size(self, key: str) -> int:
+        skip_list = self._sets.get(key)
+        return len(skip_list) if skip_list is not None else 0
+
+
+class RedisSortedSets(SortedSets):
+    backend = "redis"
+
+    def __init__(self, redis):
+        self._redis = redis
+
+    async def add(self, key: str, member: str, score: float):
+        await self._redis.zadd(key, {member: score})
+
+    async def add_many(self, key: str, items: Dict[str, float]):
+        if items:
+            await self._redis.zadd(key, items)
+
+    async def remove(self, key: str, member: str):
+        await self._redis.zrem(key, member)
+
+    async def rank(self, key: str, member: str) -> Optional[int]:
+        return await self._redis.zrevrank(key, member)
+
+    async def score(self, key: str, member: str) -> Optional[float]:
+        return await self._redis.zscore(key, member)
+
+    async def range(self, key: str, start: int, count: int) -> List[Tuple[str, float]]:
+        if count <= 0:
+            return []
+        return await self._redis.zrevrange(key, start, start + count - 1, withscores=True)
+
+    async def size(self, key: str) -> int:
+        return await self._redis.zcard(key)
+
+
+def create_sorted_sets(coordinator: Coordinator) -> SortedSets:
+    """Бэкенд множеств по координатору: Redis - общий для всех воркеров"""
+    if coordinator.backend == "redis":
+        return RedisSortedSets(coordinator.redis)
+    return InProcessSortedSets()
+
+
+# ========== Leaderboards ==========
+
+class Leaderboards:
+    """Рейтинги по XP: общий и по когортам кураторов"""
+
+    def __init__(self, coordinator: Coordinator, sorted_sets: Optional[SortedSets] = None):
+        self.coordinator = coordinator
+        self.sets = sorted_sets or create_sorted_sets(coordinator)
+
+    @staticmethod
+    def board_key(curator_id: Optional[str] = None) -> str:
+        return KEY_PREFIX + (f"curator:{curator_id}" if curator_id else "global")
+
+    async def rebuild(self, users, force: bool = False) -> int:
+        """
+        Построить рейтинги одним проходом по users
+
+        Общий бэкенд (Redis) строится один раз на все воркеры - по маркеру.
+        """
+        if not force and self.sets.backend == "redis" and await self.coordinator.get(BUILT_MARKER):
+            return 0
+        boards: Dict[str, Dict[str, float]] = {}
+        count = 0
+        cursor = users.find({"role": "student"}, {"_id": 0, "id": 1, "xp": 1, "curator_id": 1})
+        async for user in cursor:
+            xp = user.get("xp", 0) or 0
+            boards.setdefault(self.board_key(), {})[user["id"]] = xp
+            if user.get("curator_id"):
+                boards.setdefault(self.board_key(user["curator_id"]), {})[user["id"]] = xp
+            count += 1
+        for key, items in boards.items():
+            await self.sets.add_many(key, items)
+        if self.sets.backend == "redis":
+            await self.coordinator.set(BUILT_MARKER, "1")
+        logger.info(f"Рейтинги построены: {count} учеников, {len(boards)} рейтингов ({self.sets.backend})")
+        return count
+
+    async def record_xp(self, user: dict, xp: int):
+        """Обновить XP пользователя во всех его рейтингах (вызывать после записи xp)"""
+        if user.get("role", "student") != "student":
+            return
+        await self.sets.add(self.board_key(), user["id"], xp)
+        if user.get("curator_id"):
+            await self.sets.add(self.board_key(user["curator_id"]), user["id"], xp)
+
+    async def on_change(self, change: Change):
+        """
+        Изменение users из ленты изменений
+
+        Прежний куратор в событии неизвестен: при смене curator_id ученик остается и в
+        старой когорте до пересборки рейтингов.
+        """
+        if change.operation == "delete" and change.user_id:
+            await self.sets.remove(self.board_key(), change.user_id)
+            return
+        user = change.document
+        if user is None or not change.touches("xp", "role", "curator_id"):
+            return
+        if user.get("role", "student") != "student":
+            await self.sets.remove(self.board_key(), user["id"])
+            if user.get("curator_id"):
+                await self.sets.remove(self.board_key(user["curator_id"]), user["id"])
+            return
+        await self.record_xp(user, user.get("xp", 0) or 0)
+
+    async def top(self, curator_id: Optional[str] = None, limit: int = 10, offset: int = 0) -> List[Tuple[int, str, float]]:
+        """[(место с 1, user_id, xp), ...]"""
+        entries = await self.sets.range(self.board_key(curator_id), offset, limit)
+        return [(offset + i + 1, member, score) for i, (member, score) in enumerate(entries)]
+
+    async def rank(self, user_id: str, curator_id: Optional[str] = None) -> Optional[dict]:
+        key = self.board_key(curator_id)
+        rank = await self.sets.rank(key, user_id)
+        if rank is None:
+            return None
+        return {"rank": rank + 1, "xp": int(await self.sets.score(key, user_id)), "total": await self.sets.size(key)}
+
+    async def size(self, curator_id: Optional[str] = None) -> int:
+        return await self.sets.size(self.board_key(curator_id))
@@ -0,0 +1,220 @@
+"""
+Каталог уроков
+
+Раньше число уроков в модулях (boundaries 12, confidence 12, ...) было зашито в обработчики.
+Теперь каталог загружается при старте из коллекции lessons, а если она пуста - из
+data/lessons.json, и хранится неизменяемым индексом: урок по id, уроки модуля, число уроков.
+Подсчет прогресса идет за один проход с O(1)-поиском модуля по id урока - в том числе для
+записей без поля module (их создает синхронизация из localStorage).
+
+Горячая перезагрузка: фоновая задача раз в LESSON_CATALOG_RELOAD_INTERVAL секунд сверяет
+отпечаток источника и атомарно подменяет индекс; POST /api/lessons/reload (request_reload)
+рассылает событие координатора "lesson-catalog:reload" и перезагружает каталог во всех
+воркерах сразу, не дожидаясь интервала. Маршрут служебный: без PROFILING_TOKEN он
+выключен (404), с ним требует заголовок X-Profiling-Token. Новый модуль добавляется
+без правок кода.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from coordination import Coordinator
+from models import ModuleTally
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = Path(__file__).parent / "data" / "lessons.json"
+RELOAD_EVENT = "lesson-catalog:reload"
+
+
+@dataclass(frozen=True, slots=True)
+class Lesson:
+    id: str
+    module: str
+    week: int
+    position: int  # порядковый номер в модуле
+    title: Optional[str] = None
+    xp: Optional[int] = None
+
+
+@dataclass(frozen=True, slots=True)
+class Module:
+    id: str
+    title: str
+    lessons: Tuple[Lesson, ...]
+
+
+class Catalog:
+    """Неизменяемый индекс каталога; при перезагрузке создается новый объект"""
+
+    __slots__ = ("version", "modules", "lessons", "totals")
+
+    def __init__(self, modules: Iterable[Module], version: str):
+        self.version = version
+        self.modules: Mapping[str, Module] = MappingProxyType({module.id: module for module in modules})
+        self.lessons: Mapping[str, Lesson] = MappingProxyType({
+            lesson.id: lesson for module in self.modules.values() for lesson in module.lessons
+        })
+        self.totals: Mapping[str, int] = MappingProxyType({
+            module.id: len(module.lessons) for module in self.modules.values()
+        })
+
+    def module_of(self, lesson_id: str) -> Optional[str]:
+        lesson = self.lessons.get(lesson_id)
+        return lesson.module if lesson else None
+
+    def tally(self, progress: Iterable[dict]) -> Tuple[Dict[str, ModuleTally], int]:
+        """Один проход по записям прогресса: (счетчики по модулям, всего завершено)"""
+        tallies = {module: ModuleTally() for module in self.modules}
+        completed_total = 0
+        for p in progress:
+            done = p.get("status") == "completed"
+            completed_total += done
+            tally = tallies.get(p.get("module") or self.module_of(p.get("lesson_id")))
+            if tally is not None:
+                tally.started += 1
+                tally.completed += done
+        return tallies, completed_total
+
+    def percent(self, module: str, completed: int) -> float:
+        total = self.totals.get(module, 0)
+        return round((completed / total * 100) if total else 0, 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "modules": [
+                {
+                    "id": module.id,
+                    "title": module.title,
+                    "total": len(module.lessons),
+                    "lessons": [
+                        {"id": lesson.id, "week": lesson.week, "title": lesson.title, "xp": lesson.xp}
+                        for lesson in module.lessons
+                    ]
+                }
+                for module in self.modules.values()
+            ]
+        }
+
+
+def build_catalog(data: dict, version: str) -> Catalog:
+    """Каталог из формата data/lessons.json: {"modules": [{"id", "title", "lessons": [...]}]}"""
+    modules = []
+    for module in data.get("modules", []):
+        lessons = tuple(
+            Lesson(
+                id=lesson["id"],
+                module=module["id"],
+                week=lesson.get("week", position // 3 + 1),
+                position=position,
+                title=lesson.get("title"),
+                xp=lesson.get("xp")
+            )
+            for position, lesson in enumerate(module.get("lessons", []))
+        )
+        modules.append(Module(id=module["id"], title=module.get("title", module["id"]), lessons=lessons))
+    return Catalog(modules, version)
+
+
+def documents_to_data(documents: List[dict]) -> dict:
+    """Документы коллекции lessons ({id, module, week, order, title, xp, module_title}) -> формат файла"""
+    modules: Dict[str, dict] = {}
+    for doc in sorted(documents, key=lambda d: (d.get("module_order", 0), d["module"], d.get("week", 0), d.get("order", 0))):
+        module = modules.setdefault(doc["module"], {"id": doc["module"], "title": doc.get("module_title", doc["module"]), "lessons": []})
+        module["lessons"].append({key: doc[key] for key in ("id", "week", "title", "xp") if doc.get(key) is not None})
+    return {"modules": list(modules.values())}
+
+
+def fingerprint(data: dict) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:12]
+
+
+def load_catalog_file(path: Path = DEFAULT_CATALOG_PATH) -> Catalog:
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return build_catalog(data, fingerprint(data))
+
+
+class LessonCatalogService:
+    """Держит актуальный Catalog и перезагружает его при изменении источника"""
+
+    def __init__(
+        self,
+        get_collection: Callable,
+        coordinator: Coordinator,
+        path: Path = DEFAULT_CATALOG_PATH,
+        reload_interval: Optional[float] = None
+    ):
+        self._get_collection = get_collection
+        self._coordinator = coordinator
+        self.path = Path(path)
+        self.reload_interval = (
+            reload_interval if reload_interval is not None
+            else float(os.environ.get("LESSON_CATALOG_RELOAD_INTERVAL", "30"))
+        )
+        self.source = "file"
+        self._catalog: Optional[Catalog] = None
+        self._watcher: Optional[asyncio.Task] = None
+        coordinator.subscribe(self._on_event)
+
+    @property
+    def current(self) -> Catalog:
+        """Текущий каталог; до start() - из файла"""
+        if self._catalog is None:
+            self._catalog = load_catalog_file(self.path)
+        return self._catalog
+
+    async def start(self):
+        await self.reload()
+        if self.reload_interval > 0:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+
+    async def reload(self) -> bool:
+        """Перечитать источник; True - каталог изменился"""
+        try:
+            documents = await self._get_collection().find({}, {"_id": 0}).to_list(None)
+        except Exception as e:
+            logger.warning(f"Каталог уроков: коллекция lessons недоступна, используем файл: {e}")
+            documents = []
+
+        if documents:
+            data, source = documents_to_data(documents), "collection"
+        else:
+            data, source = json.loads(self.path.read_text(encoding="utf-8")), "file"
+
+        version = fingerprint(data)
+        if self._catalog is not None and self._catalog.version == version:
+            return False
+        self._catalog = build_catalog(data, version)
+        self.source = source
+        logger.info(f"Каталог уроков {version} ({source}): {dict(self._catalog.totals)}")
+        return True
+
+    async def request_reload(self) -> bool:
+        """Перезагрузить каталог здесь и разослать RELOAD_EVENT остальным воркерам"""
+        changed = await self.reload()
+        await self._coordinator.invalidate(RELOAD_EVENT)
+        return changed
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.warning(f"Каталог уроков не перезагружен: {e}")
+
+    async def _on_event(self, key: str):
+        if key == RELOAD_EVENT:
+            await self.reload()
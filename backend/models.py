@@ -1,10 +1,37 @@
 """
 Модели данных для MyTeens.Space
+
+Единый слой схем: pydantic-модели для валидации запросов и документов,
+TypedDict - для форм ответов горячих эндпоинтов (они отдаются через json_response
+без повторной валидации, а схема нужна для OpenAPI и типизации), слотовые
+dataclass - для внутренних объектов в циклах обработчиков.
 """
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict
-from datetime import datetime
+from dataclasses import dataclass
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Annotated, Any, Literal, Optional, List, Dict, Union
+from typing_extensions import TypedDict
+from datetime import date, datetime
 from enum import Enum
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Оценка колеса баланса 0-10: целые с клиента остаются целыми
+Score = Union[int, float]
+
+
+class Schema(BaseModel):
+    """
+    База моделей: валидация один раз на входе
+
+    Уже созданные экземпляры не перепроверяются при возврате из обработчика
+    (revalidate_instances="never"), чтение атрибутов ORM-объектов выключено,
+    enum хранятся значениями - model_dump() сразу готов для MongoDB.
+    """
+    model_config = ConfigDict(
+        from_attributes=False,
+        revalidate_instances="never",
+        validate_assignment=False,
+        use_enum_values=True
+    )
 
 
 class UserRole(str, Enum):
@@ -29,37 +56,72 @@ class LessonStatus(str, Enum):
 
 
 # ========== User Models ==========
-class UserCreate(BaseModel):
+class UserCreate(Schema):
     name: str
     age: int
     role: UserRole = UserRole.STUDENT
     curator_id: Optional[str] = None
     parent_id: Optional[str] = None
+    telegram_id: Optional[str] = None
 
 
-class User(BaseModel):
+class UserUpdate(Schema):
+    """Поля профиля, которые пользователь может менять сам"""
+    name: Optional[str] = None
+    age: Optional[int] = None
+    avatar_url: Optional[str] = None
+    notifications_enabled: Optional[bool] = None
+    timezone: Optional[str] = None
+
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, value: Optional[str]) -> Optional[str]:
+        """IANA-имя: Europe/Moscow, Asia/Yekaterinburg"""
+        if value is not None:
+            try:
+                ZoneInfo(value)
+            except (ZoneInfoNotFoundError, ValueError):
+                raise ValueError(f"Неизвестный часовой пояс: {value}")
+        return value
+
+
+class User(Schema):
     id: str
     name: str
     age: int
     role: UserRole
     curator_id: Optional[str] = None
     parent_id: Optional[str] = None
+    telegram_id: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     # Геймификация
     xp: int = 0
     level: int = 1
     streak: int = 0
+    longest_streak: int = 0
+    # Календарь активности: {"YYYY-MM": битовая маска дней}, см. streaks.py
+    activity: Dict[str, int] = {}
+    streak_freezes: Dict[str, int] = {}
+    coins: int = 0
+    gems: int = 0
+    # Энергия - запас на момент energy_updated_at, текущая считается при чтении (economy.py)
+    energy: int = 100
+    energy_updated_at: Optional[datetime] = None
+    inventory: Dict[str, Any] = {}
     last_activity: Optional[datetime] = None
     achievements: List[str] = []
+    unread_notifications: int = 0
+    revision: int = 0
     
     # Настройки
     notifications_enabled: bool = True
     avatar_url: Optional[str] = None
+    timezone: Optional[str] = None
 
 
 # ========== Access Code Models ==========
-class AccessCode(BaseModel):
+class AccessCode(Schema):
     code: str
     curator_id: str
     role: UserRole
@@ -72,22 +134,22 @@ class AccessCode(BaseModel):
 
 
 # ========== Balance Assessment Models ==========
-class BalanceAssessment(BaseModel):
+class BalanceAssessment(Schema):
     id: str
     user_id: str
     type: str  # 'initial' or 'final'
-    scores: Dict[str, int]  # categoryId -> score
-    answers: Dict[str, str]  # questionId -> answer
-    overall_score: float
+    scores: Dict[str, Score]  # categoryId -> score
+    answers: Dict[str, Any] = {}  # questionId -> answer
+    overall_score: Optional[float] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 
 # ========== Lesson Progress Models ==========
-class LessonProgress(BaseModel):
+class LessonProgress(Schema):
     id: str
     user_id: str
     lesson_id: str
-    module: ModuleType
+    module: Optional[str] = None  # ModuleType; синхронизация из localStorage модуль не знает
     status: LessonStatus = LessonStatus.AVAILABLE
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
@@ -99,7 +161,7 @@ class LessonProgress(BaseModel):
 
 
 # ========== Check-in Models ==========
-class CheckIn(BaseModel):
+class CheckIn(Schema):
     id: str
     user_id: str
     mood: str
@@ -110,7 +172,7 @@ class CheckIn(BaseModel):
 
 
 # ========== Achievement Models ==========
-class Achievement(BaseModel):
+class Achievement(Schema):
     id: str
     user_id: str
     achievement_type: str
@@ -120,7 +182,7 @@ class Achievement(BaseModel):
 
 
 # ========== Notification Models ==========
-class Notification(BaseModel):
+class Notification(Schema):
     id: str
     user_id: str
     type: str  # 'achievement', 'reminder', 'parent_alert', etc.
@@ -128,3 +190,241 @@ class Notification(BaseModel):
     description: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     read: bool = False
+
+
+class MarkReadRequest(Schema):
+    ids: Optional[List[str]] = None  # конкретные уведомления
+    before: Optional[datetime] = None  # или все, созданные до этого момента
+
+
+# ========== Sync Models ==========
+class ProgressSnapshot(Schema):
+    """Состояние мини-приложения из localStorage (POST /sync/progress)"""
+    completedLessons: List[str] = []
+    xp: int = 0
+    level: int = 1
+    streak: int = 0
+    # Кошелек берется из снимка один раз, потом им владеет сервер (economy.import_fields)
+    coins: Optional[int] = None
+    gems: Optional[int] = None
+    energy: Optional[int] = None
+    inventory: Optional[Dict[str, Any]] = None
+    balanceScores: Dict[str, Score] = {}
+
+    @field_validator("balanceScores")
+    @classmethod
+    def check_scores(cls, value: Dict[str, Score]) -> Dict[str, Score]:
+        for category, score in value.items():
+            if not 0 <= score <= 10:
+                raise ValueError(f"Неверная оценка для {category}")
+        return value
+
+
+class ClientOp(Schema):
+    """Операция из офлайн-очереди клиента (POST /sync/ops); seq растет с каждой операцией"""
+    seq: int = Field(ge=1)
+    at: datetime  # время на устройстве
+
+
+class LessonCompleteOp(ClientOp):
+    type: Literal["lesson_complete"]
+    lesson_id: str
+    score: int = Field(ge=0)
+    time_spent: int = Field(default=0, ge=0)
+    xp_earned: int = Field(default=0, ge=0)
+    answers: Dict[str, Any] = {}
+
+
+class PurchaseOp(ClientOp):
+    type: Literal["purchase"]
+    item_id: str
+    quantity: int = Field(default=1, ge=1)
+    # Цена и валюта - из каталога сервера (economy.ITEMS), клиентские только для совместимости
+    price: Optional[int] = None
+    currency: Optional[Literal["coins", "gems"]] = None
+
+
+class ItemUseOp(ClientOp):
+    type: Literal["item_use"]
+    item_id: str
+
+
+class CheckInOp(ClientOp):
+    type: Literal["checkin"]
+    mood: str
+    anxiety_level: int
+    sleep_hours: float
+    notes: str = ""
+
+
+SyncOp = Annotated[Union[LessonCompleteOp, PurchaseOp, ItemUseOp, CheckInOp], Field(discriminator="type")]
+
+
+class SyncOpsRequest(Schema):
+    ops: List[SyncOp] = Field(min_length=1)
+
+
+# ========== Batch Models ==========
+class BatchSubRequest(Schema):
+    id: Optional[str] = None  # вернется в ответе, чтобы клиент сопоставил результаты
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"] = "GET"
+    path: str = Field(pattern=r"^/api/")  # с query string: /api/checkin/u1?limit=7
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+
+class BatchRequest(Schema):
+    requests: List[BatchSubRequest] = Field(min_length=1)
+
+
+# ========== Response Shapes ==========
+# Формы ответов горячих эндпоинтов: словари строятся напрямую и сериализуются
+# через json_response, pydantic в них не участвует
+
+class ModuleStats(TypedDict):
+    total: int
+    completed: int
+    progress: float
+
+
+class UserStats(TypedDict):
+    user_id: str
+    level: int
+    xp: int
+    streak: int
+    total_lessons: int
+    completed_lessons: int
+    total_time_minutes: int
+    average_score: float
+    achievements: List[str]
+    modules: Dict[str, ModuleStats]
+
+
+class RosterEntry(TypedDict):
+    id: str
+    name: str
+    age: int
+    lastActive: Optional[datetime]
+    progress: Dict[str, float]
+    completedLessons: int
+    totalXP: int
+    level: int
+    streak: int
+    initialBalance: Optional[Dict[str, Score]]
+    currentBalance: Optional[Dict[str, Score]]
+
+
+class SyncedProgress(TypedDict):
+    telegram_id: str
+    user_id: str
+    name: Optional[str]
+    role: Optional[str]
+    completedLessons: List[str]
+    xp: int
+    level: int
+    coins: int
+    gems: int
+    streak: int
+    # Энергия на момент energy_updated_at; текущая - +1 за ENERGY_REGEN_SECONDS до ENERGY_MAX
+    # (economy.current_energy), None - восстановление еще не отсчитывается
+    energy: int
+    energy_updated_at: Optional[datetime]
+    inventory: Dict[str, Any]
+    balanceScores: Dict[str, Score]
+    last_activity: Optional[datetime]
+
+
+class RejectedOp(TypedDict):
+    seq: int
+    reason: str
+
+
+class SyncOpsResult(TypedDict):
+    telegram_id: str
+    ack: int  # все операции с seq <= ack приняты: клиент удаляет их из очереди
+    applied: int
+    duplicates: int
+    rejected: List[RejectedOp]  # подтверждены, но не применены (например, не хватило монет)
+    state: Dict[str, Any]  # xp, level, coins, gems, energy, inventory, streak после применения
+
+
+class Wallet(TypedDict):
+    user_id: str
+    coins: int
+    gems: int
+    energy: int  # текущая, с учетом восстановления
+    energy_max: int
+    energy_full_in_seconds: int
+    inventory: Dict[str, Any]
+
+
+class StreakCalendar(TypedDict):
+    user_id: str
+    year: int
+    timezone: str
+    today: date
+    current: int
+    longest: int
+    active_today: bool
+    days: List[date]
+    frozen_days: List[date]
+
+
+class BalanceSnapshot(TypedDict):
+    id: str
+    type: str
+    timestamp: datetime
+    scores: Dict[str, Score]
+    overall_score: Optional[float]
+
+
+class BalanceComparison(TypedDict):
+    user_id: str
+    assessments: int
+    initial: BalanceSnapshot
+    latest: Optional[BalanceSnapshot]  # None, пока оценка одна
+    deltas: Optional[Dict[str, Score]]  # latest - initial по категориям
+    overall_delta: Optional[float]
+
+
+class CohortBalanceComparison(TypedDict):
+    curator_id: str
+    students: int
+    compared: int  # учеников хотя бы с двумя оценками
+    average_deltas: Dict[str, float]
+    comparisons: List[BalanceComparison]
+
+
+class LeaderboardEntry(TypedDict):
+    rank: int
+    user_id: str
+    name: Optional[str]
+    xp: int
+    level: int
+
+
+class Leaderboard(TypedDict):
+    board: str
+    total: int
+    entries: List[LeaderboardEntry]
+
+
+class BoardPosition(TypedDict):
+    rank: int
+    xp: int
+    total: int
+
+
+class LeaderboardRank(TypedDict):
+    user_id: str
+    overall: Optional[BoardPosition]
+    cohort: Optional[BoardPosition]
+
+
+# ========== Internal Hot-Path Objects ==========
+@dataclass(slots=True)
+class ModuleTally:
+    """Счетчик уроков модуля за один проход по прогрессу (вместо фильтраций списка на каждый модуль)"""
+    started: int = 0
+    completed: int = 0
+
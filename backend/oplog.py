@@ -0,0 +1,293 @@
+"""
+Офлайн-очередь операций клиента (POST /api/sync/ops)
+
+POST /sync/progress присылает снимок localStorage целиком: после долгого офлайна клиент
+заново выгружает все состояние, а последний снимок перетирает то, что сервер насчитал
+сам (XP с другого запроса, стрик). Очередь операций вместо снимка: клиент копит
+завершения уроков, покупки, использование предметов и чек-ины с временем на устройстве
+и номером seq, а при подключении отправляет их пачкой по порядку.
+
+Протокол:
+    - seq растет на 1 с каждой операцией клиента; users.op_seq - наибольший принятый
+      seq (high-water mark)
+    - операции с seq <= op_seq - повторы (ответ не дошел, клиент отправил снова), они
+      пропускаются: дедупликация по (telegram_id, seq)
+    - ack в ответе - новый op_seq: клиент удаляет из очереди операции с seq <= ack и
+      берет state (XP, монеты, инвентарь, ...) как состояние сервера
+    - операция, которую нельзя применить (не хватает монет, нет предмета), тоже
+      подтверждается и возвращается в rejected - очередь на ней не застревает
+    - цены и действие предметов - из каталога сервера (economy.ITEMS), энергия
+      восстанавливается по времени устройства между операциями (economy.current_energy)
+
+Пачка сворачивается в памяти по документу пользователя (plan_ops) и записывается одной
+операцией на коллекцию: bulk_write в lesson_progress и checkins (upsert по id из
+(telegram_id, seq) - повтор ничего не дублирует) и один update_one пользователя с
+условием на revision. Если пользователь за это время изменился (другой запрос или та же
+пачка, отправленная повторно), пачка пересчитывается по свежему документу - до
+OPLOG_MAX_ATTEMPTS раз, потом 409.
+
+После 409 записи уроков и чек-инов уже могут быть в базе, а XP, монеты и op_seq - нет.
+Клиент не получил ack и отправляет ту же пачку снова: записи совпадут по id, а XP и
+остальное состояние начислятся один раз - до успешного повтора состояние не согласовано.
+
+Настройки через окружение:
+    OPLOG_MAX_OPS       - операций в одной пачке (по умолчанию 500)
+    OPLOG_MAX_AGE_DAYS  - время операции старше этого прижимается к границе, дней (по умолчанию 30)
+    OPLOG_MAX_ATTEMPTS  - попыток записи при параллельных изменениях пользователя (по умолчанию 3)
+    XP_PER_LEVEL        - XP на уровень (по умолчанию 500)
+"""
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+
+from economy import ENERGY_MAX, ITEMS, current_energy, energy_fields
+from events import CHECKIN, LESSON_COMPLETED, make_event
+from models import CheckIn, CheckInOp, ItemUseOp, LessonCompleteOp, PurchaseOp
+from streaks import StreakEngine
+
+# Пространство имен uuid5 для id записей, созданных операциями
+OPS_NAMESPACE = uuid.UUID("6f1d3c52-8a0e-4d8b-9a51-3f0e2b7c9d14")
+
+
+class OpConflict(Exception):
+    """Пользователь менялся параллельно на всех попытках записи"""
+
+
+def op_id(telegram_id: str, seq: int) -> str:
+    """id записи, созданной операцией: одинаковый при повторной отправке"""
+    return str(uuid.uuid5(OPS_NAMESPACE, f"{telegram_id}:{seq}"))
+
+
+def level_for(xp: int, xp_per_level: int) -> int:
+    """Уровень по XP: новый уровень каждые xp_per_level XP"""
+    return xp // xp_per_level + 1
+
+
+def client_time(at: datetime, now: datetime, max_age: timedelta) -> datetime:
+    """Время устройства -> наивное UTC (как в MongoDB) не в будущем и не старше max_age"""
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(max(at, now - max_age), now)
+
+
+def item_count(inventory: Dict[str, Any], item_id: str) -> int:
+    value = inventory.get(item_id, 0)
+    return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+@dataclass(slots=True)
+class OpPlan:
+    """Свертка пачки по документу пользователя: что записать и что ответить"""
+    ack: int
+    applied: int = 0
+    duplicates: int = 0
+    rejected: List[Dict[str, Any]] = field(default_factory=list)
+    lesson_writes: List[UpdateOne] = field(default_factory=list)
+    checkin_writes: List[UpdateOne] = field(default_factory=list)
+    events: List[dict] = field(default_factory=list)
+    state: Dict[str, Any] = field(default_factory=dict)
+    user_update: Optional[dict] = None
+    xp_changed: bool = False
+
+
+def plan_ops(
+    user: dict,
+    telegram_id: str,
+    ops: Sequence,
+    module_of: Callable[[str], Optional[str]],
+    streaks: StreakEngine,
+    now: datetime,
+    max_age: timedelta,
+    xp_per_level: int
+) -> OpPlan:
+    """Применить операции с seq > users.op_seq к копии состояния пользователя"""
+    user_id = user["id"]
+    plan = OpPlan(ack=user.get("op_seq", 0))
+    state = plan.state
+    state.update({
+        "xp": user.get("xp", 0),
+        "level": user.get("level", 1),
+        "coins": user.get("coins", 0),
+        "gems": user.get("gems", 0),
+        "inventory": dict(user.get("inventory") or {}),
+        "streak": user.get("streak", 0)
+    })
+    # Энергия: запас и момент отсчета восстановления, как в документе
+    energy = {"energy": user.get("energy", ENERGY_MAX), "energy_updated_at": user.get("energy_updated_at")}
+    flags: Dict[str, Any] = {}
+    lesson_times: List[datetime] = []
+    last_activity: Optional[datetime] = None
+
+    for op in sorted(ops, key=lambda op: op.seq):
+        if op.seq <= plan.ack:
+            plan.duplicates += 1
+            continue
+        plan.ack = op.seq
+        at = client_time(op.at, now, max_age)
+
+        if isinstance(op, (PurchaseOp, ItemUseOp)) and op.item_id not in ITEMS:
+            plan.rejected.append({"seq": op.seq, "reason": f"Неизвестный предмет: {op.item_id}"})
+            continue
+
+        if isinstance(op, PurchaseOp):
+            item = ITEMS[op.item_id]
+            cost = item.price * op.quantity
+            if state[item.currency] < cost:
+                plan.rejected.append({"seq": op.seq, "reason": f"Недостаточно {item.currency}: нужно {cost}"})
+                continue
+            state[item.currency] -= cost
+            state["inventory"][op.item_id] = item_count(state["inventory"], op.item_id) + op.quantity
+
+        elif isinstance(op, ItemUseOp):
+            item = ITEMS[op.item_id]
+            count = item_count(state["inventory"], op.item_id)
+            if count < 1:
+                plan.rejected.append({"seq": op.seq, "reason": f"Нет предмета {op.item_id}"})
+                continue
+            state["inventory"][op.item_id] = count - 1
+            if item.energy:
+                # Восстановление до момента использования на устройстве
+                value, since = current_energy(energy, max(at, energy["energy_updated_at"] or at))
+                value = min(ENERGY_MAX, value + item.energy)
+                energy = energy_fields(value, at if value >= ENERGY_MAX else since)
+            if item.streak_protection:
+                flags["streakProtection"] = True
+
+        elif isinstance(op, LessonCompleteOp):
+            plan.lesson_writes.append(UpdateOne(
+                {"user_id": user_id, "lesson_id": op.lesson_id},
+                {
+                    "$set": {
+                        "module": module_of(op.lesson_id),
+                        "status": "completed",
+                        "completed_at": at,
+                        "score": op.score,
+                        "xp_earned": op.xp_earned,
+                        "answers": op.answers,
+                        "time_spent": op.time_spent
+                    },
+                    "$setOnInsert": {"id": op_id(telegram_id, op.seq)}
+                },
+                upsert=True
+            ))
+            state["xp"] += op.xp_earned
+            plan.xp_changed = True
+            lesson_times.append(at)
+            plan.events.append(make_event(
+                LESSON_COMPLETED, user_id, lesson_id=op.lesson_id, score=op.score, time_spent=op.time_spent,
+                xp_earned=op.xp_earned, source="oplog", seq=op.seq
+            ))
+
+        elif isinstance(op, CheckInOp):
+            checkin_id = op_id(telegram_id, op.seq)
+            checkin = CheckIn(
+                id=checkin_id, user_id=user_id, mood=op.mood, anxiety_level=op.anxiety_level,
+                sleep_hours=op.sleep_hours, notes=op.notes, timestamp=at
+            )
+            plan.checkin_writes.append(UpdateOne({"id": checkin_id}, {"$setOnInsert": checkin.model_dump()}, upsert=True))
+            plan.events.append(make_event(
+                CHECKIN, user_id, checkin_id=checkin_id, mood=op.mood, anxiety_level=op.anxiety_level,
+                sleep_hours=op.sleep_hours, seq=op.seq
+            ))
+
+        plan.applied += 1
+        last_activity = at if last_activity is None else max(last_activity, at)
+
+    state["energy"] = current_energy(energy, now)[0]
+    if plan.ack == user.get("op_seq", 0):
+        # Одни повторы: писать нечего
+        return plan
+
+    if plan.xp_changed:
+        state["level"] = level_for(state["xp"], xp_per_level)
+    update: Dict[str, Any] = {
+        "$set": {
+            "op_seq": plan.ack,
+            "xp": state["xp"],
+            "level": state["level"],
+            "coins": state["coins"],
+            "gems": state["gems"],
+            "inventory": state["inventory"],
+            **flags
+        },
+        "$inc": {"revision": 1},
+        "$currentDate": {"updated_at": True}
+    }
+    if energy["energy_updated_at"] is not None:
+        update["$set"].update(energy)
+    if last_activity is not None and (user.get("last_activity") is None or last_activity > user["last_activity"]):
+        update["$set"]["last_activity"] = last_activity
+    # Дни уроков - в календарь стриков по времени устройства (офлайн-урок вчера - вчерашний день)
+    streak = streaks.record_many({**user, **flags}, lesson_times) if lesson_times else None
+    if streak is not None:
+        streak.apply(update)
+        state["streak"] = streak.current
+    plan.user_update = update
+    return plan
+
+
+class OpLog:
+    """Прием пачек операций: свертка по документу пользователя и запись с проверкой revision"""
+
+    def __init__(
+        self,
+        get_db: Callable,
+        streaks: StreakEngine,
+        module_of: Callable[[str], Optional[str]],
+        max_ops: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+        max_attempts: Optional[int] = None
+    ):
+        self._get_db = get_db
+        self.streaks = streaks
+        self.module_of = module_of
+        self.max_ops = max_ops or int(os.environ.get("OPLOG_MAX_OPS", "500"))
+        self.max_age = timedelta(days=max_age_days or float(os.environ.get("OPLOG_MAX_AGE_DAYS", "30")))
+        self.max_attempts = max_attempts or int(os.environ.get("OPLOG_MAX_ATTEMPTS", "3"))
+        self.xp_per_level = int(os.environ.get("XP_PER_LEVEL", "500"))
+        self.stats = {"batches": 0, "applied": 0, "duplicates": 0, "rejected": 0, "conflicts": 0}
+
+    async def acked(self, telegram_id: str) -> Optional[int]:
+        """Принятый high-water mark клиента (None - пользователя нет)"""
+        user = await self._get_db().users.find_one({"telegram_id": telegram_id}, {"_id": 0, "op_seq": 1})
+        return user.get("op_seq", 0) if user is not None else None
+
+    async def apply(self, telegram_id: str, ops: Sequence) -> Tuple[Optional[dict], Optional[OpPlan]]:
+        """(пользователь до записи, план) или (None, None), если пользователя нет"""
+        db = self._get_db()
+        for _ in range(self.max_attempts):
+            user = await db.users.find_one({"telegram_id": telegram_id}, {"_id": 0})
+            if user is None:
+                return None, None
+            plan = plan_ops(
+                user, telegram_id, ops, self.module_of, self.streaks, datetime.utcnow(), self.max_age, self.xp_per_level
+            )
+            if plan.user_update is None:
+                self._count(plan)
+                return user, plan
+
+            # Записи уроков и чек-инов идемпотентны: при повторе попытки они просто совпадут
+            if plan.lesson_writes:
+                await db.lesson_progress.bulk_write(plan.lesson_writes, ordered=True)
+            if plan.checkin_writes:
+                await db.checkins.bulk_write(plan.checkin_writes, ordered=False)
+            revision = user["revision"] if "revision" in user else {"$exists": False}
+            result = await db.users.update_one({"id": user["id"], "revision": revision}, plan.user_update)
+            if result.modified_count:
+                self._count(plan)
+                return user, plan
+            self.stats["conflicts"] += 1
+        raise OpConflict("Прогресс пользователя менялся параллельно, повторите отправку очереди")
+
+    def _count(self, plan: OpPlan):
+        self.stats["batches"] += 1
+        self.stats["applied"] += plan.applied
+        self.stats["duplicates"] += plan.duplicates
+        self.stats["rejected"] += len(plan.rejected)
+
+    def describe(self) -> dict:
+        return dict(self.stats)
@@ -0,0 +1,204 @@
+"""
+Профилирование под боевой нагрузкой (только по токену)
+
+    SamplingProfiler  - сэмплирующий профайлер: фоновый поток раз в PROFILE_INTERVAL_MS
+                        снимает стеки всех потоков (sys._current_frames) и считает
+                        одинаковые стеки. Обработчики не инструментируются, накладные
+                        расходы - только на снятие стеков. Результат - collapsed stacks
+                        ("поток;модуль:функция;... число"), их принимают flamegraph.pl,
+                        speedscope и inferno.
+    ProfileMiddleware - cProfile одного запроса по заголовку X-Profile: 1. Отчет pstats
+                        сохраняется в памяти, его id - в заголовке ответа X-Profile-Id.
+
+Все выключено, пока не задан PROFILING_TOKEN; запросы должны нести его в заголовке
+X-Profiling-Token. Профилируется только воркер, принявший запрос (pid - в ответе).
+
+cProfile включается на поток цикла событий: в отчет попадают и шаги других запросов,
+выполнявшиеся, пока профилируемый запрос ждал MongoDB. Одновременно профилируется
+не больше одного запроса, остальные с X-Profile: 1 идут без профилирования.
+
+Настройки через окружение:
+    PROFILING_TOKEN       - токен доступа (по умолчанию не задан - профилирование выключено)
+    PROFILE_INTERVAL_MS   - период снятия стеков, мс (по умолчанию 5)
+    PROFILE_MAX_SECONDS   - максимальная длительность сэмплирования, сек (по умолчанию 60)
+    PROFILE_KEEP_REPORTS  - сколько отчетов cProfile хранить (по умолчанию 20)
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+TOKEN_HEADER = "x-profiling-token"
+# Чаще 1 мс поток сэмплирования почти не отпускает GIL и тормозит сам воркер
+MIN_INTERVAL_MS = 1.0
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "x-profile-id"
+
+# Листовые функции ожидания: стеки простаивающих потоков по умолчанию не считаем
+IDLE_FUNCTIONS = {
+    "selectors:EpollSelector.select", "selectors:_PollLikeSelector.select", "selectors:KqueueSelector.select",
+    "selectors:SelectSelector.select",
+    "threading:Condition.wait", "threading:Event.wait", "queue:Queue.get", "concurrent.futures.thread:_worker",
+}
+
+
+def profiling_token() -> Optional[str]:
+    return os.environ.get("PROFILING_TOKEN") or None
+
+
+def authorized(token: Optional[str]) -> bool:
+    expected = profiling_token()
+    return bool(expected and token and hmac.compare_digest(token.encode(), expected.encode()))
+
+
+class SamplingProfiler:
+    """Снятие стеков всех потоков с фиксированным периодом"""
+
+    def __init__(self, interval: Optional[float] = None, include_idle: bool = False):
+        self.interval = max(
+            interval or float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000, MIN_INTERVAL_MS / 1000
+        )
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.perf_counter()
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            # co_qualname - с Python 3.11
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{frame.f_globals.get('__name__', '?')}:{name}"
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame))
+                    frame = frame.f_back
+                if not stack or (not self.include_idle and stack[0] in IDLE_FUNCTIONS):
+                    continue
+                stack.append(names.get(ident, str(ident)).replace(";", ":"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """Формат collapsed stacks: по строке на стек, "кадр;кадр;... число" """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 30) -> list:
+        """Функции по собственному (self) и суммарному (total) числу сэмплов"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [
+            {"function": name, "self": count, "total": total[name]}
+            for name, count in own.most_common(limit)
+        ]
+
+    def describe(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "seconds": round(self.stopped_at - self.started_at, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "top": self.top_functions()
+        }
+
+
+class ProfileReports:
+    """Последние отчеты cProfile по запросам"""
+
+    def __init__(self, keep: Optional[int] = None):
+        self.keep = keep or int(os.environ.get("PROFILE_KEEP_REPORTS", "20"))
+        self._reports: "OrderedDict[str, str]" = OrderedDict()
+
+    def add(self, report_id: str, title: str, profile: cProfile.Profile, sort: str = "cumulative", limit: int = 60):
+        stream = io.StringIO()
+        stream.write(title + "\n\n")
+        pstats.Stats(profile, stream=stream).strip_dirs().sort_stats(sort).print_stats(limit)
+        self._reports[report_id] = stream.getvalue()
+        while len(self._reports) > self.keep:
+            self._reports.popitem(last=False)
+
+    def get(self, report_id: str) -> Optional[str]:
+        return self._reports.get(report_id)
+
+    def ids(self) -> list:
+        return list(reversed(self._reports))
+
+
+class ProfileMiddleware:
+    """ASGI middleware: cProfile запроса с заголовками X-Profile: 1 и X-Profiling-Token"""
+
+    def __init__(self, app: ASGIApp, reports: ProfileReports):
+        self.app = app
+        self.reports = reports
+        self._active = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or self._active or not profiling_token():
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER.encode()) != b"1" or not authorized(
+            headers.get(TOKEN_HEADER.encode(), b"").decode("latin-1")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        report_id = uuid.uuid4().hex[:12]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (PROFILE_ID_HEADER.encode(), report_id.encode())]
+            await send(message)
+
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            self._active = False
+            title = f"{scope['method']} {scope['path']} - {(time.perf_counter() - started) * 1000:.1f} мс"
+            self.reports.add(report_id, title, profile)
@@ -0,0 +1,270 @@
+"""
+Проекции журнала событий: XP, уровень и статистика пользователя
+
+Projector сворачивает события пользователя (по времени at) в UserProjection.
+ProjectionRebuilder пересобирает проекции всех пользователей: делит их на чанки,
+параллельно читает события чанков из events, сворачивает и записывает
+users.xp / users.level (только изменившиеся) и коллекцию user_stats.
+
+Формулы задаются здесь, а не в обработчиках, поэтому исправленную формулу можно применить
+ко всей истории:
+
+    python projections.py rebuild --xp-per-level 500 --dry-run
+    python projections.py rebuild --xp-per-level 500
+
+Пользователи, у которых XP появился до журнала, сначала переносятся событием state_imported:
+
+    python projections.py import-state
+
+Настройки через окружение:
+    XP_PER_LEVEL        - XP на уровень (по умолчанию 500)
+    PROJECTION_WORKERS  - параллельных чанков (по умолчанию 4)
+    PROJECTION_CHUNK    - пользователей в чанке (по умолчанию 1000)
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import typer
+from pymongo import ReplaceOne, UpdateOne
+
+from events import (
+    ASSESSMENT, CHECKIN, LESSON_COMPLETED, LESSON_STARTED, PROGRESS_SYNCED, STATE_IMPORTED, EventLog, make_event
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class UserProjection:
+    user_id: str
+    xp: int = 0
+    started: Set[str] = field(default_factory=set)
+    completed: Set[str] = field(default_factory=set)
+    completions: int = 0
+    time_spent: int = 0
+    score_sum: float = 0
+    score_count: int = 0
+    checkins: int = 0
+    assessments: int = 0
+    events: int = 0
+    last_event_at: Optional[datetime] = None
+
+
+class Projector:
+    """Свертка событий; xp_rule - XP за завершение урока (по умолчанию xp_earned из события)"""
+
+    def __init__(self, xp_per_level: Optional[int] = None, xp_rule: Optional[Callable[[dict], int]] = None):
+        self.xp_per_level = xp_per_level or int(os.environ.get("XP_PER_LEVEL", "500"))
+        self.xp_rule = xp_rule or (lambda data: data.get("xp_earned", 0))
+
+    def level(self, xp: int) -> int:
+        return xp // self.xp_per_level + 1
+
+    def apply(self, state: UserProjection, event: dict):
+        kind = event["type"]
+        data = event.get("data") or {}
+        if kind == LESSON_COMPLETED:
+            state.xp += self.xp_rule(data)
+            state.completed.add(data.get("lesson_id"))
+            state.completions += 1
+            state.time_spent += data.get("time_spent") or 0
+            if data.get("score") is not None:
+                state.score_sum += data["score"]
+                state.score_count += 1
+        elif kind == LESSON_STARTED:
+            state.started.add(data.get("lesson_id"))
+        elif kind == CHECKIN:
+            state.checkins += 1
+        elif kind == ASSESSMENT:
+            state.assessments += 1
+        elif kind == PROGRESS_SYNCED:
+            state.xp = data.get("xp", state.xp)
+            state.completed.update(data.get("completed", ()))
+        elif kind == STATE_IMPORTED:
+            state.xp = data.get("xp", 0)
+            state.completed = set(data.get("completed", ()))
+            state.started = set(data.get("started", ()))
+        state.events += 1
+        state.last_event_at = event.get("at")
+
+    def fold(self, events: Iterable[dict]) -> Dict[str, UserProjection]:
+        states: Dict[str, UserProjection] = {}
+        for event in events:
+            state = states.get(event["user_id"])
+            if state is None:
+                state = states[event["user_id"]] = UserProjection(event["user_id"])
+            self.apply(state, event)
+        return states
+
+    def stats_document(self, state: UserProjection) -> dict:
+        return {
+            "user_id": state.user_id,
+            "xp": state.xp,
+            "level": self.level(state.xp),
+            "lessons_started": len(state.started | state.completed),
+            "lessons_completed": len(state.completed),
+            "completions": state.completions,
+            "total_time_minutes": state.time_spent // 60,
+            "average_score": round(state.score_sum / state.score_count, 1) if state.score_count else 0,
+            "checkins": state.checkins,
+            "assessments": state.assessments,
+            "events": state.events,
+            "last_event_at": state.last_event_at,
+            "rebuilt_at": datetime.utcnow()
+        }
+
+
+class ProjectionRebuilder:
+    """Пересборка проекций из events чанками пользователей"""
+
+    def __init__(self, db, projector: Optional[Projector] = None, workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.db = db
+        self.projector = projector or Projector()
+        self.workers = workers or int(os.environ.get("PROJECTION_WORKERS", "4"))
+        self.chunk_size = chunk_size or int(os.environ.get("PROJECTION_CHUNK", "1000"))
+
+    async def rebuild(self, user_ids: Optional[List[str]] = None, write: bool = True) -> dict:
+        """
+        Пересобрать проекции; write=False - только посчитать, у скольких изменятся XP / уровень
+
+        Returns:
+            {"users", "events", "changed", "chunks", "seconds"}
+        """
+        started = time.perf_counter()
+        user_ids = sorted(user_ids if user_ids is not None else await self.db.events.distinct("user_id"))
+        chunks = [user_ids[i:i + self.chunk_size] for i in range(0, len(user_ids), self.chunk_size)]
+        report = {"users": 0, "events": 0, "changed": 0, "chunks": len(chunks)}
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def run(chunk: List[str]):
+            async with semaphore:
+                users, events, changed = await self._rebuild_chunk(chunk, write)
+            report["users"] += users
+            report["events"] += events
+            report["changed"] += changed
+
+        await asyncio.gather(*(run(chunk) for chunk in chunks))
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    async def _rebuild_chunk(self, user_ids: List[str], write: bool):
+        states: Dict[str, UserProjection] = {}
+        # По at, а не по _id: иначе progress_synced (абсолютный XP) и lesson_completed (прибавка)
+        # из разных воркеров внутри одной секунды могли поменяться местами
+        cursor = self.db.events.find({"user_id": {"$in": user_ids}}).sort([("user_id", 1), ("at", 1), ("_id", 1)])
+        events = 0
+        async for event in cursor:
+            state = states.get(event["user_id"])
+            if state is None:
+                state = states[event["user_id"]] = UserProjection(event["user_id"])
+            self.projector.apply(state, event)
+            events += 1
+
+        current = {
+            user["id"]: user
+            async for user in self.db.users.find({"id": {"$in": list(states)}}, {"_id": 0, "id": 1, "xp": 1, "level": 1})
+        }
+        user_updates, stats = [], []
+        for user_id, state in states.items():
+            level = self.projector.level(state.xp)
+            user = current.get(user_id)
+            if user is not None and (user.get("xp", 0), user.get("level", 1)) != (state.xp, level):
+                user_updates.append(UpdateOne(
+                    {"id": user_id},
+                    {"$set": {"xp": state.xp, "level": level}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
+                ))
+            stats.append(ReplaceOne({"user_id": user_id}, self.projector.stats_document(state), upsert=True))
+
+        if write:
+            if user_updates:
+                await self.db.users.bulk_write(user_updates, ordered=False)
+            if stats:
+                await self.db.user_stats.bulk_write(stats, ordered=False)
+        return len(states), events, len(user_updates)
+
+
+async def import_state(db, batch_size: int = 1000) -> int:
+    """
+    Перенести текущее состояние пользователей в журнал событием state_imported
+
+    После него проекция пользователя начинается с его нынешних XP и пройденных уроков.
+    """
+    log = EventLog(lambda: db.events, batch_size=batch_size)
+    await log.ensure_indexes()
+    imported = 0
+
+    async def flush(users: List[dict]):
+        lessons: Dict[str, List[dict]] = {}
+        async for p in db.lesson_progress.find(
+            {"user_id": {"$in": [user["id"] for user in users]}}, {"_id": 0, "user_id": 1, "lesson_id": 1, "status": 1}
+        ):
+            lessons.setdefault(p["user_id"], []).append(p)
+        log.append_many([
+            make_event(
+                STATE_IMPORTED, user["id"],
+                xp=user.get("xp", 0),
+                completed=[p["lesson_id"] for p in lessons.get(user["id"], []) if p.get("status") == "completed"],
+                started=[p["lesson_id"] for p in lessons.get(user["id"], [])]
+            )
+            for user in users
+        ])
+        await log.flush()
+
+    batch: List[dict] = []
+    async for user in db.users.find({}, {"_id": 0, "id": 1, "xp": 1}):
+        batch.append(user)
+        imported += 1
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    await log.close()
+    return imported
+
+
+# ========== CLI ==========
+
+cli = typer.Typer(help="Проекции журнала событий")
+
+
+def _database(mongo_url: str, db_name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(mongo_url)[db_name]
+
+
+@cli.command()
+def rebuild(
+    mongo_url: str = typer.Option("mongodb://localhost:27017", envvar="MONGO_URL"),
+    db_name: str = typer.Option("myteens_space", envvar="DB_NAME"),
+    xp_per_level: Optional[int] = typer.Option(None, help="XP на уровень (по умолчанию XP_PER_LEVEL)"),
+    workers: Optional[int] = typer.Option(None, help="Параллельных чанков"),
+    chunk: Optional[int] = typer.Option(None, help="Пользователей в чанке"),
+    dry_run: bool = typer.Option(False, help="Только посчитать изменения")
+):
+    """Пересобрать XP, уровень и user_stats из events"""
+    rebuilder = ProjectionRebuilder(_database(mongo_url, db_name), Projector(xp_per_level), workers, chunk)
+    report = asyncio.run(rebuilder.rebuild(write=not dry_run))
+    typer.echo(
+        f"{'Проверено' if dry_run else 'Пересобрано'}: {report['users']} пользователей, {report['events']} событий, "
+        f"изменится XP/уровень у {report['changed']} ({report['chunks']} чанков, {report['seconds']} с)"
+    )
+
+
+@cli.command("import-state")
+def import_state_command(
+    mongo_url: str = typer.Option("mongodb://localhost:27017", envvar="MONGO_URL"),
+    db_name: str = typer.Option("myteens_space", envvar="DB_NAME")
+):
+    """Записать текущее состояние пользователей в журнал (один раз при включении журнала)"""
+    imported = asyncio.run(import_state(_database(mongo_url, db_name)))
+    typer.echo(f"Перенесено пользователей: {imported}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,318 @@
+"""
+Статистика форм запросов к MongoDB и журнал медленных запросов
+
+QueryStats - слушатель command monitoring PyMongo (передается в mongo_client_options).
+Каждая команда чтения и записи сводится к форме: коллекция, команда, фильтр со значениями,
+замененными на "?", и сортировка. Например, все
+lesson_progress.find_one({"user_id": ...}, sort=[("started_at", -1)]) - одна форма:
+
+    lesson_progress.find {"user_id": "?"} sort {"started_at": -1}
+
+По формам в скользящем окне QUERY_STATS_WINDOW_S секунд копятся число вызовов, время и
+число возвращенных документов - /api/metrics/queries показывает самые тяжелые. Маршрут
+раскрывает коллекции, фильтры и планы с именами индексов, поэтому закрыт как /debug/*:
+без PROFILING_TOKEN - 404, с ним нужен заголовок X-Profiling-Token.
+
+Команда дольше QUERY_SLOW_MS логируется с кратким explain (план, просмотренные ключи и
+документы). explain повторяет запрос, поэтому для одной формы он выполняется не чаще раза
+в QUERY_EXPLAIN_INTERVAL_S секунд; просмотренные документы в статистике - из этих explain.
+
+Слушатель вызывается в потоках PyMongo: счетчики под блокировкой, explain планируется в
+цикл событий воркера (attach() в lifespan).
+
+Настройки через окружение:
+    QUERY_STATS_ENABLED       - 0, чтобы не собирать статистику (по умолчанию 1)
+    QUERY_STATS_WINDOW_S      - окно статистики, сек (по умолчанию 300)
+    QUERY_SLOW_MS             - порог медленного запроса, мс (по умолчанию 100)
+    QUERY_EXPLAIN_INTERVAL_S  - не чаще одного explain на форму, сек (по умолчанию 60; 0 - без explain)
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Команды, по которым считаем формы; остальные (ping, hello, getMore, explain...) пропускаем
+TRACKED_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify", "insert"}
+EXPLAINABLE_COMMANDS = TRACKED_COMMANDS - {"insert"}
+# Служебные поля команды, которые нельзя передать в explain
+SESSION_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction"}
+
+BUCKETS = 10
+QUERY_ORDERS = ("total_ms", "count", "avg_ms", "max_ms", "slow", "returned")
+
+
+def shape(value: Any) -> Any:
+    """Фильтр без значений: {"user_id": "u1", "status": {"$in": [...]}} -> {"status": {"$in": "[?]"}, "user_id": "?"}"""
+    if isinstance(value, dict):
+        return {key: shape(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [shape(item) for item in value]
+        return "[?]"
+    return "?"
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(", ", ": "), default=str)
+
+
+def command_shape(name: str, command: dict) -> Optional[tuple]:
+    """(коллекция, строка формы) или None для неотслеживаемых команд"""
+    if name not in TRACKED_COMMANDS:
+        return None
+    collection = command.get(name)
+    if not isinstance(collection, str):
+        return None
+    if name == "find":
+        text = _dumps(shape(command.get("filter", {})))
+        if command.get("sort"):
+            text += " sort " + _dumps(dict(command["sort"]))
+    elif name == "aggregate":
+        stages = []
+        for stage in command.get("pipeline", []):
+            operator = next(iter(stage))
+            stages.append(f"{operator} {_dumps(shape(stage[operator]))}" if operator == "$match" else operator)
+        text = "[" + ", ".join(stages) + "]"
+    elif name in ("count", "findAndModify"):
+        text = _dumps(shape(command.get("query", {})))
+    elif name == "distinct":
+        text = f"{command.get('key')} {_dumps(shape(command.get('query', {})))}"
+    elif name == "update":
+        updates = command.get("updates") or [{}]
+        text = _dumps(shape(updates[0].get("q", {})))
+        if updates[0].get("upsert"):
+            text += " upsert"
+    elif name == "delete":
+        text = _dumps(shape((command.get("deletes") or [{}])[0].get("q", {})))
+    else:
+        text = ""
+    return collection, f"{collection}.{name} {text}".rstrip()
+
+
+def docs_returned(name: str, reply: dict) -> int:
+    if "cursor" in reply:
+        return len(reply["cursor"].get("firstBatch", ()))
+    if name == "distinct":
+        return len(reply.get("values", ()))
+    if name == "findAndModify":
+        return 1 if reply.get("value") is not None else 0
+    return int(reply.get("n", 0))
+
+
+def explain_command(name: str, command: dict) -> dict:
+    """Команда для explain: без полей сессии, для записей - только первая операция"""
+    explained = {key: value for key, value in command.items() if key not in SESSION_FIELDS}
+    if name == "update":
+        explained["updates"] = explained["updates"][:1]
+    elif name == "delete":
+        explained["deletes"] = explained["deletes"][:1]
+    return explained
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        children = plan.get("inputStages") or ([plan["inputStage"]] if plan.get("inputStage") else [])
+        plan = children[0] if children else None
+    return list(reversed(stages))
+
+
+def plan_summary(explain: dict) -> dict:
+    """Краткий explain: цепочка стадий выигравшего плана и executionStats"""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # aggregate: план первой стадии $cursor
+        for stage in explain.get("stages", ()):
+            if "$cursor" in stage:
+                explain = stage["$cursor"]
+                planner = explain.get("queryPlanner")
+                break
+    summary: Dict[str, Any] = {}
+    if planner:
+        winning = planner.get("winningPlan", {})
+        # SBE (MongoDB 7+) кладет план в winningPlan.queryPlan
+        summary["plan"] = " -> ".join(_plan_stages(winning.get("queryPlan", winning)))
+    stats = explain.get("executionStats")
+    if stats:
+        summary.update({
+            "keys_examined": stats.get("totalKeysExamined", 0),
+            "docs_examined": stats.get("totalDocsExamined", 0),
+            "returned": stats.get("nReturned", 0),
+            "explain_ms": stats.get("executionTimeMillis", 0)
+        })
+    return summary
+
+
+class QueryStats(monitoring.CommandListener):
+    """Формы запросов в скользящем окне, медленные запросы с explain"""
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        window: Optional[float] = None,
+        slow_ms: Optional[float] = None,
+        explain_interval: Optional[float] = None
+    ):
+        self.enabled = enabled if enabled is not None else os.environ.get("QUERY_STATS_ENABLED", "1") != "0"
+        self.window = window or float(os.environ.get("QUERY_STATS_WINDOW_S", "300"))
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.environ.get("QUERY_SLOW_MS", "100"))
+        self.explain_interval = (
+            explain_interval if explain_interval is not None
+            else float(os.environ.get("QUERY_EXPLAIN_INTERVAL_S", "60"))
+        )
+        self._bucket_seconds = self.window / BUCKETS
+        # deque[(начало корзины, {форма: счетчики})]
+        self._buckets: deque = deque()
+        self._pending: Dict[int, tuple] = {}
+        self._plans: Dict[str, dict] = {}
+        self._explained_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+        self.slow_total = 0
+
+    def attach(self, client):
+        """Клиент и цикл событий для explain медленных запросов (вызывать в lifespan)"""
+        self._client = client
+        self._loop = asyncio.get_running_loop()
+
+    def detach(self):
+        self._client = self._loop = None
+
+    # ========== Слушатель PyMongo (потоки драйвера) ==========
+
+    def started(self, event):
+        if not self.enabled:
+            return
+        name = event.command_name
+        described = command_shape(name, event.command)
+        if described is not None:
+            self._pending[event.request_id] = (name, event.database_name, described[1], event.command)
+
+    def succeeded(self, event):
+        pending = self._pending.pop(event.request_id, None)
+        if pending is not None:
+            self._record(pending, event.duration_micros / 1000, docs_returned(pending[0], event.reply))
+
+    def failed(self, event):
+        pending = self._pending.pop(event.request_id, None)
+        if pending is not None:
+            self._record(pending, event.duration_micros / 1000, 0, failed=True)
+
+    def _record(self, pending: tuple, ms: float, returned: int, failed: bool = False):
+        name, database, key, command = pending
+        slow = ms >= self.slow_ms
+        with self._lock:
+            stats = self._bucket().get(key)
+            if stats is None:
+                stats = self._bucket()[key] = {
+                    "count": 0, "total_ms": 0.0, "max_ms": 0.0, "returned": 0, "slow": 0, "failed": 0
+                }
+            stats["count"] += 1
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            stats["returned"] += returned
+            stats["slow"] += slow
+            stats["failed"] += failed
+            if slow:
+                self.slow_total += 1
+        if slow:
+            self._on_slow(name, database, key, command, ms)
+
+    def _bucket(self) -> dict:
+        """Текущая корзина окна (под блокировкой)"""
+        now = time.monotonic()
+        if not self._buckets or now - self._buckets[-1][0] >= self._bucket_seconds:
+            self._buckets.append((now, {}))
+        while now - self._buckets[0][0] > self.window:
+            self._buckets.popleft()
+        return self._buckets[-1][1]
+
+    # ========== Медленные запросы ==========
+
+    def _on_slow(self, name: str, database: str, key: str, command: dict, ms: float):
+        now = time.monotonic()
+        loop = self._loop
+        if (
+            name in EXPLAINABLE_COMMANDS and self.explain_interval > 0 and loop is not None
+            and now - self._explained_at.get(key, float("-inf")) >= self.explain_interval
+        ):
+            self._explained_at[key] = now
+            loop.call_soon_threadsafe(self._start_explain, name, database, key, explain_command(name, command), ms)
+            return
+        plan = self._plans.get(key)
+        logger.warning(f"Медленный запрос {ms:.0f} мс: {key}" + (f"; план: {self._describe_plan(plan)}" if plan else ""))
+
+    def _start_explain(self, name: str, database: str, key: str, command: dict, ms: float):
+        if self._client is not None:
+            asyncio.create_task(self._explain(database, key, command, ms))
+
+    async def _explain(self, database: str, key: str, command: dict, ms: float):
+        try:
+            explain = await self._client[database].command({"explain": command, "verbosity": "executionStats"})
+        except Exception as e:
+            logger.warning(f"Медленный запрос {ms:.0f} мс: {key}; explain не удался: {e}")
+            return
+        plan = self._plans[key] = plan_summary(explain)
+        logger.warning(f"Медленный запрос {ms:.0f} мс: {key}; план: {self._describe_plan(plan)}")
+
+    @staticmethod
+    def _describe_plan(plan: dict) -> str:
+        text = plan.get("plan", "?")
+        if "docs_examined" in plan:
+            text += (
+                f", ключей {plan['keys_examined']}, документов {plan['docs_examined']}, "
+                f"вернул {plan['returned']}"
+            )
+        return text
+
+    # ========== Отчет ==========
+
+    def top(self, limit: int = 20, order: str = "total_ms") -> List[dict]:
+        """Формы за окно, по убыванию order (одно из QUERY_ORDERS)"""
+        merged: Dict[str, dict] = {}
+        with self._lock:
+            self._bucket()
+            for _, bucket in self._buckets:
+                for key, stats in bucket.items():
+                    total = merged.setdefault(key, {
+                        "count": 0, "total_ms": 0.0, "max_ms": 0.0, "returned": 0, "slow": 0, "failed": 0
+                    })
+                    for field, value in stats.items():
+                        total[field] = max(total[field], value) if field == "max_ms" else total[field] + value
+        shapes = []
+        for key, stats in merged.items():
+            entry = {"shape": key, **stats, "avg_ms": stats["total_ms"] / stats["count"]}
+            plan = self._plans.get(key)
+            if plan:
+                entry["plan"] = plan
+            shapes.append(entry)
+        shapes.sort(key=lambda entry: entry.get(order, 0), reverse=True)
+        for entry in shapes[:limit]:
+            for field in ("total_ms", "max_ms", "avg_ms"):
+                entry[field] = round(entry[field], 2)
+        return shapes[:limit]
+
+    def describe(self) -> dict:
+        with self._lock:
+            shapes = len({key for _, bucket in self._buckets for key in bucket})
+        return {
+            "enabled": self.enabled,
+            "window_s": self.window,
+            "slow_ms": self.slow_ms,
+            "shapes": shapes,
+            "slow_total": self.slow_total
+        }
+
@@ -0,0 +1,168 @@
+"""
+Ограничение частоты запросов (token bucket)
+
+У каждого ключа (user_id, telegram_id или IP клиента) есть корзина на burst токенов,
+которая пополняется со скоростью rate токенов в секунду. Запрос тратит токен; если
+токенов нет - 429 и Retry-After через сколько секунд токен появится.
+
+Правила задаются на маршрут и переопределяются переменными окружения:
+    RATE_LIMIT_ENABLED=0                 - выключить полностью
+    RATE_LIMIT_AUTH_LOGIN="10/60"        - 10 запросов за 60 секунд (burst = 10)
+    RATE_LIMIT_SYNC_PROGRESS="30/60:5"   - 30 в минуту, не больше 5 подряд
+
+IP клиента за прокси (правила с key="ip"):
+    TRUST_PROXY=1                        - брать адрес из X-Forwarded-For, а не адрес соединения
+    TRUST_PROXY_HOPS=2                   - сколько доверенных прокси перед приложением (по умолчанию 1)
+
+При одном воркере корзины живут в памяти процесса, при нескольких - в общем
+координаторе (COORDINATION_URL=redis://...).
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    rate: float  # токенов в секунду
+    burst: int  # емкость корзины
+    key: str = "ip"  # "ip", "user_id" или "telegram_id"
+
+    @classmethod
+    def parse(cls, value: str, key: str) -> "RateLimitRule":
+        """"10/60" или "10/60:5" -> 10 запросов за 60 секунд, burst 5"""
+        limit, _, burst = value.partition(":")
+        count, _, period = limit.partition("/")
+        count = int(count)
+        return cls(rate=count / float(period or 1), burst=int(burst) if burst else count, key=key)
+
+
+DEFAULT_RULES = {
+    # Перебор 6-символьных кодов: 5 попыток в минуту с одного IP
+    "auth_login": RateLimitRule(rate=5 / 60, burst=5, key="ip"),
+    "sync_progress": RateLimitRule(rate=30 / 60, burst=5, key="telegram_id"),
+    # Пачка очереди за запрос: повторы при плохой сети, но не поток по одной операции
+    "sync_ops": RateLimitRule(rate=30 / 60, burst=10, key="telegram_id"),
+    "complete_lesson": RateLimitRule(rate=60 / 60, burst=10, key="telegram_id"),
+    "checkin": RateLimitRule(rate=10 / 60, burst=5, key="user_id"),
+    "economy": RateLimitRule(rate=60 / 60, burst=20, key="user_id"),
+    "lessons_reload": RateLimitRule(rate=2 / 60, burst=2, key="ip"),
+}
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "idle_after")
+
+    def __init__(self, tokens: float, updated: float, idle_after: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.idle_after = idle_after
+
+
+class TokenBuckets:
+    """
+    Корзины в памяти процесса
+
+    Одна корзина - O(1) памяти. Корзины упорядочены по последнему обращению;
+    корзина, простоявшая дольше времени полного пополнения, неотличима от
+    новой и удаляется с головы очереди при следующих обращениях.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        """Списать cost токенов; вернуть 0 или сколько секунд ждать"""
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = _Bucket(float(burst), now, burst / rate)
+        else:
+            bucket.tokens = min(float(burst), bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        retry_after = 0.0
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+        else:
+            retry_after = (cost - bucket.tokens) / rate
+        self._buckets[key] = bucket
+
+        self._evict(now)
+        return retry_after
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        for _ in range(2):
+            if not buckets:
+                break
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket.updated < bucket.idle_after and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedTokenBuckets:
+    """Корзины в общем координаторе - одинаковые лимиты во всех воркерах"""
+
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+
+    async def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        return await self.coordinator.take_token(f"ratelimit:{key}", rate, burst, cost)
+
+
+class RateLimiter:
+    """Правила по маршрутам + хранилище корзин"""
+
+    def __init__(self, coordinator, rules: Optional[Dict[str, RateLimitRule]] = None, env=os.environ):
+        self.enabled = env.get("RATE_LIMIT_ENABLED", "1") not in ("0", "false", "False")
+        self.rules = dict(rules or DEFAULT_RULES)
+        for name, rule in list(self.rules.items()):
+            override = env.get(f"RATE_LIMIT_{name.upper()}")
+            if override:
+                self.rules[name] = RateLimitRule.parse(override, rule.key)
+        if coordinator.backend == "memory":
+            self.buckets = TokenBuckets()
+        else:
+            self.buckets = SharedTokenBuckets(coordinator)
+
+    async def check(self, name: str, request: Request):
+        if not self.enabled:
+            return
+        rule = self.rules[name]
+        subject = request.query_params.get(rule.key) if rule.key != "ip" else None
+        key = f"{name}:{rule.key}:{subject}" if subject else f"{name}:ip:{client_ip(request)}"
+
+        retry_after = await self.buckets.take(key, rule.rate, rule.burst)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов, попробуйте позже",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+
+def client_ip(request: Request) -> str:
+    """
+    IP клиента; за прокси (TRUST_PROXY=1) - адрес, который дописал доверенный прокси
+
+    Левые адреса X-Forwarded-For пишет сам клиент: по ним новый адрес на каждый запрос
+    давал бы новую корзину. Каждый прокси дописывает адрес справа, поэтому берется
+    TRUST_PROXY_HOPS-й адрес с конца.
+    """
+    if os.environ.get("TRUST_PROXY") == "1":
+        hops = max(1, int(os.environ.get("TRUST_PROXY_HOPS", "1")))
+        forwarded = [address.strip() for address in request.headers.get("x-forwarded-for", "").split(",")]
+        if len(forwarded) >= hops and forwarded[-hops]:
+            return forwarded[-hops]
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,135 @@
+"""
+Быстрая JSON-сериализация ответов
+
+FastAPI по умолчанию прогоняет возвращаемый dict через jsonable_encoder (рекурсивный
+обход с копированием) и потом через stdlib json. Для длинных списков (ростер куратора,
+прогресс уроков) это заметная доля времени ответа. FastJSONResponse сериализует
+документы MongoDB (datetime, Enum, ObjectId) напрямую через orjson, а если
+orjson не установлен - через json с default-обработчиком.
+
+Обработчики горячих эндпоинтов возвращают json_response(...) - готовый Response,
+который FastAPI отдает как есть, без jsonable_encoder.
+
+Там же - разреженные наборы полей (?fields=id,name,progress.boundaries): экрану
+мини-приложения обычно нужна малая часть документа.
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict, Iterable, Optional
+
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+
+def _default(value: Any):
+    """Типы, которые не умеет сериализатор: ObjectId, Decimal128, bytes, set"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+else:
+    def dumps(content: Any) -> bytes:
+        return json.dumps(
+            content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse на orjson (или stdlib json как запасной вариант)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> FastJSONResponse:
+    """
+    Готовый ответ без jsonable_encoder
+
+    response - внедренный FastAPI Response обработчика: его заголовки (ETag и т.п.)
+    и статус переносятся в возвращаемый ответ.
+    """
+    result = FastJSONResponse(content, status_code=status_code)
+    if response is not None:
+        if response.status_code:
+            result.status_code = response.status_code
+        for name, value in response.headers.items():
+            if name not in ("content-length", "content-type"):
+                result.headers[name] = value
+    return result
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    "id,name,progress.boundaries" -> {"id": None, "name": None, "progress": {"boundaries": None}}
+
+    None в дереве - поле целиком; сам результат None - параметр не передан, нужен весь документ.
+    """
+    if not fields:
+        return None
+    tree: Dict[str, Any] = {}
+    for path in fields.split(","):
+        parts = [part for part in path.strip().split(".") if part]
+        if not parts:
+            continue
+        node = tree
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break  # родитель уже запрошен целиком
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree or None
+
+
+def wants(tree: Optional[Dict[str, Any]], *names: str) -> bool:
+    """Нужно ли хотя бы одно из полей верхнего уровня (чтобы не читать лишнее из БД)"""
+    return tree is None or any(name in tree for name in names)
+
+
+def select_fields(content: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    """Оставить в документе (или списке документов) только поля из дерева"""
+    if tree is None:
+        return content
+    if isinstance(content, list):
+        return [select_fields(item, tree) for item in content]
+    if not isinstance(content, dict):
+        return content
+    return {
+        name: content[name] if subtree is None else select_fields(content[name], subtree)
+        for name, subtree in tree.items() if name in content
+    }
+
+
+def fields_projection(tree: Optional[Dict[str, Any]], required: Iterable[str] = ()) -> Dict[str, int]:
+    """Проекция MongoDB для дерева полей; required нужны самому обработчику"""
+    if tree is None:
+        return {"_id": 0}
+    projection = {"_id": 0}
+    stack = [("", tree)]
+    while stack:
+        prefix, node = stack.pop()
+        for name, subtree in node.items():
+            if subtree is None:
+                projection[prefix + name] = 1
+            else:
+                stack.append((f"{prefix}{name}.", subtree))
+    for name in required:
+        projection[name] = 1
+    return projection
@@ -0,0 +1,87 @@
+"""
+Ревизии пользователей для ETag / If-None-Match
+
+Каждая запись, меняющая то, что отдают читающие эндпоинты пользователя, увеличивает
+users.revision (обычно тем же update_one, что и основная запись) и сбрасывает
+закэшированную ревизию во всех воркерах. Чтение сначала сверяет ревизию:
+если ETag клиента совпал - 304 без запроса данных, а при ревизии в кэше -
+вообще без похода в MongoDB.
+
+Записи в обход API (скрипты, пересборка проекций) кэш сбрасывает лента изменений:
+on_change подписан на users в change_feed.py.
+"""
+from typing import Callable, Optional, Tuple
+
+from change_feed import Change
+from coordination import Coordinator, LocalCache
+
+# Страховка от гонки "прочитали старую ревизию - запись сбросила кэш - положили старую"
+REVISION_CACHE_TTL = 30
+
+
+class Revisions:
+    def __init__(self, get_users: Callable, coordinator: Coordinator):
+        self._get_users = get_users
+        self.cache = LocalCache(coordinator, "revision", maxsize=50000, ttl=REVISION_CACHE_TTL)
+        # telegram_id -> id пользователя не меняется, инвалидация не нужна
+        self.telegram_ids = LocalCache(coordinator, "telegram-id", maxsize=50000)
+
+    async def current(self, user_id: str) -> Optional[int]:
+        """Ревизия пользователя или None, если его нет"""
+        revision = self.cache.get(user_id)
+        if revision is None:
+            user = await self._get_users().find_one({"id": user_id}, {"_id": 0, "revision": 1})
+            if user is None:
+                return None
+            revision = user.get("revision", 0)
+            self.cache.set(user_id, revision)
+        return revision
+
+    async def current_by_telegram(self, telegram_id: str) -> Tuple[Optional[str], Optional[int]]:
+        """(id пользователя, ревизия) по telegram_id"""
+        user_id = self.telegram_ids.get(telegram_id)
+        if user_id is not None:
+            return user_id, await self.current(user_id)
+
+        user = await self._get_users().find_one({"telegram_id": telegram_id}, {"_id": 0, "id": 1, "revision": 1})
+        if user is None:
+            return None, None
+        self.telegram_ids.set(telegram_id, user["id"])
+        self.cache.set(user["id"], user.get("revision", 0))
+        return user["id"], user.get("revision", 0)
+
+    def cached(self, user_id: str) -> Optional[int]:
+        """Ревизия из кэша воркера без похода в MongoDB (None - неизвестна)"""
+        return self.cache.get(user_id)
+
+    def user_id_for(self, telegram_id: str) -> Optional[str]:
+        """id пользователя по telegram_id, если воркер его уже видел"""
+        return self.telegram_ids.get(telegram_id)
+
+    def remember(self, user: dict):
+        """Документ пользователя уже прочитан обработчиком: запомнить ревизию и telegram_id"""
+        if "revision" in user:
+            self.cache.set(user["id"], user["revision"])
+        if user.get("telegram_id"):
+            self.telegram_ids.set(user["telegram_id"], user["id"])
+
+    async def bumped(self, user_id: str):
+        """Вызвать после записи, которая уже сделала $inc: {revision: 1}"""
+        await self.cache.invalidate(user_id)
+
+    async def bump(self, user_id: str):
+        """Увеличить ревизию отдельной записью (когда users не обновлялся)"""
+        await self._get_users().update_one({"id": user_id}, {"$inc": {"revision": 1}, "$currentDate": {"updated_at": True}})
+        await self.bumped(user_id)
+
+    def on_change(self, change: Change):
+        """Изменение users из ленты: каждый воркер читает ленту сам, поэтому сброс локальный"""
+        if change.operation == "reset" or change.user_id is None:
+            # Сброс позиции или удаление без документа - неизвестно, чей кэш устарел
+            self.cache.clear()
+            if change.operation == "reset":
+                self.telegram_ids.clear()
+            return
+        self.cache.discard(change.user_id)
+        if change.operation == "delete":
+            self.telegram_ids.clear()
@@ -1,12 +1,14 @@
-from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from contextlib import asynccontextmanager
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import uuid
 from datetime import datetime, timedelta
 import random
@@ -16,7 +18,77 @@ import string
 from telegram_auth import validate_telegram_webapp_data, parse_telegram_user_data
 
 # Импортируем модели
-from models import UserRole
+from models import (
+    UserRole, User, UserCreate, UserUpdate, CheckIn,
+    MarkReadRequest, BatchRequest, ProgressSnapshot, RosterEntry, SyncedProgress, UserStats,
+    Leaderboard, LeaderboardRank, StreakCalendar, BalanceComparison, CohortBalanceComparison,
+    SyncOpsRequest, SyncOpsResult, Wallet
+)
+
+# Координация между воркерами (кэши, счетчики)
+from coordination import create_coordinator, LocalCache
+
+# Настройки пула MongoDB и маршрутизация чтений
+from database import analytics_database, describe_client, mongo_client_options
+
+# Формы запросов к MongoDB и медленные запросы с explain
+from query_stats import QUERY_ORDERS, QueryStats
+
+# Ограничение частоты запросов на пишущих эндпоинтах
+from rate_limit import RateLimiter
+
+# Повторы запросов с Idempotency-Key не выполняются дважды
+from idempotency import IDEMPOTENCY_TTL, IdempotencyMiddleware, IdempotencyStore
+
+# Ревизии пользователей для ETag / 304
+from revisions import Revisions
+
+# Сериализация ответов через orjson без jsonable_encoder и ?fields=
+from responses import FastJSONResponse, fields_projection, json_response, parse_fields, select_fields, wants
+
+# Сжатие ответов Brotli / GZip
+from compression import CompressionMiddleware
+
+# Каталог уроков (число уроков в модулях, модуль по id урока)
+from lesson_catalog import LessonCatalogService
+
+# Пакетные запросы: несколько вызовов за один round trip
+from batch import BATCH_MAX_REQUESTS, BatchExecutor, RequestCache
+
+# Независимые чтения внутри обработчика - параллельно
+from fanout import Fanout
+
+# Фоновые задачи (достижения, уведомления) с outbox в MongoDB
+from jobs import JobQueue
+
+# Рейтинги по XP: skip list в памяти или sorted sets в Redis
+from leaderboard import Leaderboards
+
+# Стрики по календарю активности (битмапы дней в документе пользователя)
+from streaks import StreakEngine
+
+# Журнал событий прогресса (для пересборки проекций, см. projections.py)
+from events import ASSESSMENT, CHECKIN, LESSON_COMPLETED, LESSON_STARTED, PROGRESS_SYNCED, EventLog, make_event
+
+# История оценок колеса баланса (один документ на пользователя, баллы упакованы в байты)
+from balance_history import BalanceHistory, make_entry, unpack_scores, validate_scores
+
+# Монеты, самоцветы, инвентарь и энергия: условные $inc на сервере, энергия считается при чтении
+from economy import ENERGY_MAX, WALLET_PROJECTION, Economy, EconomyError, catalog as shop_catalog, import_fields, wallet
+
+# Офлайн-очередь операций клиента (уроки, покупки, предметы, чек-ины) пачками
+from oplog import OpConflict, OpLog, level_for
+
+# Лента изменений MongoDB (change streams или опрос) для кэшей и рейтингов воркера
+from change_feed import ChangeFeed
+
+# Прогрев при старте и /healthz, /readyz
+from health import Readiness, warm_pool, warmup_connections
+
+# Сэмплирующий профайлер и cProfile запросов (только с PROFILING_TOKEN)
+from profiling import (
+    MIN_INTERVAL_MS, ProfileMiddleware, ProfileReports, SamplingProfiler, TOKEN_HEADER, authorized, profiling_token
+)
 
 # Импортируем модели (сначала загружаем .env, потом импортируем)
 ROOT_DIR = Path(__file__).parent
@@ -24,67 +96,194 @@ ROOT_DIR = Path(__file__).parent
 # Импорты моделей будут после определения классов
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'myteens_space')]
+# Формы запросов и медленные запросы (слушатель команд клиента MongoDB)
+query_stats = QueryStats()
+
+# MongoDB connection (пул, таймауты и сжатие - из MONGO_* переменных, см. database.py).
+# Клиент создается в lifespan, а не при импорте: импорт модуля не трогает MongoDB
+client: Optional[AsyncIOMotorClient] = None
+db = None
+# Аналитические чтения (ростер куратора, статистика) - с secondary, если они есть
+analytics_db = None
+
+
+def connect_database(database=None):
+    """
+    Создать клиент MongoDB (один раз на воркер)
+
+    database - готовая база (тестовый стенд): своего клиента и прогрева пула тогда нет.
+    """
+    global client, db, analytics_db
+    if database is not None:
+        client, db, analytics_db = None, database, database
+    elif db is None:
+        client = AsyncIOMotorClient(
+            os.environ.get('MONGO_URL', 'mongodb://localhost:27017'), **mongo_client_options(listeners=[query_stats])
+        )
+        db = client[os.environ.get('DB_NAME', 'myteens_space')]
+        analytics_db = analytics_database(db)
+    return db
+
+
+# Общее состояние воркеров: memory:// для одного процесса, redis://... для нескольких
+coordinator = create_coordinator(os.environ.get('COORDINATION_URL'))
+rate_limiter = RateLimiter(coordinator)
+idempotency_store = IdempotencyStore(
+    lambda: db.idempotency_keys,
+    LocalCache(coordinator, "idempotency", maxsize=10000, ttl=IDEMPOTENCY_TTL)
+)
+revisions = Revisions(lambda: db.users, coordinator)
+lesson_catalog = LessonCatalogService(lambda: db.lessons, coordinator)
+jobs = JobQueue(lambda: db.jobs)
+leaderboards = Leaderboards(coordinator)
+streaks = StreakEngine()
+events = EventLog(lambda: db.events)
+balance_history = BalanceHistory(lambda: db.balance_history)
+economy = Economy(lambda: db.users)
+oplog = OpLog(lambda: db, streaks, lambda lesson_id: lesson_catalog.current.module_of(lesson_id))
+change_feed = ChangeFeed(lambda: db)
+change_feed.subscribe(revisions.on_change, ("users",))
+change_feed.subscribe(leaderboards.on_change, ("users",))
+readiness = Readiness()
+profile_reports = ProfileReports()
+profiling_lock = asyncio.Lock()
+# Режим параллельных чтений (fanout.py); None - FANOUT_MODE из окружения
+fanout_mode: Optional[str] = None
+
+
+async def create_indexes():
+    await idempotency_store.ensure_indexes()
+    await jobs.ensure_indexes()
+    await events.ensure_indexes()
+    await balance_history.ensure_indexes()
+    await change_feed.ensure_indexes()
+
+
+async def warm_database() -> bool:
+    """Ping и пул (обязательно для готовности), затем индексы и рейтинги"""
+    if client is not None:
+        if not await readiness.step("mongo", lambda: warm_pool(db, warmup_connections(client)), required=True):
+            return False
+    await readiness.step("indexes", create_indexes)
+    await readiness.step("leaderboards", lambda: leaderboards.rebuild(db.users))
+    return True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Подключение и прогрев воркера; /readyz отвечает 200 только после них"""
+    connect_database()
+    if client is not None:
+        query_stats.attach(client)
+    await coordinator.start()
+    if int(os.environ.get('WEB_CONCURRENCY', '1')) > 1 and coordinator.backend == "memory":
+        logger.warning("Несколько воркеров с COORDINATION_URL=memory:// - кэши и счетчики не общие")
+
+    database_ready = await warm_database()
+    await readiness.step("lesson_catalog", lesson_catalog.start)
+    await jobs.start()
+    await change_feed.start()
+    readiness.finish(retry=None if database_ready else warm_database)
+    try:
+        yield
+    finally:
+        await readiness.drain()
+        await change_feed.close()
+        await jobs.close()
+        await events.close()
+        await lesson_catalog.close()
+        await coordinator.close()
+        query_stats.detach()
+        if client is not None:
+            client.close()
+
 
 # Create the main app without a prefix
-app = FastAPI(title="MyTeens.Space API", version="2.0.0")
+app = FastAPI(
+    title="MyTeens.Space API", version="2.0.0", default_response_class=FastJSONResponse, lifespan=lifespan
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Проекция без _id: документы сразу готовы к ответу, без pop в цикле
+NO_ID = {"_id": 0}
+
+
+def rate_limited(name: str):
+    """Зависимость маршрута: token bucket по правилу name (429 + Retry-After)"""
+    async def check(request: Request):
+        await rate_limiter.check(name, request)
+    return Depends(check)
+
+
+async def require_profiling(request: Request):
+    """
+    Служебные маршруты (/debug/*, /metrics/queries, /lessons/reload) выключены без
+    PROFILING_TOKEN; с ним - только по заголовку X-Profiling-Token
+    """
+    if not profiling_token():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorized(request.headers.get(TOKEN_HEADER)):
+        raise HTTPException(status_code=403, detail="Неверный токен профилирования")
+
+
+def etag_for(revision) -> str:
+    return f'W/"{app.version}-{revision}"'
+
+
+def not_modified(request: Request, response: Response, revision) -> Optional[Response]:
+    """Проставить ETag по ревизии; вернуть 304, если у клиента та же версия"""
+    etag = etag_for(revision)
+    response.headers["ETag"] = etag
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+async def conditional_get(
+    request: Request, response: Response, user_id: str = None, telegram_id: str = None, etag: bool = False
+):
+    """
+    304 по If-None-Match до чтения данных
+
+    Без заголовка ревизию отдельно не читаем - обработчик проставит ETag
+    по полю revision из документа пользователя, который и так загружает.
+    etag=True - обработчик документ пользователя не читает: ревизия читается здесь
+    и ETag проставляется и без заголовка.
+    """
+    if "if-none-match" not in request.headers and not etag:
+        return None
+    if telegram_id is not None:
+        _, revision = await revisions.current_by_telegram(telegram_id)
+    else:
+        revision = await revisions.current(user_id)
+    if revision is None:
+        return None
+    return not_modified(request, response, revision)
+
+
+async def find_user(query: dict, projection: dict = NO_ID) -> Optional[dict]:
+    """
+    Документ пользователя по {"id": ...} или {"telegram_id": ...}
+
+    Внутри /api/batch документ читается целиком один раз и переиспользуется всеми
+    под-запросами (по обоим ключам); вне batch - обычный find_one с проекцией.
+    """
+    if not RequestCache.active():
+        return await db.users.find_one(query, projection)
+    (field, value), = query.items()
+    return await RequestCache.get_or_load(
+        ("users", field, value),
+        lambda: db.users.find_one(query, NO_ID),
+        aliases=lambda user: [("users", "id", user.get("id")), ("users", "telegram_id", user.get("telegram_id"))]
+    )
 
-# ========== Models ==========
-class UserCreate(BaseModel):
-    user_id: str
-    name: str
-    age: int
-    telegram_id: str = None
-
-class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    name: str
-    age: int
-    telegram_id: str = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    xp: int = 0
-    level: int = 1
-    streak: int = 0
-    last_activity: datetime = Field(default_factory=datetime.utcnow)
-
-class BalanceAssessment(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    type: str  # 'initial' or 'final'
-    scores: dict  # categoryId -> score
-    answers: dict  # questionId -> answer
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
-
-class LessonProgress(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    lesson_id: str
-    module: str
-    completed: bool = False
-    xp_earned: int = 0
-    answers: dict = {}
-    completed_at: datetime = None
-
-class CheckIn(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    mood: str
-    anxiety_level: int
-    sleep_hours: float
-    notes: str = ""
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 # ========== Authentication & Authorization ==========
 
-@api_router.post("/auth/login")
+@api_router.post("/auth/login", dependencies=[rate_limited("auth_login")])
 async def login_with_code(code: str):
     """Вход по уникальному коду"""
     code = code.upper().strip()
@@ -189,8 +388,9 @@ async def telegram_login(init_data: str, selected_role: Optional[str] = None):
         # Пользователь уже есть, обновляем last_activity
         await db.users.update_one(
             {"telegram_id": telegram_id},
-            {"$set": {"last_activity": datetime.utcnow()}}
+            {"$set": {"last_activity": datetime.utcnow()}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
         )
+        await revisions.bumped(existing_user["id"])
         existing_user.pop("_id", None)
         return {
             "user": existing_user,
@@ -240,27 +440,38 @@ async def telegram_login(init_data: str, selected_role: Optional[str] = None):
 # ========== User Management ==========
 
 @api_router.get("/users/{user_id}")
-async def get_user(user_id: str):
-    """Получить информацию о пользователе"""
-    user = await db.users.find_one({"id": user_id})
+async def get_user(user_id: str, request: Request, response: Response, fields: Optional[str] = None):
+    """Получить информацию о пользователе (fields=name,xp,level - только нужные поля)"""
+    # Ревизия в кэше - 304 без MongoDB; иначе ее дает сам документ (одно чтение вместо двух)
+    revision = revisions.cached(user_id) if "if-none-match" in request.headers else None
+    if revision is not None:
+        cached = not_modified(request, response, revision)
+        if cached:
+            return cached
+    
+    tree = parse_fields(fields)
+    user = await find_user({"id": user_id}, fields_projection(tree, required=["revision"]))
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    user.pop("_id", None)
-    return user
+    revisions.remember(user)
+    cached = not_modified(request, response, user.get("revision", 0))
+    if cached:
+        return cached
+    return json_response(select_fields(user, tree), response)
 
 
 @api_router.put("/users/{user_id}")
-async def update_user(user_id: str, update_data: Dict):
+async def update_user(user_id: str, update_data: UserUpdate):
     """Обновить информацию о пользователе"""
-    allowed_fields = ["name", "age", "avatar_url", "notifications_enabled"]
-    filtered_data = {k: v for k, v in update_data.items() if k in allowed_fields}
+    filtered_data = update_data.model_dump(exclude_unset=True)
     
     if filtered_data:
         await db.users.update_one(
             {"id": user_id},
-            {"$set": filtered_data}
+            {"$set": filtered_data, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
         )
+        await revisions.bumped(user_id)
     
     return {"message": "Профиль обновлен"}
 
@@ -303,37 +514,40 @@ async def generate_student_code(curator_id: str, student_name: str, student_age:
     }
 
 
-@api_router.get("/curator/{curator_id}/students")
-async def get_curator_students(curator_id: str):
-    """Получить всех учеников куратора"""
-    students = await db.users.find({"curator_id": curator_id, "role": UserRole.STUDENT}).to_list(1000)
-    
-    result = []
+@api_router.get("/curator/{curator_id}/students", response_model=List[RosterEntry])
+async def get_curator_students(curator_id: str, fields: Optional[str] = None):
+    """Получить всех учеников куратора (fields=id,name,progress - только нужные поля)"""
+    tree = parse_fields(fields)
+    need_progress = wants(tree, "progress", "completedLessons")
+    need_balance = wants(tree, "initialBalance", "currentBalance")
+    
+    students = await analytics_db.users.find(
+        {"curator_id": curator_id, "role": UserRole.STUDENT},
+        {"_id": 0, "id": 1, "name": 1, "age": 1, "last_activity": 1, "created_at": 1, "xp": 1, "level": 1, "streak": 1}
+    ).to_list(1000)
+    
+    catalog = lesson_catalog.current
+    # Начальная и последняя оценки всех учеников - одним запросом
+    balances = {}
+    if need_balance and students:
+        cursor = analytics_db.balance_history.find(
+            {"user_id": {"$in": [student["id"] for student in students]}},
+            {"_id": 0, "user_id": 1, "count": 1, "initial.scores": 1, "initial.extra": 1, "latest.scores": 1, "latest.extra": 1}
+        )
+        balances = {history["user_id"]: history async for history in cursor}
+
+    result: List[RosterEntry] = []
     for student in students:
-        student.pop("_id", None)
-        
         # Получаем прогресс
-        all_progress = await db.lesson_progress.find({"user_id": student["id"]}).to_list(1000)
+        all_progress = await analytics_db.lesson_progress.find(
+            {"user_id": student["id"]}, {"_id": 0, "lesson_id": 1, "module": 1, "status": 1}
+        ).to_list(1000) if need_progress else []
         
-        # Считаем прогресс по модулям
-        module_totals = {
-            "boundaries": 12,
-            "confidence": 12,
-            "emotions": 10,
-            "relationships": 10
-        }
-        
-        module_progress = {}
-        for module in ModuleType:
-            module_lessons = [p for p in all_progress if p.get("module") == module.value]
-            completed = len([p for p in module_lessons if p.get("status") == "completed"])
-            total = module_totals.get(module.value, 10)
-            module_progress[module.value] = round((completed / total * 100) if total else 0, 1)
+        # Считаем прогресс по модулям каталога
+        tallies, completed_total = catalog.tally(all_progress)
+        module_progress = {module: catalog.percent(module, tally.completed) for module, tally in tallies.items()}
         
-        # Получаем последнюю оценку баланса
-        balances = await db.balance_assessments.find(
-            {"user_id": student["id"]}
-        ).sort("timestamp", -1).to_list(2)
+        history = balances.get(student["id"])
         
         result.append({
             "id": student["id"],
@@ -341,26 +555,27 @@ async def get_curator_students(curator_id: str):
             "age": student.get("age", 14),
             "lastActive": student.get("last_activity", student.get("created_at")),
             "progress": module_progress,
-            "completedLessons": len([p for p in all_progress if p.get("status") == "completed"]),
+            "completedLessons": completed_total,
             "totalXP": student.get("xp", 0),
             "level": student.get("level", 1),
             "streak": student.get("streak", 0),
-            "initialBalance": balances[1]["scores"] if len(balances) > 1 else None,
-            "currentBalance": balances[0]["scores"] if balances else None
+            "initialBalance": (
+                unpack_scores(history["initial"]["scores"], history["initial"].get("extra"))
+                if history and history.get("count", 1) > 1 else None
+            ),
+            "currentBalance": (
+                unpack_scores(history["latest"]["scores"], history["latest"].get("extra")) if history else None
+            )
         })
     
-    return result
+    return json_response(select_fields(result, tree))
 
 
 @api_router.get("/curator/{curator_id}/codes")
 async def get_curator_codes(curator_id: str):
     """Получить все коды куратора"""
-    codes = await db.access_codes.find({"curator_id": curator_id}).to_list(100)
-    
-    for code in codes:
-        code.pop("_id", None)
-    
-    return codes
+    codes = await db.access_codes.find({"curator_id": curator_id}, NO_ID).to_list(100)
+    return json_response(codes)
 
 
 # ========== Old User Routes (kept for compatibility) ==========
@@ -374,18 +589,9 @@ async def create_user(user: UserCreate):
         existing.pop("_id", None)
         return User(**existing)
     
-    user_obj = {
-        "id": user_id,
-        **user.dict(),
-        "created_at": datetime.utcnow(),
-        "xp": 0,
-        "level": 1,
-        "streak": 0,
-        "achievements": [],
-        "notifications_enabled": True
-    }
-    await db.users.insert_one(user_obj)
-    return User(**user_obj)
+    user_obj = User(id=user_id, **user.model_dump())
+    await db.users.insert_one(user_obj.model_dump())
+    return user_obj
 
 
 # ========== Lesson Progress Routes ==========
@@ -424,12 +630,42 @@ async def start_lesson(lesson_id: str, user_id: str, module: str):
     # Обновляем последнюю активность
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"last_activity": datetime.utcnow()}}
+        {"$set": {"last_activity": datetime.utcnow()}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
     )
+    await revisions.bumped(user_id)
+    events.append(LESSON_STARTED, user_id, lesson_id=lesson_id, module=module)
     
     return {"message": "Урок начат", "status": "in_progress"}
 
 
+async def credit_lesson_xp(user: dict, xp_earned: int, streak) -> Tuple[int, int]:
+    """
+    Начислить XP за урок и отметить день стрика; вернуть (xp, level) после записи
+
+    XP - через $inc: два параллельных завершения урока не теряют начисление друг друга.
+    Уровень - по XP после записи той же формулой, что в oplog (XP_PER_LEVEL); условие
+    level < нового не откатывает уровень, уже поднятый параллельным запросом.
+    """
+    updated = await db.users.find_one_and_update(
+        {"id": user["id"]},
+        streak.apply({
+            "$set": {"last_activity": datetime.utcnow()},
+            "$inc": {"xp": xp_earned, "revision": 1},
+            "$currentDate": {"updated_at": True}
+        }),
+        projection={"_id": 0, "xp": 1, "level": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    new_level = level_for(updated["xp"], oplog.xp_per_level)
+    if new_level > updated.get("level", 1):
+        await db.users.update_one(
+            {"id": user["id"], "level": {"$lt": new_level}},
+            {"$set": {"level": new_level}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
+        )
+    await revisions.bumped(user["id"])
+    return updated["xp"], new_level
+
+
 @api_router.post("/progress/lesson/{lesson_id}/complete")
 async def complete_lesson(
     lesson_id: str,
@@ -456,8 +692,8 @@ async def complete_lesson(
     # Начисляем XP
     xp_earned = score * 10  # 10 XP за каждый процент
     user = await db.users.find_one({"id": user_id})
-    new_xp = user.get("xp", 0) + xp_earned
-    new_level = (new_xp // 1000) + 1  # Новый уровень каждые 1000 XP
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     # Обновляем XP в прогрессе
     await db.lesson_progress.update_one(
@@ -465,33 +701,19 @@ async def complete_lesson(
         {"$set": {"xp_earned": xp_earned}}
     )
     
-    # Обновляем стрик
-    last_activity = user.get("last_activity")
-    streak_days = user.get("streak", 0)
+    # Отмечаем день в календаре активности - стрик считается из него
+    streak = streaks.record(user)
+    streak_days = streak.current
     
-    if last_activity:
-        days_diff = (datetime.utcnow() - last_activity).days
-        if days_diff == 1:
-            streak_days += 1
-        elif days_diff > 1:
-            streak_days = 1
-    else:
-        streak_days = 1
-    
-    await db.users.update_one(
-        {"id": user_id},
-        {
-            "$set": {
-                "xp": new_xp,
-                "level": new_level,
-                "streak": streak_days,
-                "last_activity": datetime.utcnow()
-            }
-        }
+    new_xp, new_level = await credit_lesson_xp(user, xp_earned, streak)
+    await leaderboards.record_xp(user, new_xp)
+    events.append(
+        LESSON_COMPLETED, user_id,
+        lesson_id=lesson_id, score=score, time_spent=time_spent, xp_earned=xp_earned, source="api"
     )
     
-    # Проверка достижений
-    achievements = await check_achievements(user_id, new_xp, new_level, streak_days)
+    # Проверка достижений (запись и уведомления - фоновой задачей)
+    achievements = await check_achievements(user, new_xp, new_level, streak_days)
     
     return {
         "message": "Урок завершен",
@@ -503,168 +725,206 @@ async def complete_lesson(
     }
 
 
-async def check_achievements(user_id: str, xp: int, level: int, streak: int) -> List[str]:
-    """Проверка и начисление достижений"""
-    new_achievements = []
-    
-    # Правила достижений
-    achievements_rules = [
-        ("first_lesson", "Первый урок пройден!", lambda: True),
-        ("level_5", "Достигнут 5 уровень!", lambda: level >= 5),
-        ("level_10", "Достигнут 10 уровень!", lambda: level >= 10),
-        ("level_20", "Достигнут 20 уровень!", lambda: level >= 20),
-        ("streak_3", "3 дня подряд!", lambda: streak >= 3),
-        ("streak_7", "7 дней подряд!", lambda: streak >= 7),
-        ("streak_30", "30 дней подряд!", lambda: streak >= 30),
-        ("xp_1000", "1000 XP заработано!", lambda: xp >= 1000),
-        ("xp_5000", "5000 XP заработано!", lambda: xp >= 5000),
-        ("xp_10000", "10000 XP заработано!", lambda: xp >= 10000),
-    ]
+# Правила достижений: (id, описание, условие от xp, level, streak)
+ACHIEVEMENT_RULES = [
+    ("first_lesson", "Первый урок пройден!", lambda xp, level, streak: True),
+    ("level_5", "Достигнут 5 уровень!", lambda xp, level, streak: level >= 5),
+    ("level_10", "Достигнут 10 уровень!", lambda xp, level, streak: level >= 10),
+    ("level_20", "Достигнут 20 уровень!", lambda xp, level, streak: level >= 20),
+    ("streak_3", "3 дня подряд!", lambda xp, level, streak: streak >= 3),
+    ("streak_7", "7 дней подряд!", lambda xp, level, streak: streak >= 7),
+    ("streak_30", "30 дней подряд!", lambda xp, level, streak: streak >= 30),
+    ("xp_1000", "1000 XP заработано!", lambda xp, level, streak: xp >= 1000),
+    ("xp_5000", "5000 XP заработано!", lambda xp, level, streak: xp >= 5000),
+    ("xp_10000", "10000 XP заработано!", lambda xp, level, streak: xp >= 10000),
+]
+ACHIEVEMENT_DESCRIPTIONS = {achievement_id: description for achievement_id, description, _ in ACHIEVEMENT_RULES}
+
+
+async def check_achievements(user: dict, xp: int, level: int, streak: int) -> List[str]:
+    """
+    Проверка достижений по уже загруженному документу пользователя
     
-    user = await db.users.find_one({"id": user_id})
+    Новые достижения сразу возвращаются клиенту, а запись, уведомления и оповещение
+    родителя выполняет фоновая задача grant_achievements.
+    """
     current_achievements = user.get("achievements", [])
-    
-    for achievement_id, description, condition in achievements_rules:
-        if achievement_id not in current_achievements and condition():
-            new_achievements.append(achievement_id)
-            
-            # Добавляем достижение
-            await db.users.update_one(
-                {"id": user_id},
-                {"$push": {"achievements": achievement_id}}
-            )
-            
-            # Сохраняем уведомление о достижении
-            notification_id = str(uuid.uuid4())
-            await db.notifications.insert_one({
-                "id": notification_id,
-                "user_id": user_id,
-                "type": "achievement",
-                "title": "Новое достижение!",
-                "description": description,
-                "created_at": datetime.utcnow(),
-                "read": False
-            })
-    
+    new_achievements = [
+        achievement_id
+        for achievement_id, _, condition in ACHIEVEMENT_RULES
+        if achievement_id not in current_achievements and condition(xp, level, streak)
+    ]
+    if new_achievements:
+        await jobs.enqueue("grant_achievements", user_id=user["id"], achievement_ids=new_achievements)
     return new_achievements
 
 
+@jobs.handler("grant_achievements")
+async def grant_achievements(user_id: str, achievement_ids: List[str]):
+    """Начислить достижения; идемпотентно - задача может выполниться повторно"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "name": 1, "parent_id": 1})
+    if not user:
+        return
+    
+    for achievement_id in achievement_ids:
+        description = ACHIEVEMENT_DESCRIPTIONS[achievement_id]
+        # Уведомления с детерминированным id: повтор задачи их не продублирует
+        await create_notification(
+            user_id, "achievement", "Новое достижение!", description,
+            notification_id=f"{user_id}:achievement:{achievement_id}"
+        )
+        if user.get("parent_id"):
+            await create_notification(
+                user["parent_id"], "parent_alert", f"{user.get('name', 'Ребенок')}: новое достижение", description,
+                notification_id=f"{user_id}:achievement:{achievement_id}:parent"
+            )
+        
+        result = await db.users.update_one(
+            {"id": user_id, "achievements": {"$ne": achievement_id}},
+            {"$push": {"achievements": achievement_id}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
+        )
+        if result.modified_count:
+            await revisions.bumped(user_id)
+
+
 @api_router.get("/progress/{user_id}")
-async def get_user_progress(user_id: str):
-    """Получить весь прогресс пользователя"""
-    progress_list = await db.lesson_progress.find({"user_id": user_id}).to_list(1000)
-    
-    for p in progress_list:
-        p.pop("_id", None)
-    
-    return progress_list
+async def get_user_progress(user_id: str, fields: Optional[str] = None):
+    """Получить весь прогресс пользователя (fields=lesson_id,status - только нужные поля)"""
+    progress_list = await db.lesson_progress.find({"user_id": user_id}, fields_projection(parse_fields(fields))).to_list(1000)
+    return json_response(progress_list)
 
 
-@api_router.get("/progress/{user_id}/stats")
-async def get_user_stats(user_id: str):
+@api_router.get("/progress/{user_id}/stats", response_model=UserStats)
+async def get_user_stats(user_id: str, request: Request, response: Response):
     """Получить статистику пользователя"""
-    user = await db.users.find_one({"id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    progress_list = await db.lesson_progress.find({"user_id": user_id}).to_list(1000)
-    completed = [p for p in progress_list if p.get("status") == "completed"]
-    
-    # Прогресс по модулям
-    module_totals = {
-        "boundaries": 12,
-        "confidence": 12,
-        "emotions": 10,
-        "relationships": 10
-    }
-    
-    modules_stats = {}
-    for module, total in module_totals.items():
-        module_lessons = [p for p in progress_list if p.get("module") == module]
-        module_completed = [p for p in module_lessons if p.get("status") == "completed"]
-        modules_stats[module] = {
-            "total": total,
-            "completed": len(module_completed),
-            "progress": round((len(module_completed) / total * 100) if total else 0, 1)
+    cached = await conditional_get(request, response, user_id=user_id)
+    if cached:
+        return cached
+    
+    # Пользователь и прогресс - параллельно
+    async with Fanout(fanout_mode) as reads:
+        reads.start("user", analytics_db.users.find_one, {"id": user_id})
+        reads.start("progress", analytics_db.lesson_progress.find(
+            {"user_id": user_id}, {"_id": 0, "lesson_id": 1, "module": 1, "status": 1, "time_spent": 1, "score": 1}
+        ).to_list, 1000)
+        user = await reads.get("user")
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        response.headers["ETag"] = etag_for(user.get("revision", 0))
+        progress_list = await reads.get("progress")
+    
+    # Прогресс по модулям каталога
+    catalog = lesson_catalog.current
+    tallies, completed_count = catalog.tally(progress_list)
+    modules_stats = {
+        module: {
+            "total": catalog.totals[module],
+            "completed": tally.completed,
+            "progress": catalog.percent(module, tally.completed)
         }
+        for module, tally in tallies.items()
+    }
     
-    # Общее время обучения
-    total_time = sum(p.get("time_spent", 0) for p in progress_list)
+    # Общее время обучения и средний балл
+    total_time = 0
+    score_sum = 0
+    score_count = 0
+    for p in progress_list:
+        total_time += p.get("time_spent", 0)
+        if p.get("status") == "completed" and p.get("score") is not None:
+            score_sum += p["score"]
+            score_count += 1
     
-    # Средний балл
-    completed_with_score = [p for p in completed if p.get("score") is not None]
-    avg_score = sum(p["score"] for p in completed_with_score) / len(completed_with_score) if completed_with_score else 0
+    avg_score = score_sum / score_count if score_count else 0
     
-    return {
+    return json_response({
         "user_id": user_id,
         "level": user.get("level", 1),
         "xp": user.get("xp", 0),
         "streak": user.get("streak", 0),
         "total_lessons": len(progress_list),
-        "completed_lessons": len(completed),
+        "completed_lessons": completed_count,
         "total_time_minutes": total_time // 60,
         "average_score": round(avg_score, 1),
         "achievements": user.get("achievements", []),
         "modules": modules_stats
-    }
+    }, response)
 
 
 # ========== Balance Assessment Routes ==========
 @api_router.post("/balance-assessment")
 async def save_balance_assessment(user_id: str, type: str, scores: dict, answers: dict):
-    """Сохранить оценку колеса баланса"""
+    """Сохранить оценку колеса баланса (в историю пользователя)"""
     # Валидация оценок (0-10)
-    for area, score in scores.items():
-        if not isinstance(score, (int, float)) or score < 0 or score > 10:
-            raise HTTPException(status_code=400, detail=f"Неверная оценка для {area}")
-    
-    # Расчет общего балла
-    overall_score = sum(scores.values()) / len(scores) if scores else 0
-    
-    assessment_id = str(uuid.uuid4())
-    assessment = {
-        "id": assessment_id,
-        "user_id": user_id,
-        "type": type,
-        "scores": scores,
-        "answers": answers,
-        "overall_score": round(overall_score, 2),
-        "timestamp": datetime.utcnow()
-    }
-    
-    await db.balance_assessments.insert_one(assessment)
+    try:
+        validate_scores(scores)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    entry = await balance_history.record(user_id, make_entry(type, scores, answers))
+    await revisions.bump(user_id)
+    events.append(
+        ASSESSMENT, user_id, assessment_id=entry["id"], type=type, scores=scores, overall_score=entry["overall_score"]
+    )
     
     return {
-        "id": assessment_id,
-        "overall_score": overall_score,
+        "id": entry["id"],
+        "overall_score": entry["overall_score"],
         "message": "Оценка сохранена"
     }
 
 
 @api_router.get("/balance-assessment/{user_id}")
-async def get_balance_assessments(user_id: str):
+async def get_balance_assessments(user_id: str, request: Request, response: Response):
     """Получить все оценки баланса пользователя"""
-    assessments = await db.balance_assessments.find({"user_id": user_id}).sort("timestamp", -1).to_list(100)
+    cached = await conditional_get(request, response, user_id=user_id, etag=True)
+    if cached:
+        return cached
     
-    for a in assessments:
-        a.pop("_id", None)
-    
-    return assessments
+    return json_response(await balance_history.entries(user_id), response)
 
 
 @api_router.get("/balance-assessment/{user_id}/latest")
 async def get_latest_assessment(user_id: str, type: str = None):
     """Получить последнюю оценку баланса"""
-    query = {"user_id": user_id}
-    if type:
-        query["type"] = type
+    return json_response(await balance_history.latest(user_id, type))
+
+
+@api_router.get("/balance-assessment/{user_id}/compare", response_model=BalanceComparison)
+async def compare_balance(user_id: str, request: Request, response: Response):
+    """Начальная и последняя оценки и разница по категориям - одним чтением истории"""
+    cached = await conditional_get(request, response, user_id=user_id, etag=True)
+    if cached:
+        return cached
+    
+    comparison = await balance_history.compare(user_id)
+    if comparison is None:
+        raise HTTPException(status_code=404, detail="Оценок баланса нет")
+    return json_response(comparison, response)
+
+
+@api_router.get("/curator/{curator_id}/balance-compare", response_model=CohortBalanceComparison)
+async def compare_cohort_balance(curator_id: str):
+    """Сравнение оценок всех учеников куратора и средняя разница по категориям"""
+    students = await analytics_db.users.find(
+        {"curator_id": curator_id, "role": UserRole.STUDENT}, {"_id": 0, "id": 1}
+    ).to_list(1000)
+    comparisons = await balance_history.compare_many(
+        (student["id"] for student in students), analytics_db.balance_history
+    )
     
-    assessment = await db.balance_assessments.find_one(query, sort=[("timestamp", -1)])
-    if not assessment:
-        return None
+    totals: Dict[str, list] = {}
+    for comparison in comparisons.values():
+        for category, delta in (comparison["deltas"] or {}).items():
+            totals.setdefault(category, []).append(delta)
     
-    assessment.pop("_id", None)
-    return assessment
+    return json_response({
+        "curator_id": curator_id,
+        "students": len(students),
+        "compared": sum(1 for comparison in comparisons.values() if comparison["latest"] is not None),
+        "average_deltas": {category: round(sum(values) / len(values), 2) for category, values in totals.items()},
+        "comparisons": [comparisons[student["id"]] for student in students if student["id"] in comparisons]
+    })
 
 
 # ========== Notifications ==========
@@ -676,45 +936,133 @@ async def get_notifications(user_id: str, unread_only: bool = False):
     if unread_only:
         query["read"] = False
     
-    notifications = await db.notifications.find(query).sort("created_at", -1).limit(50).to_list(None)
+    notifications = await db.notifications.find(query, NO_ID).sort("created_at", -1).limit(50).to_list(None)
+    return json_response(notifications)
+
+
+async def shift_unread(user_id: str, delta: int):
+    """
+    Изменить счетчик непрочитанных после записи в notifications
     
-    for n in notifications:
-        n.pop("_id", None)
+    У старых пользователей счетчика нет: $inc создал бы его от нуля без прежних
+    непрочитанных. Для них счетчик считается по notifications (уже с этой записью).
+    """
+    result = await db.users.update_one(
+        {"id": user_id, "unread_notifications": {"$exists": True}},
+        {"$inc": {"unread_notifications": delta, "revision": 1}, "$currentDate": {"updated_at": True}}
+    )
+    if not result.matched_count:
+        unread = await db.notifications.count_documents({"user_id": user_id, "read": False})
+        await db.users.update_one(
+            {"id": user_id, "unread_notifications": {"$exists": False}},
+            {"$set": {"unread_notifications": unread}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
+        )
+    await revisions.bumped(user_id)
+
+
+async def create_notification(
+    user_id: str, type: str, title: str, description: str, notification_id: Optional[str] = None
+) -> str:
+    """
+    Создать уведомление и увеличить счетчик непрочитанных
     
-    return notifications
+    С заданным notification_id создание идемпотентно (для фоновых задач с повторами).
+    """
+    notification = {
+        "id": notification_id or str(uuid.uuid4()),
+        "user_id": user_id,
+        "type": type,
+        "title": title,
+        "description": description,
+        "created_at": datetime.utcnow(),
+        "read": False
+    }
+    if notification_id is None:
+        await db.notifications.insert_one(notification)
+    else:
+        result = await db.notifications.update_one(
+            {"id": notification_id}, {"$setOnInsert": notification}, upsert=True
+        )
+        if result.upserted_id is None:
+            return notification_id
+    await shift_unread(user_id, 1)
+    return notification["id"]
+
+
+@api_router.get("/notifications/{user_id}/unread-count")
+async def get_unread_count(user_id: str):
+    """Количество непрочитанных уведомлений (для бейджа)"""
+    user = await find_user({"id": user_id}, {"_id": 0, "unread_notifications": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    unread = user.get("unread_notifications")
+    if unread is None:
+        # Старые пользователи без счетчика - считаем один раз и сохраняем
+        unread = await db.notifications.count_documents({"user_id": user_id, "read": False})
+        await db.users.update_one(
+            {"id": user_id, "unread_notifications": {"$exists": False}},
+            {"$set": {"unread_notifications": unread}}
+        )
+
+    return {"user_id": user_id, "unread": unread}
+
+
+@api_router.put("/notifications/{user_id}/mark-read")
+async def mark_notifications_read(user_id: str, request: MarkReadRequest):
+    """Отметить прочитанными список уведомлений или все до указанного времени"""
+    if request.ids is None and request.before is None:
+        raise HTTPException(status_code=400, detail="Укажите ids или before")
+
+    query = {"user_id": user_id, "read": False}
+    if request.ids is not None:
+        query["id"] = {"$in": request.ids}
+    if request.before is not None:
+        query["created_at"] = {"$lte": request.before}
+
+    result = await db.notifications.update_many(query, {"$set": {"read": True}})
+    if result.modified_count:
+        await shift_unread(user_id, -result.modified_count)
+
+    return {"marked": result.modified_count, "message": "Уведомления прочитаны"}
 
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str):
     """Отметить уведомление как прочитанное"""
-    await db.notifications.update_one(
-        {"id": notification_id},
+    notification = await db.notifications.find_one_and_update(
+        {"id": notification_id, "read": False},
         {"$set": {"read": True}}
     )
+    if notification:
+        await shift_unread(notification["user_id"], -1)
     return {"message": "Уведомление прочитано"}
 
 
 # ========== Check-in Routes ==========
-@api_router.post("/checkin")
+@api_router.post("/checkin", dependencies=[rate_limited("checkin")])
 async def save_checkin(user_id: str, mood: str, anxiety_level: int, sleep_hours: float, notes: str = ""):
     """Сохранить ежедневный чек-ин"""
     checkin_id = str(uuid.uuid4())
-    checkin = {
-        "id": checkin_id,
-        "user_id": user_id,
-        "mood": mood,
-        "anxiety_level": anxiety_level,
-        "sleep_hours": sleep_hours,
-        "notes": notes,
-        "timestamp": datetime.utcnow()
-    }
+    checkin = CheckIn(
+        id=checkin_id,
+        user_id=user_id,
+        mood=mood,
+        anxiety_level=anxiety_level,
+        sleep_hours=sleep_hours,
+        notes=notes
+    )
     
-    await db.checkins.insert_one(checkin)
+    await db.checkins.insert_one(checkin.model_dump())
     
     # Обновляем последнюю активность
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"last_activity": datetime.utcnow()}}
+        {"$set": {"last_activity": datetime.utcnow()}, "$inc": {"revision": 1}, "$currentDate": {"updated_at": True}}
+    )
+    await revisions.bumped(user_id)
+    events.append(
+        CHECKIN, user_id, checkin_id=checkin_id, mood=mood, anxiety_level=anxiety_level, sleep_hours=sleep_hours
     )
     
     return {"id": checkin_id, "message": "Чек-ин сохранен"}
@@ -723,12 +1071,8 @@ async def save_checkin(user_id: str, mood: str, anxiety_level: int, sleep_hours:
 @api_router.get("/checkin/{user_id}")
 async def get_checkins(user_id: str, limit: int = 30):
     """Получить историю чек-инов"""
-    checkins = await db.checkins.find({"user_id": user_id}).sort("timestamp", -1).limit(limit).to_list(None)
-    
-    for c in checkins:
-        c.pop("_id", None)
-    
-    return checkins
+    checkins = await db.checkins.find({"user_id": user_id}, NO_ID).sort("timestamp", -1).limit(limit).to_list(None)
+    return json_response(checkins)
 
 
 # ========== Parent Dashboard ==========
@@ -736,39 +1080,198 @@ async def get_checkins(user_id: str, limit: int = 30):
 @api_router.get("/parent/{parent_id}/children")
 async def get_parent_children(parent_id: str):
     """Получить детей родителя"""
-    children = await db.users.find({"parent_id": parent_id, "role": UserRole.STUDENT}).to_list(100)
+    children = await analytics_db.users.find({"parent_id": parent_id, "role": UserRole.STUDENT}, NO_ID).to_list(100)
     
-    result = []
-    for child in children:
-        child.pop("_id", None)
-        
-        # Получаем последний прогресс
-        last_progress = await db.lesson_progress.find_one(
-            {"user_id": child["id"]},
-            sort=[("started_at", -1)]
+    # Последние общие баллы детей (одним запросом) и последний урок каждого - параллельно
+    async with Fanout(fanout_mode) as reads:
+        reads.start(
+            "balance", balance_history.latest_overall_many, [child["id"] for child in children], analytics_db.balance_history
         )
+        for child in children:
+            reads.start(
+                ("last_lesson", child["id"]),
+                analytics_db.lesson_progress.find_one, {"user_id": child["id"]}, NO_ID, sort=[("started_at", -1)]
+            )
         
-        if last_progress:
-            last_progress.pop("_id", None)
-        
-        # Получаем последнюю оценку баланса
-        last_balance = await db.balance_assessments.find_one(
-            {"user_id": child["id"]},
-            sort=[("timestamp", -1)]
+        last_scores = await reads.get("balance")
+        result = []
+        for child in children:
+            result.append({
+                **child,
+                "last_lesson": await reads.get(("last_lesson", child["id"])),
+                "last_balance_score": last_scores.get(child["id"])
+            })
+    
+    return json_response(result)
+
+
+# ========== Batch ==========
+
+@api_router.post("/batch")
+async def batch(payload: BatchRequest, request: Request):
+    """
+    Выполнить несколько запросов за один round trip
+    
+    {"requests": [{"id": "user", "method": "GET", "path": "/api/users/u1"}, ...]}
+    Соседние GET выполняются параллельно, записи - по порядку.
+    Returns: {"responses": [{"id", "status", "headers", "body"}, ...]} в порядке запросов
+    """
+    if len(payload.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"Не больше {BATCH_MAX_REQUESTS} запросов в batch")
+    
+    body = await BatchExecutor(request.app, api_router.prefix + "/batch").run(
+        request.scope, [sub.model_dump() for sub in payload.requests]
+    )
+    return Response(content=body, media_type="application/json")
+
+
+# ========== Lesson Catalog ==========
+
+@api_router.get("/lessons")
+async def get_lesson_catalog(request: Request, response: Response):
+    """Каталог модулей и уроков"""
+    catalog = lesson_catalog.current
+    cached = not_modified(request, response, f"lessons-{catalog.version}")
+    if cached:
+        return cached
+    return json_response(catalog.to_dict(), response)
+
+
+@api_router.post("/lessons/reload", dependencies=[Depends(require_profiling), rate_limited("lessons_reload")])
+async def reload_lesson_catalog():
+    """Перечитать каталог во всех воркерах (после изменения коллекции lessons или data/lessons.json)"""
+    changed = await lesson_catalog.request_reload()
+    catalog = lesson_catalog.current
+    return {
+        "version": catalog.version,
+        "source": lesson_catalog.source,
+        "changed": changed,
+        "modules": dict(catalog.totals)
+    }
+
+
+# ========== Streaks ==========
+
+@api_router.get("/streak/{user_id}", response_model=StreakCalendar)
+async def get_streak_calendar(user_id: str, year: Optional[int] = None):
+    """Календарь активности за год, текущий и самый длинный стрик (по часовому поясу пользователя)"""
+    user = await find_user(
+        {"id": user_id},
+        {"_id": 0, "id": 1, "activity": 1, "streak_freezes": 1, "timezone": 1, "streak": 1, "last_activity": 1}
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return json_response(streaks.calendar(user, year or streaks.local_date(user).year))
+
+
+# ========== Economy ==========
+
+@api_router.get("/economy/items")
+async def get_shop_items():
+    """Каталог магазина: цены и действие предметов"""
+    return shop_catalog()
+
+
+@api_router.get("/economy/{user_id}", response_model=Wallet)
+async def get_wallet(user_id: str):
+    """Монеты, самоцветы, инвентарь и текущая энергия (с восстановлением)"""
+    user = await find_user({"id": user_id}, WALLET_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return json_response(wallet(user))
+
+
+async def economy_operation(user_id: str, operation) -> Response:
+    """Выполнить операцию Economy и вернуть кошелек после нее"""
+    try:
+        user = await operation
+    except EconomyError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    await revisions.bumped(user_id)
+    return json_response(wallet(user))
+
+
+@api_router.post("/economy/purchase", response_model=Wallet, dependencies=[rate_limited("economy")])
+async def purchase_item(user_id: str, item_id: str, quantity: int = 1):
+    """Купить предмет по цене каталога: списание и +quantity в инвентарь одним условным $inc (409 - не хватает)"""
+    if not 1 <= quantity <= 99:
+        raise HTTPException(status_code=400, detail="quantity от 1 до 99")
+    return await economy_operation(user_id, economy.purchase(user_id, item_id, quantity))
+
+
+@api_router.post("/economy/use", response_model=Wallet, dependencies=[rate_limited("economy")])
+async def use_item(user_id: str, item_id: str):
+    """Использовать предмет: -1 в инвентаре и его действие (энергия, защита стрика); 409 - предмета нет"""
+    return await economy_operation(user_id, economy.use_item(user_id, item_id))
+
+
+@api_router.post("/economy/earn", response_model=Wallet, dependencies=[rate_limited("economy")])
+async def earn_currency(user_id: str, coins: int = 0, gems: int = 0):
+    """Начислить награду мини-игры или квеста ($inc, не больше ECONOMY_MAX_REWARD за запрос)"""
+    return await economy_operation(user_id, economy.earn(user_id, coins, gems))
+
+
+@api_router.post("/economy/energy/spend", response_model=Wallet, dependencies=[rate_limited("economy")])
+async def spend_energy(user_id: str, amount: int):
+    """Списать энергию с учетом восстановления (409 - не хватает)"""
+    return await economy_operation(user_id, economy.spend_energy(user_id, amount))
+
+
+# ========== Leaderboards ==========
+
+@api_router.get("/leaderboard", response_model=Leaderboard)
+async def get_leaderboard(curator_id: Optional[str] = None, limit: int = 10, offset: int = 0):
+    """
+    Топ учеников по XP: общий или когорта куратора (curator_id)
+    
+    Места берутся из рейтинга за O(log n + limit); из users читаются только имена топа.
+    """
+    if not 1 <= limit <= 100 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit от 1 до 100, offset >= 0")
+    
+    top = await leaderboards.top(curator_id, limit, offset)
+    users = {}
+    if top:
+        cursor = analytics_db.users.find(
+            {"id": {"$in": [user_id for _, user_id, _ in top]}},
+            {"_id": 0, "id": 1, "name": 1, "level": 1}
         )
-        
-        result.append({
-            **child,
-            "last_lesson": last_progress,
-            "last_balance_score": last_balance.get("overall_score") if last_balance else None
-        })
+        users = {user["id"]: user async for user in cursor}
+    
+    return json_response({
+        "board": f"curator:{curator_id}" if curator_id else "global",
+        "total": await leaderboards.size(curator_id),
+        "entries": [
+            {
+                "rank": rank,
+                "user_id": user_id,
+                "name": users.get(user_id, {}).get("name"),
+                "xp": int(xp),
+                "level": users.get(user_id, {}).get("level", 1)
+            }
+            for rank, user_id, xp in top
+        ]
+    })
+
+
+@api_router.get("/leaderboard/{user_id}/rank", response_model=LeaderboardRank)
+async def get_leaderboard_rank(user_id: str):
+    """Место ученика в общем рейтинге и в когорте своего куратора"""
+    user = await find_user({"id": user_id}, {"_id": 0, "id": 1, "curator_id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    return result
+    overall = await leaderboards.rank(user_id)
+    cohort = await leaderboards.rank(user_id, user["curator_id"]) if user.get("curator_id") else None
+    return json_response({"user_id": user_id, "overall": overall, "cohort": cohort})
 
 
 # ========== Root ==========
 @api_router.get("/")
-async def root():
+async def root(request: Request, response: Response):
+    cached = not_modified(request, response, "root")
+    if cached:
+        return cached
     return {
         "app": "MyTeens.Space API",
         "version": "2.0.0",
@@ -780,31 +1283,53 @@ async def root():
             "progress": "/api/progress",
             "notifications": "/api/notifications",
             "checkin": "/api/checkin",
-            "parent": "/api/parent"
+            "parent": "/api/parent",
+            "lessons": "/api/lessons",
+            "leaderboard": "/api/leaderboard",
+            "streak": "/api/streak"
         }
     }
 
 
+@api_router.get("/metrics")
+async def get_metrics():
+    """Диагностика воркера: процесс, пул MongoDB, координация, фоновые задачи, журнал и лента изменений"""
+    return {
+        "worker": {
+            "pid": os.getpid(),
+            "started_at": WORKER_STARTED_AT
+        },
+        "mongo": describe_client(client, analytics_db) if client is not None else None,
+        "coordination": {
+            "backend": coordinator.backend
+        },
+        "jobs": jobs.describe(),
+        "events": events.describe(),
+        "change_feed": change_feed.describe(),
+        "oplog": oplog.describe(),
+        "queries": query_stats.describe()
+    }
+
+
+@api_router.get("/metrics/queries", dependencies=[Depends(require_profiling)])
+async def get_query_metrics(limit: int = 20, order: str = "total_ms"):
+    """Самые тяжелые формы запросов к MongoDB за окно QUERY_STATS_WINDOW_S (order - поле сортировки)"""
+    if not 1 <= limit <= 200 or order not in QUERY_ORDERS:
+        raise HTTPException(status_code=400, detail=f"limit от 1 до 200, order: {', '.join(QUERY_ORDERS)}")
+    return {**query_stats.describe(), "top": query_stats.top(limit, order)}
+
+
 # ========== NEW: Telegram ID based endpoints ==========
 
-@api_router.post("/sync/progress")
-async def sync_progress(telegram_id: str, progress_data: dict):
+@api_router.post("/sync/progress", dependencies=[rate_limited("sync_progress")])
+async def sync_progress(telegram_id: str, progress_data: ProgressSnapshot):
     """
     Синхронизация прогресса пользователя из localStorage
     
     Args:
         telegram_id: Telegram ID пользователя
-        progress_data: {
-            "completedLessons": [],
-            "xp": 0,
-            "level": 1,
-            "coins": 0,
-            "gems": 0,
-            "streak": 0,
-            "energy": 100,
-            "inventory": {},
-            "balanceScores": {}
-        }
+        progress_data: ProgressSnapshot (completedLessons, xp, level, coins, gems,
+            streak, energy, inventory, balanceScores)
     """
     user = await db.users.find_one({"telegram_id": telegram_id})
     if not user:
@@ -812,26 +1337,9 @@ async def sync_progress(telegram_id: str, progress_data: dict):
     
     user_id = user["id"]
     
-    # Обновляем пользователя
-    await db.users.update_one(
-        {"telegram_id": telegram_id},
-        {
-            "$set": {
-                "xp": progress_data.get("xp", 0),
-                "level": progress_data.get("level", 1),
-                "coins": progress_data.get("coins", 0),
-                "gems": progress_data.get("gems", 0),
-                "streak": progress_data.get("streak", 0),
-                "energy": progress_data.get("energy", 100),
-                "inventory": progress_data.get("inventory", {}),
-                "last_activity": datetime.utcnow()
-            }
-        }
-    )
-    
     # Синхронизируем пройденные уроки
-    completed_lessons = progress_data.get("completedLessons", [])
-    for lesson_id in completed_lessons:
+    new_lessons = []
+    for lesson_id in progress_data.completedLessons:
         existing = await db.lesson_progress.find_one({
             "user_id": user_id,
             "lesson_id": lesson_id
@@ -841,6 +1349,7 @@ async def sync_progress(telegram_id: str, progress_data: dict):
                 "id": str(uuid.uuid4()),
                 "user_id": user_id,
                 "lesson_id": lesson_id,
+                "module": lesson_catalog.current.module_of(lesson_id),
                 "status": "completed",
                 "completed_at": datetime.utcnow(),
                 "score": 100,  # По умолчанию
@@ -848,60 +1357,97 @@ async def sync_progress(telegram_id: str, progress_data: dict):
                 "answers": {},
                 "time_spent": 0
             })
+            new_lessons.append(lesson_id)
     
     # Синхронизируем balance assessments если есть
-    if progress_data.get("balanceScores"):
-        existing_assessment = await db.balance_assessments.find_one({
-            "user_id": user_id,
-            "type": "initial"
-        })
-        if not existing_assessment:
-            await db.balance_assessments.insert_one({
-                "id": str(uuid.uuid4()),
-                "user_id": user_id,
-                "type": "initial",
-                "scores": progress_data["balanceScores"],
-                "timestamp": datetime.utcnow()
-            })
+    synced_events = []
+    if progress_data.balanceScores and not await balance_history.exists(user_id):
+        entry = await balance_history.record(user_id, make_entry("initial", progress_data.balanceScores))
+        synced_events.append(make_event(
+            ASSESSMENT, user_id, assessment_id=entry["id"], type="initial", scores=progress_data.balanceScores
+        ))
+    
+    # Кошелек из снимка - только пока им не владеет сервер (дальше - /economy/*, без перезаписи)
+    now = datetime.utcnow()
+    imported = import_fields(user, progress_data.model_dump(include={"coins", "gems", "energy", "inventory"}), now)
+    
+    # Обновляем пользователя последним: новая ревизия (ETag) - только после всех записей
+    await db.users.update_one(
+        {"telegram_id": telegram_id},
+        {
+            "$set": {
+                "xp": progress_data.xp,
+                "level": progress_data.level,
+                # С календарем активности стрик считает сервер; число с клиента - только до него
+                "streak": user.get("streak", 0) if "activity" in user else progress_data.streak,
+                "last_activity": now,
+                **imported
+            },
+            "$inc": {"revision": 1},
+            "$currentDate": {"updated_at": True}
+        }
+    )
+    await revisions.bumped(user_id)
+    await leaderboards.record_xp(user, progress_data.xp)
+    synced_events.append(make_event(
+        PROGRESS_SYNCED, user_id, xp=progress_data.xp, level=progress_data.level, completed=new_lessons
+    ))
+    events.append_many(synced_events)
     
     return {
         "message": "Прогресс синхронизирован",
-        "user_id": user_id
+        "user_id": user_id,
+        "wallet": wallet({**user, **imported}, now)
     }
 
 
-@api_router.get("/sync/progress/{telegram_id}")
-async def get_synced_progress(telegram_id: str):
+@api_router.get("/sync/progress/{telegram_id}", response_model=SyncedProgress)
+async def get_synced_progress(telegram_id: str, request: Request, response: Response, fields: Optional[str] = None):
     """
     Получить синхронизированный прогресс пользователя
     
+    fields=xp,level,coins - только нужные экрану поля
     Returns: Полный прогресс для загрузки в localStorage
     """
-    user = await db.users.find_one({"telegram_id": telegram_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    user_id = user["id"]
-    
-    # Получаем все пройденные уроки
-    completed_lessons_cursor = db.lesson_progress.find({
-        "user_id": user_id,
-        "status": "completed"
-    })
-    completed_lessons_list = await completed_lessons_cursor.to_list(1000)
-    completed_lesson_ids = [lesson["lesson_id"] for lesson in completed_lessons_list]
-    
-    # Получаем balance assessments
-    balance_assessment = await db.balance_assessments.find_one({
-        "user_id": user_id,
-        "type": "initial"
-    })
-    
-    balance_scores = {}
-    if balance_assessment:
-        balance_scores = balance_assessment.get("scores", {})
-    
-    return {
+    cached = await conditional_get(request, response, telegram_id=telegram_id)
+    if cached:
+        return cached
+    
+    tree = parse_fields(fields)
+    
+    def start_reads(user_id: str):
+        """Пройденные уроки и начальная оценка - по id пользователя"""
+        if wants(tree, "completedLessons"):
+            reads.start(("lessons", user_id), db.lesson_progress.find(
+                {"user_id": user_id, "status": "completed"}, {"_id": 0, "lesson_id": 1}
+            ).to_list, 1000)
+        if wants(tree, "balanceScores"):
+            reads.start(("balance", user_id), balance_history.initial_scores, user_id)
+    
+    async with Fanout(fanout_mode) as reads:
+        reads.start("user", find_user, {"telegram_id": telegram_id})
+        # id по telegram_id воркер обычно уже знает - тогда уроки и оценка читаются вместе с пользователем
+        known_user_id = revisions.user_id_for(telegram_id)
+        if known_user_id is not None:
+            start_reads(known_user_id)
+        
+        user = await reads.get("user")
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        response.headers["ETag"] = etag_for(user.get("revision", 0))
+        revisions.remember(user)
+        
+        # Уже запущенные чтения с тем же id не повторяются
+        user_id = user["id"]
+        start_reads(user_id)
+        completed_lesson_ids = []
+        if wants(tree, "completedLessons"):
+            completed_lesson_ids = [lesson["lesson_id"] for lesson in await reads.get(("lessons", user_id))]
+        balance_scores = {}
+        if wants(tree, "balanceScores"):
+            balance_scores = await reads.get(("balance", user_id))
+    
+    return json_response(select_fields({
         "telegram_id": telegram_id,
         "user_id": user_id,
         "name": user.get("name"),
@@ -912,14 +1458,62 @@ async def get_synced_progress(telegram_id: str):
         "coins": user.get("coins", 0),
         "gems": user.get("gems", 0),
         "streak": user.get("streak", 0),
-        "energy": user.get("energy", 100),
+        # Запас на момент energy_updated_at, а не текущая энергия: она растет без записей,
+        # и ответ с ETag по revision отдавал бы по 304 устаревшее значение
+        "energy": user.get("energy", ENERGY_MAX),
+        "energy_updated_at": user.get("energy_updated_at"),
         "inventory": user.get("inventory", {}),
         "balanceScores": balance_scores,
         "last_activity": user.get("last_activity")
-    }
+    }, tree), response)
+
+
+@api_router.post("/sync/ops", response_model=SyncOpsResult, dependencies=[rate_limited("sync_ops")])
+async def sync_ops(telegram_id: str, payload: SyncOpsRequest):
+    """
+    Принять пачку операций офлайн-очереди клиента (см. oplog.py)
+    
+    {"ops": [{"seq": 41, "type": "lesson_complete", "at": "...", "lesson_id": "b1", ...},
+             {"seq": 42, "type": "purchase", "at": "...", "item_id": "energy_boost", "price": 100}]}
+    Операции с уже принятым seq пропускаются. Returns: ack - клиент удаляет из очереди
+    операции с seq <= ack; state - состояние пользователя после применения.
+    """
+    if len(payload.ops) > oplog.max_ops:
+        raise HTTPException(status_code=400, detail=f"Не больше {oplog.max_ops} операций в пачке")
+    
+    try:
+        user, plan = await oplog.apply(telegram_id, payload.ops)
+    except OpConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if user is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    
+    if plan.user_update is not None:
+        await revisions.bumped(user["id"])
+        if plan.xp_changed:
+            await leaderboards.record_xp(user, plan.state["xp"])
+        events.append_many(plan.events)
+    
+    return json_response({
+        "telegram_id": telegram_id,
+        "ack": plan.ack,
+        "applied": plan.applied,
+        "duplicates": plan.duplicates,
+        "rejected": plan.rejected,
+        "state": plan.state
+    })
+
+
+@api_router.get("/sync/ops/{telegram_id}")
+async def get_sync_ops_ack(telegram_id: str):
+    """Принятый seq очереди (после переустановки клиент продолжает нумерацию с ack + 1)"""
+    acked = await oplog.acked(telegram_id)
+    if acked is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return {"telegram_id": telegram_id, "ack": acked}
 
 
-@api_router.post("/telegram/complete-lesson")
+@api_router.post("/telegram/complete-lesson", dependencies=[rate_limited("complete_lesson")])
 async def complete_lesson_telegram(
     telegram_id: str,
     lesson_id: str,
@@ -945,6 +1539,7 @@ async def complete_lesson_telegram(
                 "id": str(uuid.uuid4()),
                 "user_id": user_id,
                 "lesson_id": lesson_id,
+                "module": lesson_catalog.current.module_of(lesson_id),
                 "status": "completed",
                 "completed_at": datetime.utcnow(),
                 "score": score,
@@ -956,44 +1551,16 @@ async def complete_lesson_telegram(
         upsert=True
     )
     
-    # Обновляем XP и streak пользователя
-    new_xp = user.get("xp", 0) + xp_earned
-    new_level = (new_xp // 500) + 1
-    
-    # Логика streak
-    last_activity = user.get("last_activity")
-    streak_days = user.get("streak", 0)
-    
-    if last_activity:
-        days_diff = (datetime.utcnow() - last_activity).days
-        if days_diff == 0:
-            # Сегодня уже был - не меняем
-            pass
-        elif days_diff == 1:
-            streak_days += 1
-        else:
-            # Проверяем streak protection
-            if user.get("streakProtection", False):
-                # Защита сработала - не сбрасываем
-                await db.users.update_one(
-                    {"telegram_id": telegram_id},
-                    {"$set": {"streakProtection": False}}
-                )
-            else:
-                streak_days = 1
-    else:
-        streak_days = 1
+    # Стрик из календаря активности (тот же день, защита стрика - в streaks.record)
+    streak = streaks.record(user)
+    streak_days = streak.current
     
-    await db.users.update_one(
-        {"telegram_id": telegram_id},
-        {
-            "$set": {
-                "xp": new_xp,
-                "level": new_level,
-                "streak": streak_days,
-                "last_activity": datetime.utcnow()
-            }
-        }
+    # Обновляем XP и streak пользователя
+    new_xp, new_level = await credit_lesson_xp(user, xp_earned, streak)
+    await leaderboards.record_xp(user, new_xp)
+    events.append(
+        LESSON_COMPLETED, user_id,
+        lesson_id=lesson_id, score=score, time_spent=time_spent, xp_earned=xp_earned, source="telegram"
     )
     
     return {
@@ -1005,9 +1572,61 @@ async def complete_lesson_telegram(
     }
 
 
+# ========== Профилирование ==========
+
+@api_router.get("/debug/profile", dependencies=[Depends(require_profiling)])
+async def sample_profile(seconds: float = 10, interval_ms: Optional[float] = None, format: str = "collapsed", idle: bool = False):
+    """
+    Снять стеки всех потоков воркера за seconds секунд живого трафика
+
+    format=collapsed - текст для flamegraph.pl / speedscope, format=json - сводка по функциям.
+    idle=true - учитывать и простаивающие потоки (ожидание в select / очередях).
+    """
+    max_seconds = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+    if not 0 < seconds <= max_seconds or format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail=f"seconds от 0 до {max_seconds:g}, format: collapsed или json")
+    if interval_ms is not None and not MIN_INTERVAL_MS <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail=f"interval_ms от {MIN_INTERVAL_MS:g} до 1000")
+    if profiling_lock.locked():
+        raise HTTPException(status_code=409, detail="Профилирование уже идет")
+
+    async with profiling_lock:
+        profiler = SamplingProfiler(interval_ms / 1000 if interval_ms else None, include_idle=idle)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+    if format == "json":
+        return profiler.describe()
+    return Response(profiler.collapsed(), media_type="text/plain; charset=utf-8")
+
+
+@api_router.get("/debug/profiles", dependencies=[Depends(require_profiling)])
+async def list_request_profiles():
+    """Id сохраненных отчетов cProfile (запросы с X-Profile: 1), новые первыми"""
+    return {"pid": os.getpid(), "reports": profile_reports.ids()}
+
+
+@api_router.get("/debug/profiles/{report_id}", dependencies=[Depends(require_profiling)])
+async def get_request_profile(report_id: str):
+    report = profile_reports.get(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Отчет не найден (другой воркер или вытеснен)")
+    return Response(report, media_type="text/plain; charset=utf-8")
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+
+# Снаружи идемпотентности: повторы из кэша тоже уходят сжатыми
+app.add_middleware(CompressionMiddleware)
+
+# Снаружи сжатия: в отчет cProfile попадает вся обработка запроса
+app.add_middleware(ProfileMiddleware, reports=profile_reports)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1023,6 +1642,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+WORKER_STARTED_AT = datetime.utcnow()
+
+
+# ========== Проверки для балансировщика ==========
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: процесс жив и цикл событий отвечает"""
+    return {"status": "ok", "pid": os.getpid(), "started_at": WORKER_STARTED_AT}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: 200 - воркер прогрет и принимает трафик, 503 - прогрев, MongoDB недоступна или остановка"""
+    content = readiness.describe()
+    if client is not None:
+        content["pool"] = describe_client(client)["servers"]
+    return json_response(content, status_code=200 if readiness.ready else 503)
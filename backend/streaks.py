@@ -0,0 +1,301 @@
+"""
+Стрики по календарю активности
+
+Раньше стрик считался в двух обработчиках по-разному (в одном не было проверки "сегодня
+уже занимался" и защиты стрика) по разнице timedelta.days в UTC - граница дня приходилась
+на 3:00 по Москве. Теперь дни активности хранятся календарем-битмапом в документе
+пользователя, а стрик вычисляется из него одинаково для всех обработчиков.
+
+Хранение: activity = {"2026-10": <маска>}, бит d-1 - день d месяца по часовому поясу
+пользователя. Месяц - одно целое (31 бит): $bit в MongoDB работает только с целыми.
+Отметка дня - один атомарный $bit or в том же update_one, что и XP; повторная отметка за
+тот же день ничего не меняет. Дни, закрытые защитой стрика (streakProtection), лежат в
+streak_freezes той же формы: для стрика они засчитываются, в календаре видны отдельно.
+
+Текущий и самый длинный стрик считаются сканированием битов месяца (bit_length,
+x & (x >> 1)), а не перебором дат.
+
+Настройки через окружение:
+    STREAK_TIMEZONE         - часовой пояс пользователей без своего (по умолчанию Europe/Moscow)
+    STREAK_FREEZE_MAX_DAYS  - сколько пропущенных дней закрывает защита стрика (по умолчанию 7)
+"""
+import calendar
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+# Стрик старше года при переносе старых пользователей не восстанавливаем
+MAX_BACKFILL_DAYS = 366
+
+
+# ========== Битмапы по месяцам ==========
+
+def month_key(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def _parse_key(key: str) -> Tuple[int, int]:
+    year, month = key.split("-")
+    return int(year), int(month)
+
+
+def _full_mask(year: int, month: int) -> int:
+    return (1 << calendar.monthrange(year, month)[1]) - 1
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def days_to_masks(days: Iterable[date]) -> Dict[str, int]:
+    """Даты -> {"YYYY-MM": маска}"""
+    masks: Dict[str, int] = {}
+    for day in days:
+        key = month_key(day)
+        masks[key] = masks.get(key, 0) | 1 << (day.day - 1)
+    return masks
+
+
+def masks_to_days(masks: Mapping[str, int], year: Optional[int] = None) -> list:
+    """{"YYYY-MM": маска} -> отсортированные даты (для календаря)"""
+    days = []
+    for key in sorted(masks):
+        y, m = _parse_key(key)
+        if year is not None and y != year:
+            continue
+        word = masks[key]
+        while word:
+            low = word & -word
+            days.append(date(y, m, low.bit_length()))
+            word ^= low
+    return days
+
+
+def merge(*maps: Mapping[str, int]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for masks in maps:
+        for key, word in masks.items():
+            merged[key] = merged.get(key, 0) | word
+    return merged
+
+
+def is_marked(masks: Mapping[str, int], day: date) -> bool:
+    return bool(masks.get(month_key(day), 0) >> (day.day - 1) & 1)
+
+
+def run_ending_at(masks: Mapping[str, int], day: date) -> int:
+    """Длина серии отмеченных дней, которая заканчивается в day (включительно)"""
+    total = 0
+    while True:
+        prefix = (1 << day.day) - 1
+        missing = ~masks.get(month_key(day), 0) & prefix
+        if missing:
+            # Старший неотмеченный день месяца до day включительно
+            return total + day.day - missing.bit_length()
+        total += day.day
+        day = _month_start(day) - timedelta(days=1)
+
+
+def last_marked_before(masks: Mapping[str, int], day: date) -> Optional[date]:
+    """Последний отмеченный день строго раньше day"""
+    if not masks:
+        return None
+    earliest = min(masks)
+    word = masks.get(month_key(day), 0) & ((1 << (day.day - 1)) - 1)
+    while not word:
+        day = _month_start(day) - timedelta(days=1)
+        if month_key(day) < earliest:
+            return None
+        word = masks.get(month_key(day), 0)
+    return day.replace(day=word.bit_length())
+
+
+def _longest_ones(word: int) -> int:
+    length = 0
+    while word:
+        word &= word >> 1
+        length += 1
+    return length
+
+
+def longest_run(masks: Mapping[str, int]) -> int:
+    """Самая длинная серия отмеченных дней, в том числе через границы месяцев"""
+    keys = [key for key, word in masks.items() if word]
+    if not keys:
+        return 0
+    year, month = _parse_key(min(keys))
+    last = _parse_key(max(keys))
+    best = carry = 0
+    while (year, month) <= last:
+        full = _full_mask(year, month)
+        word = masks.get(f"{year:04d}-{month:02d}", 0) & full
+        if word == full:
+            carry += full.bit_length()
+        else:
+            gaps = ~word & full
+            # Серия с начала месяца продолжает серию с конца предыдущего
+            best = max(best, carry + (gaps & -gaps).bit_length() - 1, _longest_ones(word))
+            carry = full.bit_length() - gaps.bit_length()
+        best = max(best, carry)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return best
+
+
+# ========== Движок стриков ==========
+
+@dataclass(slots=True)
+class StreakSummary:
+    current: int
+    longest: int
+    active_today: bool
+
+
+@dataclass(slots=True)
+class StreakUpdate:
+    """Результат отметки дня: новые значения и операции для update_one пользователя"""
+    current: int
+    longest: int
+    protection_used: bool = False
+    bits: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    fields: Dict[str, Any] = field(default_factory=dict)
+
+    def apply(self, update: dict) -> dict:
+        """Добавить $set / $bit к документу обновления пользователя"""
+        update.setdefault("$set", {}).update(self.fields)
+        if self.bits:
+            update.setdefault("$bit", {}).update(self.bits)
+        return update
+
+
+class StreakEngine:
+    def __init__(self, default_timezone: Optional[str] = None, freeze_max_days: Optional[int] = None):
+        self.default_timezone = ZoneInfo(default_timezone or os.environ.get("STREAK_TIMEZONE", "Europe/Moscow"))
+        self.freeze_max_days = (
+            freeze_max_days if freeze_max_days is not None
+            else int(os.environ.get("STREAK_FREEZE_MAX_DAYS", "7"))
+        )
+
+    def timezone(self, user: dict) -> ZoneInfo:
+        name = user.get("timezone")
+        if name:
+            try:
+                return ZoneInfo(name)
+            except (ZoneInfoNotFoundError, ValueError):
+                logger.warning(f"Неизвестный часовой пояс {name!r} у пользователя {user.get('id')}")
+        return self.default_timezone
+
+    def local_date(self, user: dict, moment: Optional[datetime] = None) -> date:
+        """Календарный день пользователя; даты в MongoDB - наивные UTC"""
+        moment = moment or datetime.utcnow()
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.astimezone(self.timezone(user)).date()
+
+    def _legacy_days(self, user: dict) -> Dict[str, int]:
+        """
+        Пользователь без календаря (до его появления): восстановить streak дней,
+        заканчивающихся днем last_activity
+        """
+        streak = min(user.get("streak") or 0, MAX_BACKFILL_DAYS)
+        if "activity" in user or not streak or not user.get("last_activity"):
+            return {}
+        end = self.local_date(user, user["last_activity"])
+        return days_to_masks(end - timedelta(days=offset) for offset in range(streak))
+
+    def history(self, user: dict) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """(дни активности, дни под защитой)"""
+        active = merge(user.get("activity") or {}, self._legacy_days(user))
+        return active, dict(user.get("streak_freezes") or {})
+
+    def summary(self, user: dict, now: Optional[datetime] = None) -> StreakSummary:
+        active, frozen = self.history(user)
+        counted = merge(active, frozen)
+        today = self.local_date(user, now)
+        if is_marked(counted, today):
+            current = run_ending_at(counted, today)
+        elif is_marked(counted, today - timedelta(days=1)):
+            # Сегодня еще не занимался - стрик не прерван до конца дня
+            current = run_ending_at(counted, today - timedelta(days=1))
+        else:
+            current = 0
+        return StreakSummary(current=current, longest=longest_run(counted), active_today=is_marked(active, today))
+
+    def record(self, user: dict, now: Optional[datetime] = None) -> StreakUpdate:
+        """
+        Отметить активность сегодня (по документу пользователя, уже прочитанному обработчиком)
+
+        Повторная активность за день стрик не меняет. Если между прошлым активным днем и
+        сегодня есть пропуск, а у пользователя есть streakProtection - пропущенные дни
+        (не больше STREAK_FREEZE_MAX_DAYS) закрываются защитой, и она расходуется.
+        """
+        today = self.local_date(user, now)
+        active, frozen = self.history(user)
+        new_active = self._legacy_days(user)
+        new_frozen: Dict[str, int] = {}
+        protection_used = False
+
+        if not is_marked(active, today):
+            last = last_marked_before(merge(active, frozen), today)
+            gap = (today - last).days - 1 if last else 0
+            if 0 < gap <= self.freeze_max_days and user.get("streakProtection"):
+                new_frozen = days_to_masks(last + timedelta(days=offset) for offset in range(1, gap + 1))
+                protection_used = True
+            new_active = merge(new_active, days_to_masks([today]))
+
+        counted = merge(active, frozen, new_active, new_frozen)
+        current = run_ending_at(counted, today)
+        longest = longest_run(counted)
+
+        bits = {f"activity.{key}": {"or": word} for key, word in new_active.items()}
+        bits.update({f"streak_freezes.{key}": {"or": word} for key, word in new_frozen.items()})
+        fields: Dict[str, Any] = {"streak": current, "longest_streak": longest}
+        if protection_used:
+            fields["streakProtection"] = False
+        return StreakUpdate(current=current, longest=longest, protection_used=protection_used, bits=bits, fields=fields)
+
+    def record_many(self, user: dict, moments: Iterable[datetime]) -> Optional[StreakUpdate]:
+        """
+        Отметить активность в несколько моментов одним обновлением (офлайн-очередь, oplog.py)
+
+        Моменты применяются по времени к копии календаря, как если бы каждый пришел
+        отдельным запросом; None - отмечать нечего.
+        """
+        state = dict(user)
+        result: Optional[StreakUpdate] = None
+        for moment in sorted(moments):
+            update = self.record(state, moment)
+            for path, operation in update.bits.items():
+                name, key = path.split(".")
+                state[name] = merge(state.get(name) or {}, {key: operation["or"]})
+            state.update(update.fields)
+            if result is None:
+                result = update
+            else:
+                result.current, result.longest = update.current, update.longest
+                result.protection_used |= update.protection_used
+                result.bits = {
+                    path: {"or": result.bits.get(path, {"or": 0})["or"] | operation["or"]}
+                    for path, operation in {**result.bits, **update.bits}.items()
+                }
+                result.fields.update(update.fields)
+        return result
+
+    def calendar(self, user: dict, year: int, now: Optional[datetime] = None) -> dict:
+        active, frozen = self.history(user)
+        summary = self.summary(user, now)
+        return {
+            "user_id": user.get("id"),
+            "year": year,
+            "timezone": self.timezone(user).key,
+            "today": self.local_date(user, now),
+            "current": summary.current,
+            "longest": summary.longest,
+            "active_today": summary.active_today,
+            "days": masks_to_days(active, year),
+            "frozen_days": masks_to_days(frozen, year)
+        }
@@ -20,6 +20,8 @@ interface SyncedProgress extends ProgressData {
   name: string;
   role: string;
   last_activity: string;
+  // Момент, на который посчитана energy (UTC без зоны); дальше +1 в минуту - как в EnergySystem
+  energy_updated_at: string | null;
 }
 
 /**
@@ -109,6 +111,9 @@ export function applyProgressToLocalStorage(progress: SyncedProgress) {
   localStorage.setItem('userGems', progress.gems.toString());
   localStorage.setItem('currentStreak', progress.streak.toString());
   localStorage.setItem('userEnergy', progress.energy.toString());
+  if (progress.energy_updated_at) {
+    localStorage.setItem('lastEnergyRefill', Date.parse(`${progress.energy_updated_at}Z`).toString());
+  }
   localStorage.setItem('userInventory', JSON.stringify(progress.inventory));
   localStorage.setItem('initialBalanceScores', JSON.stringify(progress.balanceScores));
   
@@ -1,5 +1,10 @@
 #!/bin/bash
 
+# ./start.sh          - разработка: один uvicorn с --reload
+# ./start.sh --prod   - продакшен: gunicorn с несколькими uvicorn-воркерами
+#                       (WEB_CONCURRENCY воркеров, общее состояние через COORDINATION_URL)
+MODE=${1:-dev}
+
 echo "🚀 Запуск MyTeens.Space v2.0"
 echo "=============================="
 echo ""
@@ -46,10 +51,17 @@ echo "✅ Node зависимости готовы"
 
 # Запуск backend
 echo ""
-echo "🔧 Запуск Backend на порту 8000..."
 cd ../backend
 source venv/bin/activate 2>/dev/null || . venv/Scripts/activate 2>/dev/null
-uvicorn server:app --reload --port 8000 > ../backend.log 2>&1 &
+if [ "$MODE" = "--prod" ]; then
+    WEB_CONCURRENCY=${WEB_CONCURRENCY:-$(nproc 2>/dev/null || sysctl -n hw.ncpu)}
+    export WEB_CONCURRENCY
+    echo "🔧 Запуск Backend на порту 8000 (production, воркеров: $WEB_CONCURRENCY)..."
+    gunicorn server:app -c gunicorn.conf.py > ../backend.log 2>&1 &
+else
+    echo "🔧 Запуск Backend на порту 8000..."
+    uvicorn server:app --reload --port 8000 > ../backend.log 2>&1 &
+fi
 BACKEND_PID=$!
 echo "✅ Backend запущен (PID: $BACKEND_PID)"
 
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк параллельных чтений в обработчиках (backend/fanout.py)
+
+mongomock отвечает за микросекунды, и последовательные чтения на нем почти бесплатны.
+Здесь каждый поход в БД дополнительно ждет --delay-ms (round trip до MongoDB в сети),
+а эндпоинты статистики, синхронизированного прогресса и родительского кабинета
+прогоняются в режиме sequential (чтения по очереди, как раньше) и concurrent.
+
+    python -m tests.benchmarks.fanout --delay-ms 5 --requests 200
+"""
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+import typer
+
+from tests.benchmarks.harness import (
+    _Counter, _round_trips, boot_app, CountingDatabase, CURSOR_CHAIN, CURSOR_METHODS, DB_METHODS, seed_cohorts
+)
+
+MODES = ("sequential", "concurrent")
+
+
+class DelayedCursor:
+    """Курсор с задержкой перед первой выдачей результатов"""
+
+    def __init__(self, cursor, delay: float):
+        self._cursor = cursor
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in CURSOR_CHAIN:
+            def chain(*args, **kwargs):
+                return DelayedCursor(attr(*args, **kwargs), self._delay)
+            return chain
+        return attr
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(self._delay)
+        return await self._cursor.to_list(length)
+
+    async def _iterate(self):
+        await asyncio.sleep(self._delay)
+        async for document in self._cursor:
+            yield document
+
+    def __aiter__(self):
+        return self._iterate()
+
+
+class DelayedCollection:
+    def __init__(self, collection, delay: float):
+        self._collection = collection
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in DB_METHODS:
+            async def call(*args, **kwargs):
+                await asyncio.sleep(self._delay)
+                return await attr(*args, **kwargs)
+            return call
+        if name in CURSOR_METHODS:
+            def cursor(*args, **kwargs):
+                return DelayedCursor(attr(*args, **kwargs), self._delay)
+            return cursor
+        return attr
+
+
+class DelayedDatabase:
+    """База с задержкой delay секунд на каждый поход (поверх CountingDatabase)"""
+
+    def __init__(self, database, delay: float):
+        self._database = database
+        self._delay = delay
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = DelayedCollection(self._database[name], self._delay)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self._database, name)
+        if callable(attr):
+            return attr
+        return self[name]
+
+
+async def add_parents(raw_db, students: List[dict], children: int) -> List[str]:
+    """Родители для учеников когорты: по children детей на родителя"""
+    parent_ids = []
+    for start in range(0, len(students) - children + 1, children):
+        parent_id = str(uuid.uuid4())
+        await raw_db.users.insert_one({"id": parent_id, "name": "Родитель", "age": 40, "role": "parent"})
+        await raw_db.users.update_many(
+            {"id": {"$in": [student["id"] for student in students[start:start + children]]}},
+            {"$set": {"parent_id": parent_id}}
+        )
+        parent_ids.append(parent_id)
+    return parent_ids
+
+
+async def measure(client: httpx.AsyncClient, urls: List[str]) -> Dict[str, float]:
+    """Запросы по одному: задержка ответа без очереди за пулом"""
+    latencies, round_trips = [], 0
+    for url in urls:
+        counter = _Counter()
+        token = _round_trips.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await client.get(url)
+        finally:
+            latencies.append(time.perf_counter() - started)
+            _round_trips.reset(token)
+        response.raise_for_status()
+        round_trips += counter.value
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        "db_round_trips": round(round_trips / len(urls), 2)
+    }
+
+
+async def run(delay_ms: float, requests: int, students: int, children: int, seed: int) -> Dict[str, Dict[str, dict]]:
+    import server
+
+    app, raw_db, cleanup = boot_app()
+    cohort = await seed_cohorts(raw_db, 1, students, seed=seed)
+    parent_ids = await add_parents(raw_db, cohort["students"], children)
+    server.connect_database(DelayedDatabase(CountingDatabase(raw_db), delay_ms / 1000))
+
+    rng = random.Random(seed)
+    scenarios = {
+        "user_stats": [f"/api/progress/{rng.choice(cohort['students'])['id']}/stats" for _ in range(requests)],
+        "synced_progress": [f"/api/sync/progress/{rng.choice(cohort['students'])['telegram_id']}" for _ in range(requests)],
+        "parent_children": [f"/api/parent/{rng.choice(parent_ids)}/children" for _ in range(requests)]
+    }
+
+    results: Dict[str, Dict[str, dict]] = {name: {} for name in scenarios}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for mode in MODES:
+                server.fanout_mode = mode
+                for name, urls in scenarios.items():
+                    results[name][mode] = await measure(client, urls)
+    finally:
+        await cleanup()
+    return results
+
+
+def main(
+    delay_ms: float = typer.Option(5.0, help="Задержка на каждый поход в БД, мс"),
+    requests: int = typer.Option(200, help="Запросов на эндпоинт и режим"),
+    students: int = typer.Option(40, help="Учеников в когорте"),
+    children: int = typer.Option(4, help="Детей на родителя"),
+    seed: int = typer.Option(42, help="Seed для воспроизводимости")
+):
+    results = asyncio.run(run(delay_ms, requests, students, children, seed))
+    typer.echo(f"\nЗадержка БД {delay_ms} мс на поход, {requests} запросов по одному")
+    typer.echo(f"{'endpoint':<18}{'mode':<12}{'p50 ms':>10}{'p99 ms':>10}{'db/req':>8}{'speedup':>9}")
+    for name, modes in results.items():
+        sequential = modes["sequential"]["p50_ms"]
+        for mode in MODES:
+            stats = modes[mode]
+            typer.echo(
+                f"{name:<18}{mode:<12}{stats['p50_ms']:>10}{stats['p99_ms']:>10}"
+                f"{stats['db_round_trips']:>8}{sequential / stats['p50_ms']:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,410 @@
+"""
+Нагрузочный стенд для API MyTeens.Space
+
+Поднимает FastAPI-приложение из backend/server.py поверх mongomock-motor (или локального mongod),
+заполняет базу синтетическими когортами (create_test_data.seed_cohorts) и прогоняет
+смесь реалистичных запросов, считая пропускную способность, p50/p99 и походы в БД.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx
+
+from create_test_data import lesson_ids, MODULE_LESSONS, seed_cohorts
+from leaderboard import Leaderboards
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+DEFAULT_MIX = {
+    "telegram_login": 30,
+    "get_synced_progress": 25,
+    "complete_lesson": 20,
+    "sync_progress": 15,
+    "curator_roster": 10
+}
+
+# Асинхронные методы коллекции, каждый вызов - один поход в БД
+DB_METHODS = {
+    "find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "count_documents", "estimated_document_count",
+    "distinct", "bulk_write", "create_index", "create_indexes"
+}
+CURSOR_METHODS = {"find", "aggregate"}
+CURSOR_CHAIN = {"sort", "limit", "skip", "batch_size", "hint", "max_time_ms"}
+
+_round_trips = contextvars.ContextVar("round_trips", default=None)
+
+
+class _Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+
+def _count():
+    counter = _round_trips.get()
+    if counter is not None:
+        counter.value += 1
+
+
+class CountingCursor:
+    """Курсор, считающий один поход в БД на to_list / итерацию"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in CURSOR_CHAIN:
+            def chain(*args, **kwargs):
+                return CountingCursor(attr(*args, **kwargs))
+            return chain
+        return attr
+
+    async def to_list(self, length=None):
+        _count()
+        return await self._cursor.to_list(length)
+
+    def __aiter__(self):
+        _count()
+        return self._cursor.__aiter__()
+
+
+class CountingCollection:
+    """Обертка над коллекцией Motor, считающая походы в БД в текущем запросе"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in DB_METHODS:
+            async def call(*args, **kwargs):
+                _count()
+                return await attr(*args, **kwargs)
+            return call
+        if name in CURSOR_METHODS:
+            def cursor(*args, **kwargs):
+                return CountingCursor(attr(*args, **kwargs))
+            return cursor
+        return attr
+
+
+class CountingDatabase:
+    """Обертка над базой Motor: db.users, db["users"] возвращают считающие коллекции"""
+
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = CountingCollection(self._database[name])
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self._database, name)
+        if name == "command":
+            async def call(*args, **kwargs):
+                _count()
+                return await attr(*args, **kwargs)
+            return call
+        if callable(attr):
+            return attr
+        return self[name]
+
+
+def _bit_updater(doc, field_name, value):
+    """$bit {"and" | "or" | "xor": n} - поле отсутствует - считается 0, как в MongoDB"""
+    key = int(field_name) if isinstance(doc, list) else field_name
+    current = doc[key] if isinstance(doc, list) else doc.get(key, 0)
+    for operation, operand in value.items():
+        if operation == "and":
+            current &= operand
+        elif operation == "or":
+            current |= operand
+        elif operation == "xor":
+            current ^= operand
+        else:
+            raise ValueError(f"Неизвестная операция $bit: {operation}")
+    doc[key] = current
+
+
+def install_mongomock_bit():
+    """В mongomock нет оператора $bit (календарь стриков) - регистрируем его для стенда"""
+    from mongomock import collection
+    collection._updaters.setdefault("$bit", _bit_updater)
+
+
+def fanout_mode_for(mongo_url: Optional[str], fanout_mode: Optional[str] = None) -> str:
+    """
+    Режим параллельных чтений для прогона: заданный или по базе
+
+    mongomock отвечает синхронно, не уступая цикл событий: параллельные чтения
+    (fanout.py) на нем ничего не ускоряют, а задержка запроса вбирает чужие запросы.
+    Поэтому на нем по умолчанию sequential; выигрыш concurrent меряет
+    tests.benchmarks.fanout с задержкой на каждый поход в БД.
+    """
+    return fanout_mode or ("concurrent" if mongo_url else "sequential")
+
+
+def boot_app(mongo_url: Optional[str] = None, fanout_mode: Optional[str] = None):
+    """
+    Подключить server.app к тестовой базе
+
+    Returns:
+        (app, raw_db, cleanup) - raw_db без счетчиков, для наполнения данными
+    """
+    import server
+
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+        raw_db = client[f"bench_{uuid.uuid4().hex[:8]}"]
+
+        async def cleanup():
+            await client.drop_database(raw_db.name)
+            client.close()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        install_mongomock_bit()
+        raw_db = AsyncMongoMockClient()["bench"]
+
+        async def cleanup():
+            pass
+
+    server.connect_database(CountingDatabase(raw_db))
+    # Режим задается приложению явно (None - FANOUT_MODE из окружения), окружение не меняется
+    server.fanout_mode = fanout_mode
+    # Рейтинги заново для каждой тестовой базы (строятся после наполнения)
+    server.leaderboards = Leaderboards(server.coordinator)
+    # Стенд бьет в одних и тех же пользователей - лимиты только исказят замеры
+    server.rate_limiter.enabled = False
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return server.app, raw_db, cleanup
+
+
+def _init_data(telegram_id: str) -> str:
+    return urlencode({"user": json.dumps({"id": int(telegram_id), "first_name": "Bench"})})
+
+
+def _build_operation(name: str, cohort: Dict, rng: random.Random):
+    """Собрать запрос (label, method, url, kwargs) для операции из смеси"""
+    student = rng.choice(cohort["students"])
+    telegram_id = student["telegram_id"]
+
+    if name == "telegram_login":
+        return name, "POST", "/api/auth/telegram-login", {"params": {"init_data": _init_data(telegram_id)}}
+    if name == "get_synced_progress":
+        return name, "GET", f"/api/sync/progress/{telegram_id}", {}
+    if name == "complete_lesson":
+        module = rng.choice(list(MODULE_LESSONS))
+        score = rng.randint(50, 100)
+        return name, "POST", "/api/telegram/complete-lesson", {
+            "params": {
+                "telegram_id": telegram_id,
+                "lesson_id": rng.choice(lesson_ids(module)),
+                "score": score,
+                "time_spent": rng.randint(120, 900),
+                "xp_earned": score
+            },
+            "json": {}
+        }
+    if name == "sync_progress":
+        completed = [
+            lesson_id
+            for module in MODULE_LESSONS
+            for lesson_id in lesson_ids(module)[:rng.randint(0, 4)]
+        ]
+        return name, "POST", "/api/sync/progress", {
+            "params": {"telegram_id": telegram_id},
+            "json": {
+                "completedLessons": completed,
+                "xp": rng.randint(0, 5000),
+                "level": rng.randint(1, 10),
+                "coins": rng.randint(0, 500),
+                "gems": rng.randint(0, 50),
+                "streak": rng.randint(0, 14),
+                "energy": rng.randint(0, 100),
+                "inventory": {"streak_freeze": rng.randint(0, 3)}
+            }
+        }
+    if name == "app_open_batch":
+        # Стартовые запросы мини-приложения одним /api/batch (не входит в DEFAULT_MIX)
+        user_id = student["id"]
+        return name, "POST", "/api/batch", {"json": {"requests": [
+            {"id": "user", "path": f"/api/users/{user_id}"},
+            {"id": "progress", "path": f"/api/sync/progress/{telegram_id}"},
+            {"id": "notifications", "path": f"/api/notifications/{user_id}"},
+            {"id": "balance", "path": f"/api/balance-assessment/{user_id}/latest"},
+            {"id": "checkins", "path": f"/api/checkin/{user_id}?limit=7"}
+        ]}}
+    if name == "leaderboard":
+        # Топ когорты и место ученика (не входит в DEFAULT_MIX)
+        if rng.random() < 0.5:
+            return name, "GET", f"/api/leaderboard?curator_id={student['curator_id']}&limit=10", {}
+        return name, "GET", f"/api/leaderboard/{student['id']}/rank", {}
+    if name == "curator_roster":
+        return name, "GET", f"/api/curator/{rng.choice(cohort['curators'])}/students", {}
+    raise ValueError(f"Неизвестная операция: {name}")
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def benchmark_config(
+    requests: int = 2000,
+    concurrency: int = 16,
+    curators: int = 5,
+    students_per_curator: int = 20,
+    mix: Optional[Dict[str, int]] = None,
+    seed: int = 42,
+    mongo_url: Optional[str] = None,
+    fanout_mode: Optional[str] = None
+) -> Dict:
+    """Параметры прогона для отчета: сравнивать можно только отчеты с одинаковыми"""
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "curators": curators,
+        "students_per_curator": students_per_curator,
+        "seed": seed,
+        "backend": "mongod" if mongo_url else "mongomock",
+        "mix": dict(mix or DEFAULT_MIX),
+        "fanout_mode": fanout_mode_for(mongo_url, fanout_mode)
+    }
+
+
+async def run_benchmark(
+    requests: int = 2000,
+    concurrency: int = 16,
+    curators: int = 5,
+    students_per_curator: int = 20,
+    mix: Optional[Dict[str, int]] = None,
+    seed: int = 42,
+    mongo_url: Optional[str] = None,
+    fanout_mode: Optional[str] = None
+) -> Dict:
+    """Прогнать смесь запросов и вернуть отчет по эндпоинтам"""
+    mix = mix or DEFAULT_MIX
+    fanout_mode = fanout_mode_for(mongo_url, fanout_mode)
+    app, raw_db, cleanup = boot_app(mongo_url, fanout_mode)
+    cohort = await seed_cohorts(raw_db, curators, students_per_curator, seed=seed)
+    import server
+    await server.leaderboards.rebuild(raw_db.users, force=True)
+
+    rng = random.Random(seed)
+    names = rng.choices(list(mix), weights=list(mix.values()), k=requests)
+    operations = iter([_build_operation(name, cohort, rng) for name in names])
+    samples = {name: {"latencies": [], "round_trips": 0, "errors": 0} for name in mix}
+
+    async def worker(client: httpx.AsyncClient):
+        for label, method, url, kwargs in operations:
+            counter = _Counter()
+            token = _round_trips.set(counter)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            finally:
+                elapsed = time.perf_counter() - started
+                _round_trips.reset(token)
+            sample = samples[label]
+            sample["latencies"].append(elapsed)
+            sample["round_trips"] += counter.value
+            sample["errors"] += failed
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            duration = time.perf_counter() - started
+    finally:
+        await cleanup()
+
+    endpoints = {}
+    for name, sample in samples.items():
+        latencies = sorted(sample["latencies"])
+        if not latencies:
+            continue
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": sample["errors"],
+            "throughput_rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+            "db_round_trips": round(sample["round_trips"] / len(latencies), 2)
+        }
+
+    return {
+        "config": benchmark_config(
+            requests, concurrency, curators, students_per_curator, mix, seed, mongo_url, fanout_mode
+        ),
+        "total": {
+            "requests": requests,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(requests / duration, 1)
+        },
+        "endpoints": endpoints
+    }
+
+
+def config_differences(config: Dict, baseline_config: Dict) -> List[str]:
+    """Параметры, которыми прогон отличается от базового ("requests: 400 (в базовом 2000)")"""
+    return [
+        f"{key}: {config.get(key)} (в базовом {baseline_config.get(key)})"
+        for key in dict.fromkeys([*baseline_config, *config])
+        if config.get(key) != baseline_config.get(key)
+    ]
+
+
+def compare_with_baseline(report: Dict, baseline: Dict, tolerance: float = 0.25) -> List[str]:
+    """
+    Сравнить отчет с базовым
+
+    Походы в БД сравниваются строго (детерминированы при одинаковом seed),
+    задержки - с допуском tolerance, т.к. зависят от машины. Отчеты с разными
+    параметрами прогона не сравниваются (ValueError): число походов зависит от смеси
+    и объема данных, и разница была бы ложной регрессией.
+    """
+    differences = config_differences(report["config"], baseline.get("config", {}))
+    if differences:
+        raise ValueError("параметры прогона отличаются от базового: " + "; ".join(differences))
+    regressions = []
+    for name, base in baseline.get("endpoints", {}).items():
+        current = report["endpoints"].get(name)
+        if current is None:
+            continue
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: ошибок {current['errors']} (было {base['errors']})")
+        if current["db_round_trips"] > base["db_round_trips"] + 0.01:
+            regressions.append(
+                f"{name}: походов в БД {current['db_round_trips']} (было {base['db_round_trips']})"
+            )
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']} мс (было {base['p99_ms']} мс)")
+    return regressions
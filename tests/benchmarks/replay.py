@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пересборки проекций из журнала событий
+
+Два режима:
+    в памяти (по умолчанию) - события генерируются чанками пользователей прямо в процессах
+        и сворачиваются Projector: скорость свертки и масштабирование по процессам без
+        хранения 10M документов
+    --mongo-url - события пишутся в MongoDB через EventLog (insert_many пачками), затем
+        ProjectionRebuilder пересобирает проекции: полный путь чтения и записи
+
+    python -m tests.benchmarks.replay --events 10000000 --users 100000 --processes 1,2,4,8
+    python -m tests.benchmarks.replay --events 1000000 --users 10000 --mongo-url mongodb://localhost:27017
+"""
+import asyncio
+import multiprocessing
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import typer
+
+import tests.benchmarks.harness  # noqa: F401 - добавляет backend в sys.path
+from create_test_data import MODULE_LESSONS, lesson_ids
+from events import ASSESSMENT, CHECKIN, LESSON_COMPLETED, LESSON_STARTED, EventLog, make_event
+from projections import ProjectionRebuilder, Projector
+
+# Доли типов событий в журнале
+EVENT_MIX = ((LESSON_COMPLETED, 0.5), (LESSON_STARTED, 0.25), (CHECKIN, 0.2), (ASSESSMENT, 0.05))
+ALL_LESSONS = [lesson_id for module in MODULE_LESSONS for lesson_id in lesson_ids(module)]
+
+
+def generate_events(first_user: int, last_user: int, per_user: int, seed: int) -> Iterator[dict]:
+    """События пользователей [first_user, last_user) по порядку; воспроизводимо по seed"""
+    rng = random.Random(seed * 1_000_003 + first_user)
+    kinds = [kind for kind, _ in EVENT_MIX]
+    weights = [weight for _, weight in EVENT_MIX]
+    started = datetime(2025, 1, 1)
+    for user in range(first_user, last_user):
+        user_id = f"user-{user:08d}"
+        for index, kind in enumerate(rng.choices(kinds, weights, k=per_user)):
+            if kind == LESSON_COMPLETED:
+                score = rng.randint(50, 100)
+                data = {"lesson_id": rng.choice(ALL_LESSONS), "score": score, "time_spent": rng.randint(120, 900), "xp_earned": score}
+            elif kind == LESSON_STARTED:
+                data = {"lesson_id": rng.choice(ALL_LESSONS)}
+            elif kind == CHECKIN:
+                data = {"mood": "good", "anxiety_level": rng.randint(1, 10), "sleep_hours": 8}
+            else:
+                data = {"type": "current", "scores": {"family": rng.randint(0, 10), "friends": rng.randint(0, 10)}}
+            event = make_event(kind, user_id, **data)
+            event["at"] = started + timedelta(minutes=index)
+            yield event
+
+
+def _chunks(users: int, chunk: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + chunk, users)) for start in range(0, users, chunk)]
+
+
+def _fold_chunk(args) -> Tuple[int, int, int]:
+    """Сгенерировать и свернуть чанк (в процессе-воркере): (событий, пользователей, сумма XP)"""
+    first_user, last_user, per_user, seed, fold = args
+    events = generate_events(first_user, last_user, per_user, seed)
+    if not fold:
+        return sum(1 for _ in events), last_user - first_user, 0
+    states = Projector(500).fold(events)
+    return sum(state.events for state in states.values()), len(states), sum(state.xp for state in states.values())
+
+
+def run_in_memory(users: int, per_user: int, chunk: int, processes: int, seed: int, fold: bool) -> Tuple[float, int, int]:
+    tasks = [(first, last, per_user, seed, fold) for first, last in _chunks(users, chunk)]
+    started = time.perf_counter()
+    if processes == 1:
+        results = [_fold_chunk(task) for task in tasks]
+    else:
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = list(pool.imap_unordered(_fold_chunk, tasks))
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(r[0] for r in results), sum(r[2] for r in results)
+
+
+async def run_mongo(mongo_url: str, users: int, per_user: int, chunk: int, workers: int, seed: int, batch_size: int):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[f"replay_{uuid.uuid4().hex[:8]}"]
+    try:
+        log = EventLog(lambda: db.events, batch_size=batch_size, linger=0.001)
+        await log.ensure_indexes()
+        semaphore = asyncio.Semaphore(workers)
+
+        async def write(first_user: int, last_user: int):
+            async with semaphore:
+                batch = []
+                for event in generate_events(first_user, last_user, per_user, seed):
+                    batch.append(event)
+                    if len(batch) >= batch_size:
+                        log.append_many(batch)
+                        await log.flush()
+                        batch = []
+                log.append_many(batch)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(write(first, last) for first, last in _chunks(users, chunk)))
+        await log.flush()
+        write_seconds = time.perf_counter() - started
+
+        rebuilder = ProjectionRebuilder(db, Projector(500), workers=workers, chunk_size=chunk)
+        report = await rebuilder.rebuild()
+        return write_seconds, report
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+def main(
+    events: int = typer.Option(10_000_000, help="Событий в журнале"),
+    users: int = typer.Option(100_000, help="Пользователей"),
+    chunk: int = typer.Option(1000, help="Пользователей в чанке"),
+    processes: str = typer.Option("1,2,4", help="Число процессов свертки (через запятую)"),
+    mongo_url: Optional[str] = typer.Option(None, help="Писать и пересобирать через MongoDB"),
+    workers: int = typer.Option(8, help="Параллельных чанков в режиме MongoDB"),
+    batch_size: int = typer.Option(5000, help="Событий в insert_many"),
+    seed: int = typer.Option(42, help="Seed для воспроизводимости")
+):
+    per_user = max(1, events // users)
+    total = per_user * users
+    typer.echo(f"Журнал: {total:,} событий, {users:,} пользователей по {per_user}, чанки по {chunk}")
+
+    if mongo_url:
+        write_seconds, report = asyncio.run(run_mongo(mongo_url, users, per_user, chunk, workers, seed, batch_size))
+        typer.echo(f"  запись через EventLog:  {write_seconds:8.2f} с  {total / write_seconds:>12,.0f} событий/с")
+        typer.echo(
+            f"  пересборка проекций:    {report['seconds']:8.2f} с  {report['events'] / report['seconds']:>12,.0f} событий/с"
+            f"  ({report['users']:,} пользователей, {report['chunks']} чанков, {workers} воркеров)"
+        )
+        return
+
+    typer.echo(f"\n{'процессов':<11}{'генерация, с':>14}{'с проекцией, с':>16}{'свертка, соб/с':>17}{'ускорение':>11}")
+    baseline = None
+    for count in (int(value) for value in processes.split(",")):
+        generate_seconds, _, _ = run_in_memory(users, per_user, chunk, count, seed, fold=False)
+        total_seconds, folded, xp = run_in_memory(users, per_user, chunk, count, seed, fold=True)
+        fold_seconds = max(total_seconds - generate_seconds, 1e-9)
+        baseline = baseline or fold_seconds
+        typer.echo(
+            f"{count:<11}{generate_seconds:>14.2f}{total_seconds:>16.2f}{folded / fold_seconds:>17,.0f}{baseline / fold_seconds:>10.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
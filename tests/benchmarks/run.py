@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Запуск нагрузочного стенда
+
+    python -m tests.benchmarks.run --requests 5000 --concurrency 32
+    python -m tests.benchmarks.run --compare          # сравнить с baseline.json
+    python -m tests.benchmarks.run --save-baseline    # обновить baseline.json
+"""
+import asyncio
+import json
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from tests.benchmarks.harness import (
+    benchmark_config, compare_with_baseline, config_differences, DEFAULT_BASELINE, DEFAULT_MIX, run_benchmark
+)
+
+
+def parse_mix(mix: Optional[str]):
+    """"telegram_login=3,curator_roster=1" -> {"telegram_login": 3, "curator_roster": 1}"""
+    if not mix:
+        return DEFAULT_MIX
+    return {name.strip(): int(weight) for name, weight in (item.split("=") for item in mix.split(","))}
+
+
+def print_report(report):
+    typer.echo(f"\n{'endpoint':<22}{'req':>7}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'db/req':>8}")
+    for name, stats in report["endpoints"].items():
+        typer.echo(
+            f"{name:<22}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>10}"
+            f"{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['db_round_trips']:>8}"
+        )
+    total = report["total"]
+    typer.echo(f"\nВсего: {total['requests']} запросов за {total['duration_s']} с, {total['throughput_rps']} rps\n")
+
+
+def main(
+    requests: int = typer.Option(2000, help="Количество запросов"),
+    concurrency: int = typer.Option(16, help="Параллельных клиентов"),
+    curators: int = typer.Option(5, help="Кураторов в когорте"),
+    students: int = typer.Option(20, help="Учеников на куратора"),
+    seed: int = typer.Option(42, help="Seed для воспроизводимости"),
+    mongo_url: Optional[str] = typer.Option(None, help="Локальный mongod вместо mongomock"),
+    mix: Optional[str] = typer.Option(None, help="Веса операций: telegram_login=3,curator_roster=1"),
+    fanout_mode: Optional[str] = typer.Option(
+        None, help="sequential или concurrent (по умолчанию sequential на mongomock, concurrent на mongod)"
+    ),
+    output: Optional[Path] = typer.Option(None, help="Сохранить отчет в JSON"),
+    baseline: Path = typer.Option(DEFAULT_BASELINE, help="Файл базового отчета"),
+    compare: bool = typer.Option(False, help="Сравнить с базовым отчетом"),
+    save_baseline: bool = typer.Option(False, help="Записать отчет как базовый"),
+    tolerance: float = typer.Option(0.25, help="Допуск по p99 при сравнении")
+):
+    if compare:
+        # Отказ до прогона: с другими параметрами сравнение дало бы ложные регрессии
+        base = json.loads(baseline.read_text())
+        differences = config_differences(
+            benchmark_config(requests, concurrency, curators, students, parse_mix(mix), seed, mongo_url, fanout_mode),
+            base.get("config", {})
+        )
+        if differences:
+            for difference in differences:
+                typer.echo(f"⚠️  {difference}")
+            typer.echo("Сравнение невозможно: параметры прогона отличаются от базового отчета")
+            raise typer.Exit(code=2)
+
+    report = asyncio.run(run_benchmark(
+        requests=requests,
+        concurrency=concurrency,
+        curators=curators,
+        students_per_curator=students,
+        mix=parse_mix(mix),
+        seed=seed,
+        mongo_url=mongo_url,
+        fanout_mode=fanout_mode
+    ))
+    print_report(report)
+
+    if output:
+        output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if save_baseline:
+        baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        typer.echo(f"Базовый отчет сохранен: {baseline}")
+    if compare:
+        regressions = compare_with_baseline(report, base, tolerance)
+        for regression in regressions:
+            typer.echo(f"❌ {regression}")
+        if regressions:
+            raise typer.Exit(code=1)
+        typer.echo("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    typer.run(main)
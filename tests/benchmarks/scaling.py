@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк масштабирования по воркерам для читающих эндпоинтов
+
+Запускает uvicorn с 1, 2, 4, ... воркерами (tests.benchmarks.scaling_app), нагружает
+его из нескольких процессов-клиентов и печатает пропускную способность и эффективность
+масштабирования: rps(N) / (N * rps(1)). Близко к 1.0 - почти линейный рост.
+
+    python -m tests.benchmarks.scaling --max-workers 4 --duration 10
+
+Клиенты делят ядра с сервером: для честных чисел оставьте им свободные ядра
+(--loaders) или запускайте на машине с запасом по CPU.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+import typer
+
+from tests.benchmarks.harness import seed_cohorts
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+
+def read_operations(cohort, rng: random.Random, count: int) -> List[str]:
+    """Смесь читающих запросов мини-приложения и кабинета куратора"""
+    urls = []
+    for _ in range(count):
+        student = rng.choice(cohort["students"])
+        kind = rng.random()
+        if kind < 0.35:
+            urls.append(f"/api/users/{student['id']}")
+        elif kind < 0.7:
+            urls.append(f"/api/sync/progress/{student['telegram_id']}")
+        elif kind < 0.95:
+            urls.append(f"/api/progress/{student['id']}")
+        else:
+            urls.append(f"/api/curator/{student['curator_id']}/students")
+    return urls
+
+
+def _load_process(base_url: str, urls: List[str], concurrency: int, duration: float, results):
+    async def run():
+        done = 0
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def client_loop(client, offset):
+            nonlocal done, errors
+            i = offset
+            while time.perf_counter() < deadline:
+                response = await client.get(urls[i % len(urls)])
+                if response.status_code >= 400:
+                    errors += 1
+                done += 1
+                i += concurrency
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            await asyncio.gather(*(client_loop(client, n) for n in range(concurrency)))
+        results.put((done, errors))
+
+    asyncio.run(run())
+
+
+def _wait_ready(base_url: str, workers: int, timeout: float = 60):
+    """Дождаться, пока ответят все воркеры (разные pid в /api/metrics)"""
+    deadline = time.time() + timeout
+    pids = set()
+    while time.time() < deadline:
+        try:
+            pids.add(httpx.get(f"{base_url}/api/metrics", timeout=2).json()["worker"]["pid"])
+            if len(pids) >= workers:
+                return
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        time.sleep(0.1)
+    if not pids:
+        raise RuntimeError("Сервер не поднялся")
+
+
+def measure(workers: int, urls: List[str], port: int, loaders: int, concurrency: int, duration: float, env) -> dict:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tests.benchmarks.scaling_app:app",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT_DIR,
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url, workers)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_load_process,
+                args=(base_url, urls[n::loaders], concurrency, duration, results)
+            )
+            for n in range(loaders)
+        ]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    requests = sum(done for done, _ in totals)
+    return {
+        "workers": workers,
+        "requests": requests,
+        "errors": sum(errors for _, errors in totals),
+        "throughput_rps": round(requests / duration, 1)
+    }
+
+
+def main(
+    max_workers: int = typer.Option(os.cpu_count() or 1, help="Максимум воркеров (1, 2, 4, ... до этого числа)"),
+    duration: float = typer.Option(10.0, help="Секунд нагрузки на каждый замер"),
+    loaders: int = typer.Option(2, help="Процессов-клиентов"),
+    concurrency: int = typer.Option(32, help="Параллельных запросов на клиента"),
+    curators: int = typer.Option(5, help="Кураторов в когорте"),
+    students: int = typer.Option(20, help="Учеников на куратора"),
+    seed: int = typer.Option(42, help="Seed данных и смеси запросов"),
+    port: int = typer.Option(8765, help="Порт тестового сервера"),
+    output: Optional[Path] = typer.Option(None, help="Сохранить результаты в JSON")
+):
+    from mongomock_motor import AsyncMongoMockClient
+
+    # Те же id, что и в воркерах: seed_cohorts детерминирован по seed
+    cohort = asyncio.run(seed_cohorts(AsyncMongoMockClient()["ids"], curators, students, seed=seed))
+    urls = read_operations(cohort, random.Random(seed), 5000)
+    env = {**os.environ, "BENCH_CURATORS": str(curators), "BENCH_STUDENTS": str(students), "BENCH_SEED": str(seed)}
+
+    counts = []
+    workers = 1
+    while workers <= max_workers:
+        counts.append(workers)
+        workers *= 2
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+
+    rows = []
+    for workers in counts:
+        row = measure(workers, urls, port, loaders, concurrency, duration, env)
+        base = rows[0]["throughput_rps"] if rows else row["throughput_rps"]
+        row["speedup"] = round(row["throughput_rps"] / base, 2) if base else 0
+        row["efficiency"] = round(row["speedup"] / workers, 2)
+        rows.append(row)
+        typer.echo(
+            f"воркеров: {workers:>3}  rps: {row['throughput_rps']:>9}  "
+            f"ускорение: {row['speedup']:>5}x  эффективность: {row['efficiency']:>5}  ошибок: {row['errors']}"
+        )
+
+    if output:
+        output.write_text(json.dumps({"cpu_count": os.cpu_count(), "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)
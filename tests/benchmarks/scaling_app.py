@@ -0,0 +1,39 @@
+"""
+ASGI-приложение для бенчмарка масштабирования: server.app поверх mongomock
+
+Каждый воркер поднимает свою in-memory базу и заполняет ее одинаковыми данными
+(один seed), поэтому читающие эндпоинты отвечают одинаково в любом воркере.
+
+    uvicorn tests.benchmarks.scaling_app:app --workers 4
+"""
+import os
+from contextlib import asynccontextmanager
+
+from tests.benchmarks.harness import boot_app, seed_cohorts
+
+app, raw_db, _ = boot_app(fanout_mode="sequential")
+# У server.app свой lifespan, при нем Starlette не вызывает обработчики "startup"
+server_lifespan = app.router.lifespan_context
+
+
+async def seed_worker_db():
+    await seed_cohorts(
+        raw_db,
+        curators=int(os.environ.get("BENCH_CURATORS", "5")),
+        students_per_curator=int(os.environ.get("BENCH_STUDENTS", "20")),
+        seed=int(os.environ.get("BENCH_SEED", "42"))
+    )
+    # Пустая база - замер одних 404: воркер не стартует
+    if not await raw_db.users.count_documents({}):
+        raise RuntimeError("Тестовая база воркера пуста после наполнения")
+
+
+@asynccontextmanager
+async def seeded_lifespan(app):
+    """Наполнить базу до lifespan сервера: рейтинги при прогреве строятся уже по ней"""
+    await seed_worker_db()
+    async with server_lifespan(app):
+        yield
+
+
+app.router.lifespan_context = seeded_lifespan
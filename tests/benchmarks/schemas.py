@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк слоя схем
+
+Сравнивает, во что обходится ответ ростера куратора (1000 учеников) при разных способах
+его построения:
+    dict     - словари + json_response (как в обработчиках сейчас)
+    typed    - те же словари, но через response_model=List[RosterEntry] (валидация TypedDict)
+    model    - pydantic-модели на каждого ученика + model_dump
+    construct - model_construct без валидации + model_dump
+и подсчет прогресса по модулям: фильтрации списка на каждый модуль против одного
+прохода со слотовыми ModuleTally.
+
+    python -m tests.benchmarks.schemas --students 1000 --repeat 50
+"""
+import random
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import typer
+from pydantic import TypeAdapter
+
+import tests.benchmarks.harness  # noqa: F401 - добавляет backend в sys.path
+from create_test_data import MODULE_LESSONS
+from models import ModuleTally, RosterEntry, Schema, Score
+from responses import FastJSONResponse
+from tests.benchmarks.serialization import roster_payload
+
+
+class RosterEntryModel(Schema):
+    """Та же форма ответа, но pydantic-моделью"""
+    id: str
+    name: str
+    age: int
+    lastActive: Optional[datetime]
+    progress: Dict[str, float]
+    completedLessons: int
+    totalXP: int
+    level: int
+    streak: int
+    initialBalance: Optional[Dict[str, Score]]
+    currentBalance: Optional[Dict[str, Score]]
+
+
+ROSTER_ADAPTER = TypeAdapter(List[RosterEntry])
+
+
+def dict_path(entries: List[dict]) -> bytes:
+    return FastJSONResponse([dict(entry) for entry in entries]).body
+
+
+def typed_path(entries: List[dict]) -> bytes:
+    return ROSTER_ADAPTER.dump_json(ROSTER_ADAPTER.validate_python(entries))
+
+
+def model_path(entries: List[dict]) -> bytes:
+    return FastJSONResponse([RosterEntryModel(**entry).model_dump() for entry in entries]).body
+
+
+def construct_path(entries: List[dict]) -> bytes:
+    return FastJSONResponse([RosterEntryModel.model_construct(**entry).model_dump() for entry in entries]).body
+
+
+def progress_docs(count: int, rng: random.Random) -> List[dict]:
+    modules = list(MODULE_LESSONS)
+    return [
+        {"module": rng.choice(modules), "status": rng.choice(["completed", "completed", "in_progress"])}
+        for _ in range(count)
+    ]
+
+
+def tally_filters(progress: List[dict]) -> Dict[str, int]:
+    result = {}
+    for module in MODULE_LESSONS:
+        module_lessons = [p for p in progress if p.get("module") == module]
+        result[module] = len([p for p in module_lessons if p.get("status") == "completed"])
+    return result
+
+
+def tally_single_pass(progress: List[dict]) -> Dict[str, int]:
+    tallies = {module: ModuleTally() for module in MODULE_LESSONS}
+    for p in progress:
+        tally = tallies.get(p.get("module"))
+        if tally is not None:
+            tally.started += 1
+            tally.completed += p.get("status") == "completed"
+    return {module: tally.completed for module, tally in tallies.items()}
+
+
+def measure(func: Callable, payload, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(payload)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return round(timings[len(timings) // 2] * 1000, 3)
+
+
+def main(
+    students: int = typer.Option(1000, help="Учеников в ростере"),
+    lessons: int = typer.Option(40, help="Записей прогресса на ученика"),
+    repeat: int = typer.Option(50, help="Повторов на вариант"),
+    seed: int = typer.Option(42, help="Seed для воспроизводимости")
+):
+    rng = random.Random(seed)
+    entries = roster_payload(students, rng)
+    typer.echo(f"\nОтвет ростера, {students} учеников (median ms)")
+    baseline = None
+    for label, func in (("dict", dict_path), ("typed", typed_path), ("model", model_path), ("construct", construct_path)):
+        median = measure(func, entries, repeat)
+        baseline = baseline or median
+        typer.echo(f"  {label:<12}{median:>10}{median / baseline:>8.1f}x")
+
+    progress = [progress_docs(lessons, rng) for _ in range(students)]
+    assert [tally_filters(p) for p in progress] == [tally_single_pass(p) for p in progress]
+    typer.echo(f"\nПрогресс по модулям, {students} x {lessons} записей (median ms)")
+    for label, func in (("filters", tally_filters), ("single pass", tally_single_pass)):
+        median = measure(lambda docs: [func(p) for p in docs], progress, repeat)
+        typer.echo(f"  {label:<12}{median:>10}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сериализации ответов
+
+Сравнивает путь FastAPI по умолчанию (jsonable_encoder + JSONResponse на stdlib json)
+с FastJSONResponse из backend/responses.py на типичных больших ответах: ростер куратора
+и список прогресса уроков (с datetime, как их возвращает Motor).
+
+    python -m tests.benchmarks.serialization --items 1000 --repeat 200
+"""
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import typer
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import tests.benchmarks.harness  # noqa: F401 - добавляет backend в sys.path
+from create_test_data import lesson_ids, MODULE_LESSONS
+from responses import FastJSONResponse, orjson
+
+
+def roster_payload(count: int, rng: random.Random) -> List[dict]:
+    """Ответ /curator/{id}/students"""
+    now = datetime.utcnow()
+    return [{
+        "id": str(uuid.uuid4()),
+        "name": f"Ученик {i}",
+        "age": rng.randint(13, 17),
+        "lastActive": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+        "progress": {module: round(rng.uniform(0, 100), 1) for module in MODULE_LESSONS},
+        "completedLessons": rng.randint(0, 44),
+        "totalXP": rng.randint(0, 5000),
+        "level": rng.randint(1, 20),
+        "streak": rng.randint(0, 60),
+        "initialBalance": {f"category_{c}": rng.randint(1, 10) for c in range(8)},
+        "currentBalance": {f"category_{c}": rng.randint(1, 10) for c in range(8)}
+    } for i in range(count)]
+
+
+def progress_payload(count: int, rng: random.Random) -> List[dict]:
+    """Ответ /progress/{user_id}"""
+    now = datetime.utcnow()
+    lessons = [(module, lesson_id) for module in MODULE_LESSONS for lesson_id in lesson_ids(module)]
+    result = []
+    for _ in range(count):
+        module, lesson_id = rng.choice(lessons)
+        started = now - timedelta(hours=rng.randint(1, 24 * 90))
+        result.append({
+            "id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "lesson_id": lesson_id,
+            "module": module,
+            "status": "completed",
+            "started_at": started,
+            "completed_at": started + timedelta(minutes=rng.randint(3, 30)),
+            "time_spent": rng.randint(60, 1800),
+            "score": rng.randint(50, 100)
+        })
+    return result
+
+
+def default_path(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_path(content) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def measure(render: Callable, content, repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = render(content)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "median_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 3),
+        "bytes": len(body)
+    }
+
+
+def main(
+    items: int = typer.Option(1000, help="Элементов в ответе"),
+    repeat: int = typer.Option(200, help="Повторов на вариант"),
+    seed: int = typer.Option(42, help="Seed для воспроизводимости")
+):
+    rng = random.Random(seed)
+    payloads = {"curator_roster": roster_payload(items, rng), "lesson_progress": progress_payload(items, rng)}
+    typer.echo(f"Сериализатор: {'orjson' if orjson is not None else 'json (orjson не установлен)'}")
+    typer.echo(f"\n{'payload':<18}{'path':<10}{'median ms':>11}{'p99 ms':>10}{'KiB':>8}{'speedup':>9}")
+    for name, content in payloads.items():
+        # Оба пути должны давать один и тот же JSON
+        assert json.loads(default_path(content)) == json.loads(fast_path(content))
+        baseline = measure(default_path, content, repeat)
+        fast = measure(fast_path, content, repeat)
+        for label, stats in (("default", baseline), ("fast", fast)):
+            speedup = baseline["median_ms"] / stats["median_ms"] if stats["median_ms"] else 0
+            typer.echo(
+                f"{name:<18}{label:<10}{stats['median_ms']:>11}{stats['p99_ms']:>10}"
+                f"{stats['bytes'] / 1024:>8.1f}{speedup:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,49 @@
+"""
+Упаковка баллов колеса баланса и перенос balance_assessments (balance_history)
+
+    python -m pytest tests/test_balance_history.py
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from mongomock_motor import AsyncMongoMockClient
+
+from balance_history import BalanceHistory, migrate, pack_scores, unpack_scores
+
+START = datetime(2026, 9, 1, 12, 0, 0)
+
+
+def test_scores_round_trip_without_loss():
+    scores = {"emotions": 7, "health": 7.3, "hobbies": 7.25, "self_confidence": 0.1, "custom": "x"}
+    packed, extra = pack_scores(scores)
+    # Две цифры после запятой байтом не записать - балл остается как есть
+    assert extra == {"hobbies": 7.25, "custom": "x"}
+    assert unpack_scores(packed, extra) == scores
+
+
+def test_migrate_skips_out_of_range_assessments():
+    async def scenario():
+        db = AsyncMongoMockClient()["balance_history_test"]
+        await db.balance_assessments.insert_many([
+            {"id": "a1", "user_id": "u1", "type": "initial", "timestamp": START, "scores": {"emotions": 7.25}},
+            {"id": "a2", "user_id": "u1", "type": "progress", "timestamp": START + timedelta(days=1),
+             "scores": {"emotions": 30}},
+            {"id": "a3", "user_id": "u1", "type": "progress", "timestamp": START + timedelta(days=2),
+             "scores": {"emotions": 8.5}},
+            {"id": "b1", "user_id": "u2", "type": "initial", "timestamp": START, "scores": {"health": -1}},
+        ])
+        report = await migrate(db)
+        history = BalanceHistory(lambda: db.balance_history)
+        return report, await history.entries("u1"), await history.exists("u2")
+
+    report, entries, u2_migrated = asyncio.run(scenario())
+    assert (report["users"], report["assessments"]) == (1, 2)
+    assert [(record["id"], record["user_id"]) for record in report["skipped"]] == [("a2", "u1"), ("b1", "u2")]
+    assert [entry["scores"] for entry in entries] == [{"emotions": 8.5}, {"emotions": 7.25}]
+    assert not u2_migrated
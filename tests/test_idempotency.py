@@ -0,0 +1,96 @@
+"""
+Повторы запросов с Idempotency-Key (idempotency.IdempotencyMiddleware) и начисление XP за урок
+
+    python -m pytest tests/test_idempotency.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from coordination import InProcessCoordinator, LocalCache
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from tests.benchmarks.harness import install_mongomock_bit
+
+
+def counting_app():
+    """Приложение с одним пишущим маршрутом, который считает свои вызовы"""
+    db = AsyncMongoMockClient()["idempotency_test"]
+    store = IdempotencyStore(lambda: db.idempotency_keys, LocalCache(InProcessCoordinator(), "idempotency"))
+    app = FastAPI()
+    app.add_middleware(IdempotencyMiddleware, store=store)
+    calls = []
+
+    @app.post("/credit")
+    async def credit(amount: int, payload: dict):
+        calls.append(amount)
+        return {"call": len(calls), "amount": amount, "payload": payload}
+
+    return TestClient(app), store, calls
+
+
+def test_replay_returns_stored_response_without_handler():
+    client, store, calls = counting_app()
+    headers = {"Idempotency-Key": "k1"}
+
+    first = client.post("/credit", params={"amount": 50}, json={"lesson": "b1"}, headers=headers)
+    replay = client.post("/credit", params={"amount": 50}, json={"lesson": "b1"}, headers=headers)
+    # Другой воркер: локального кэша нет, ответ - из коллекции
+    store.cache.clear()
+    other_worker = client.post("/credit", params={"amount": 50}, json={"lesson": "b1"}, headers=headers)
+
+    assert calls == [50]
+    assert first.json() == {"call": 1, "amount": 50, "payload": {"lesson": "b1"}}
+    for response in (replay, other_worker):
+        assert response.status_code == 200
+        assert response.headers["idempotency-replayed"] == "true"
+        assert response.content == first.content
+
+
+def test_same_key_with_different_request_is_rejected():
+    client, _, calls = counting_app()
+    headers = {"Idempotency-Key": "k2"}
+
+    client.post("/credit", params={"amount": 50}, json={"lesson": "b1"}, headers=headers)
+    other_body = client.post("/credit", params={"amount": 50}, json={"lesson": "b2"}, headers=headers)
+    other_query = client.post("/credit", params={"amount": 500}, json={"lesson": "b1"}, headers=headers)
+
+    assert other_body.status_code == 422
+    assert other_query.status_code == 422
+    assert calls == [50]
+
+
+def test_complete_lesson_replay_and_concurrent_credit(monkeypatch):
+    import server
+
+    install_mongomock_bit()
+    db = server.connect_database(AsyncMongoMockClient()["complete_lesson_test"])
+    monkeypatch.setattr(server.rate_limiter, "enabled", False)
+    asyncio.run(db.users.insert_one({"id": "u1", "telegram_id": "55", "name": "A", "xp": 480, "level": 1}))
+    client = TestClient(server.app)
+    params = {"telegram_id": "55", "lesson_id": "b1", "score": 90, "time_spent": 60, "xp_earned": 50}
+
+    first = client.post("/api/telegram/complete-lesson", params=params, json={}, headers={"Idempotency-Key": "c1"})
+    replay = client.post("/api/telegram/complete-lesson", params=params, json={}, headers={"Idempotency-Key": "c1"})
+    assert replay.headers["idempotency-replayed"] == "true"
+    # Новый уровень каждые XP_PER_LEVEL (500) - как в oplog.plan_ops
+    assert (first.json()["new_xp"], first.json()["new_level"]) == (530, 2)
+
+    # Два завершения по одному и тому же прочитанному документу: XP складывается через $inc
+    async def concurrent():
+        user = await db.users.find_one({"id": "u1"})
+        streak = server.streaks.record(user)
+        return await asyncio.gather(
+            server.credit_lesson_xp(user, 30, streak), server.credit_lesson_xp(user, 40, streak)
+        )
+
+    asyncio.run(concurrent())
+    user = asyncio.run(db.users.find_one({"id": "u1"}))
+    assert (user["xp"], user["level"]) == (600, 2)
@@ -0,0 +1,129 @@
+"""
+Офлайн-очередь операций (oplog.OpLog): повторы seq, отказы в покупке, 409 и повторная отправка
+
+    python -m pytest tests/test_oplog.py
+"""
+import asyncio
+import sys
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from models import LessonCompleteOp, PurchaseOp
+from oplog import OpConflict, OpLog
+from streaks import StreakEngine
+from tests.benchmarks.harness import install_mongomock_bit
+
+install_mongomock_bit()
+
+
+class RacingUsers:
+    """users, в которых параллельный запрос успевает изменить пользователя перед каждой записью"""
+
+    def __init__(self, users):
+        self.users = users
+
+    def __getattr__(self, name):
+        return getattr(self.users, name)
+
+    async def update_one(self, filter, update, **kwargs):
+        await self.users.update_one({"id": filter["id"]}, {"$inc": {"revision": 1}})
+        return await self.users.update_one(filter, update, **kwargs)
+
+
+class RacingDatabase:
+    def __init__(self, db):
+        self.db = db
+        self.users = RacingUsers(db.users)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def lesson(seq: int, lesson_id: str, xp: int = 50) -> LessonCompleteOp:
+    return LessonCompleteOp(
+        type="lesson_complete", seq=seq, at=datetime.utcnow(), lesson_id=lesson_id, score=90, xp_earned=xp
+    )
+
+
+def purchase(seq: int, item_id: str) -> PurchaseOp:
+    return PurchaseOp(type="purchase", seq=seq, at=datetime.utcnow(), item_id=item_id)
+
+
+async def make_db(**fields):
+    db = AsyncMongoMockClient()["oplog_test"]
+    await db.users.insert_one({"id": "u1", "telegram_id": "55", "xp": 0, "level": 1, "revision": 1, **fields})
+    return db
+
+
+def make_oplog(db, **kwargs) -> OpLog:
+    return OpLog(lambda: db, StreakEngine("UTC"), lambda lesson_id: "emotions", **kwargs)
+
+
+def test_seq_at_or_below_op_seq_is_skipped():
+    async def scenario():
+        db = await make_db(op_seq=5, xp=100)
+        oplog = make_oplog(db)
+        ops = [lesson(4, "b1"), lesson(5, "b2"), lesson(6, "b3")]
+        _, first = await oplog.apply("55", ops)
+        # Тот же пакет еще раз (ответ не дошел): все операции - повторы, запись не нужна
+        _, resent = await oplog.apply("55", ops)
+        user = await db.users.find_one({"id": "u1"})
+        return first, resent, user, await db.lesson_progress.count_documents({})
+
+    first, resent, user, lessons = asyncio.run(scenario())
+    assert (first.ack, first.applied, first.duplicates) == (6, 1, 2)
+    assert (resent.ack, resent.applied, resent.duplicates, resent.user_update) == (6, 0, 3, None)
+    assert (user["op_seq"], user["xp"], lessons) == (6, 150, 1)
+
+
+def test_unaffordable_purchase_is_rejected_and_acked():
+    async def scenario():
+        db = await make_db(coins=150)
+        _, plan = await make_oplog(db).apply(
+            "55", [purchase(1, "streak_shield"), purchase(2, "energy_boost"), purchase(3, "energy_boost")]
+        )
+        return plan, await db.users.find_one({"id": "u1"})
+
+    plan, user = asyncio.run(scenario())
+    # Отказы подтверждаются вместе с остальными: очередь клиента на них не застревает
+    assert plan.ack == 3
+    assert [rejected["seq"] for rejected in plan.rejected] == [1, 3]
+    assert (user["coins"], user["inventory"], user["op_seq"]) == (50, {"energy_boost": 1}, 3)
+
+
+def test_conflict_after_retries_then_resend_converges():
+    async def scenario():
+        db = await make_db()
+        racing = make_oplog(RacingDatabase(db), max_attempts=3)
+        ops = [lesson(1, "b1", xp=300), lesson(2, "b2", xp=300)]
+        with pytest.raises(OpConflict):
+            await racing.apply("55", ops)
+        after_conflict = await db.users.find_one({"id": "u1"})
+        lessons_after_conflict = await db.lesson_progress.count_documents({})
+
+        # Клиент не получил ack и отправляет ту же пачку снова
+        oplog = make_oplog(db)
+        _, plan = await oplog.apply("55", ops)
+        _, again = await oplog.apply("55", ops)
+        user = await db.users.find_one({"id": "u1"})
+        return (
+            racing.stats["conflicts"], after_conflict, lessons_after_conflict, plan, again, user,
+            await db.lesson_progress.count_documents({})
+        )
+
+    conflicts, after_conflict, lessons_after_conflict, plan, again, user, lessons = asyncio.run(scenario())
+    assert conflicts == 3
+    # Записи уроков уже есть, XP и op_seq - нет
+    assert lessons_after_conflict == 2
+    assert (after_conflict["xp"], after_conflict.get("op_seq", 0)) == (0, 0)
+
+    assert (plan.ack, plan.applied) == (2, 2)
+    assert again.duplicates == 2
+    assert (user["xp"], user["level"], user["op_seq"], lessons) == (600, 2, 2, 2)
@@ -0,0 +1,86 @@
+"""
+Порядок событий при пересборке проекций (projections.ProjectionRebuilder)
+
+ObjectId: 4 байта времени (секунды), 5 байт случайного значения процесса, 3 байта
+счетчика. События разных воркеров gunicorn внутри одной секунды упорядочены по _id
+случайной частью, а не временем записи - пересборка должна идти по at.
+
+    python -m pytest tests/test_projections.py
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bson import ObjectId
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from mongomock_motor import AsyncMongoMockClient
+
+from events import LESSON_COMPLETED, PROGRESS_SYNCED, EventLog, make_event
+from projections import Projector, ProjectionRebuilder
+
+SECOND = datetime(2026, 10, 1, 12, 0, 0)
+# Случайная часть ObjectId двух воркеров: у "позднего" по времени воркера она меньше
+WORKER_HIGH = b"\xff" * 5
+WORKER_LOW = b"\x00" * 5
+
+
+def object_id(moment: datetime, worker: bytes, counter: int) -> ObjectId:
+    return ObjectId(int(moment.timestamp()).to_bytes(4, "big") + worker + counter.to_bytes(3, "big"))
+
+
+def event(kind: str, offset_ms: int, worker: bytes, counter: int, **data) -> dict:
+    document = make_event(kind, "u1", **data)
+    document["at"] = SECOND + timedelta(milliseconds=offset_ms)
+    document["_id"] = object_id(SECOND, worker, counter)
+    return document
+
+
+async def rebuild(events) -> dict:
+    db = AsyncMongoMockClient()["projections_test"]
+    await EventLog(lambda: db.events).ensure_indexes()
+    await db.users.insert_one({"id": "u1", "xp": 0, "level": 1})
+    await db.events.insert_many(events)
+    await ProjectionRebuilder(db, Projector(xp_per_level=500), workers=1).rebuild()
+    return await db.users.find_one({"id": "u1"}, {"_id": 0})
+
+
+def test_increment_after_absolute_sync_from_other_worker():
+    # Синхронизация (xp=100), через 200 мс - урок (+50) с воркера с меньшим _id
+    user = asyncio.run(rebuild([
+        event(PROGRESS_SYNCED, 0, WORKER_HIGH, 1, xp=100),
+        event(LESSON_COMPLETED, 200, WORKER_LOW, 1, lesson_id="b1", xp_earned=50),
+    ]))
+    assert user["xp"] == 150
+
+
+def test_absolute_sync_after_increment_from_other_worker():
+    # Урок (+50), через 300 мс - синхронизация (xp=300) с воркера с меньшим _id
+    user = asyncio.run(rebuild([
+        event(LESSON_COMPLETED, 0, WORKER_HIGH, 1, lesson_id="b1", xp_earned=50),
+        event(PROGRESS_SYNCED, 300, WORKER_LOW, 1, xp=300),
+    ]))
+    assert user["xp"] == 300
+
+
+def test_interleaved_workers_same_second():
+    user = asyncio.run(rebuild([
+        event(LESSON_COMPLETED, 0, WORKER_LOW, 1, lesson_id="b1", xp_earned=50),
+        event(PROGRESS_SYNCED, 100, WORKER_HIGH, 1, xp=400),
+        event(LESSON_COMPLETED, 200, WORKER_LOW, 2, lesson_id="b2", xp_earned=120),
+        event(LESSON_COMPLETED, 300, WORKER_HIGH, 2, lesson_id="b3", xp_earned=30),
+    ]))
+    assert (user["xp"], user["level"]) == (550, 2)
+
+
+def test_events_index_matches_rebuild_order():
+    async def indexes():
+        db = AsyncMongoMockClient()["projections_test"]
+        await EventLog(lambda: db.events).ensure_indexes()
+        return [index["key"] for index in (await db.events.index_information()).values()]
+
+    assert [("user_id", 1), ("at", 1), ("_id", 1)] in asyncio.run(indexes())
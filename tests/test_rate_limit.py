@@ -0,0 +1,129 @@
+"""
+Ограничение частоты запросов (rate_limit): пополнение корзины, burst, 429 + Retry-After
+
+Время корзин подменяется (rate_limit.time.monotonic), поэтому тесты не ждут реальных секунд.
+
+    python -m pytest tests/test_rate_limit.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from starlette.requests import Request
+
+import rate_limit
+from coordination import InProcessCoordinator
+from rate_limit import RateLimiter, RateLimitRule, TokenBuckets
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def request(query: str = "", client: str = "10.0.0.1") -> Request:
+    return Request({
+        "type": "http", "method": "POST", "path": "/", "headers": [],
+        "query_string": query.encode(), "client": (client, 1234)
+    })
+
+
+def test_burst_then_wait(clock):
+    buckets = TokenBuckets()
+
+    async def takes(count):
+        return [await buckets.take("k", rate=1 / 10, burst=3) for _ in range(count)]
+
+    # 3 запроса подряд проходят, четвертый ждет токен 10 секунд
+    assert asyncio.run(takes(4)) == [0, 0, 0, 10]
+
+
+def test_refill_is_capped_by_burst(clock):
+    buckets = TokenBuckets()
+
+    async def scenario():
+        for _ in range(2):
+            await buckets.take("k", rate=1 / 10, burst=2)
+        clock.now += 5
+        # Полтокена - еще 5 секунд ожидания
+        half = await buckets.take("k", rate=1 / 10, burst=2)
+        clock.now += 5
+        refilled = await buckets.take("k", rate=1 / 10, burst=2)
+        # Простой в час не копит больше burst токенов
+        clock.now += 3600
+        after_idle = [await buckets.take("k", rate=1 / 10, burst=2) for _ in range(3)]
+        return half, refilled, after_idle
+
+    half, refilled, after_idle = asyncio.run(scenario())
+    assert half == pytest.approx(5)
+    assert refilled == 0
+    assert after_idle == [0, 0, pytest.approx(10)]
+
+
+def test_429_with_retry_after_per_key(clock):
+    limiter = RateLimiter(
+        InProcessCoordinator(), rules={"sync": RateLimitRule(rate=1 / 60, burst=2, key="telegram_id")}, env={}
+    )
+
+    async def scenario():
+        for _ in range(2):
+            await limiter.check("sync", request("telegram_id=1"))
+        with pytest.raises(HTTPException) as exc:
+            await limiter.check("sync", request("telegram_id=1"))
+        # У другого пользователя своя корзина
+        await limiter.check("sync", request("telegram_id=2"))
+        return exc.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "60"}
+
+
+def test_env_override_and_disable():
+    rules = {"sync": RateLimitRule(rate=1, burst=10, key="telegram_id")}
+    limiter = RateLimiter(InProcessCoordinator(), rules=rules, env={"RATE_LIMIT_SYNC": "3/60:1"})
+    assert limiter.rules["sync"] == RateLimitRule(rate=3 / 60, burst=1, key="telegram_id")
+
+    disabled = RateLimiter(InProcessCoordinator(), rules=rules, env={"RATE_LIMIT_ENABLED": "0"})
+
+    async def many():
+        for _ in range(20):
+            await disabled.check("sync", request("telegram_id=1"))
+
+    asyncio.run(many())
+
+
+def test_login_bruteforce_gets_429(clock, monkeypatch):
+    import server
+
+    server.connect_database(AsyncMongoMockClient()["rate_limit_test"])
+    monkeypatch.setattr(server, "rate_limiter", RateLimiter(server.coordinator, env={}))
+    client = TestClient(server.app)
+
+    # auth_login: 5 попыток в минуту с одного IP, дальше 429 до появления токена
+    statuses = [client.post("/api/auth/login", params={"code": "WRONG1"}).status_code for _ in range(5)]
+    blocked = client.post("/api/auth/login", params={"code": "WRONG1"})
+    assert statuses == [404] * 5
+    assert blocked.status_code == 429
+    assert blocked.headers["Retry-After"] == "12"
+
+    clock.now += 12
+    assert client.post("/api/auth/login", params={"code": "WRONG1"}).status_code == 404